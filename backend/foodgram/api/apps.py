@@ -4,3 +4,24 @@ from django.apps import AppConfig
 class ApiConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'api'
+
+    def ready(self):
+        from api import signals  # noqa: F401
+        from api import metrics
+        from api.authentication import token_cache
+        from api.compression import compression_stats
+        from api.rate_limiter import get_limiter
+        from api.throttling import throttle_stats
+
+        metrics.register('token_auth', token_cache.stats)
+        metrics.register('http_client', _http_client_metrics)
+        metrics.register('rate_limits', lambda: get_limiter().stats())
+        metrics.register('compression', compression_stats.stats)
+        metrics.register('throttling', throttle_stats.stats)
+
+
+def _http_client_metrics():
+    # Импорт по требованию: requests не грузится при старте процесса
+    from api.http_client import get_client
+
+    return get_client().metrics()
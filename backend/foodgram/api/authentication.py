@@ -0,0 +1,152 @@
+import copy
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from rest_framework.authentication import TokenAuthentication
+
+from api.conditional import bump_on_commit, get_versions
+
+SHARED_KEY = 'auth-{}'
+
+
+def token_resource(key):
+    """Ресурс api.conditional, версия которого меняется при отзыве токена."""
+    return 'token:{}'.format(hashlib.sha256(key.encode()).hexdigest())
+
+
+class TokenCache:
+    """Кэш аутентификации по ключу токена.
+
+    Локальный LRU хранит (user, token) и живёт не дольше ttl секунд, общий
+    кэш Django (shared_ttl > 0) — только пару (user_id, token_created).
+    Каждая запись помечена версией токена из общего кэша; отзыв (выход,
+    смена пароля, is_active) меняет версию, и записи во всех процессах
+    перестают действовать на следующем же запросе.
+    """
+
+    def __init__(self, max_size, ttl, shared_ttl=0):
+        self._max_size = max_size
+        self._ttl = ttl
+        self._shared_ttl = shared_ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {
+            'local_hits': 0,
+            'shared_hits': 0,
+            'misses': 0,
+            'invalidations': 0,
+            'lookups': 0,
+            'lookup_time_total': 0.0,
+            'lookup_time_max': 0.0,
+        }
+
+    @staticmethod
+    def version(key):
+        return get_versions(token_resource(key))[0]
+
+    def get(self, key, version):
+        """(user, token) из локального LRU, если версия не сменилась."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            value, entry_version, expires_at = entry
+            if entry_version == version and time.monotonic() < expires_at:
+                self._entries.move_to_end(key)
+                self._stats['local_hits'] += 1
+                return value
+            del self._entries[key]
+        return None
+
+    def get_shared(self, key, version):
+        """(user_id, token_created) из общего кэша или None."""
+        if self._shared_ttl:
+            value = cache.get(SHARED_KEY.format(token_resource(key)))
+            if value is not None and value[2] == version:
+                with self._lock:
+                    self._stats['shared_hits'] += 1
+                return value[:2]
+        with self._lock:
+            self._stats['misses'] += 1
+        return None
+
+    def set(self, key, user, token, version, shared=True):
+        with self._lock:
+            self._entries[key] = ((user, token), version,
+                                  time.monotonic() + self._ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self._max_size:
+                self._entries.popitem(last=False)
+        if shared and self._shared_ttl:
+            cache.set(SHARED_KEY.format(token_resource(key)),
+                      (user.pk, token.created, version), self._shared_ttl)
+
+    def invalidate(self, key):
+        """Отзыв токена. Версия меняется после коммита: процесс, успевший
+        прочитать из базы старое состояние, не запомнит его под новой
+        версией."""
+        with self._lock:
+            self._entries.pop(key, None)
+            self._stats['invalidations'] += 1
+        bump_on_commit(token_resource(key))
+
+    def observe(self, seconds):
+        with self._lock:
+            self._stats['lookups'] += 1
+            self._stats['lookup_time_total'] += seconds
+            self._stats['lookup_time_max'] = max(
+                self._stats['lookup_time_max'], seconds)
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats, size=len(self._entries))
+        hits = stats['local_hits'] + stats['shared_hits']
+        lookups = stats['lookups']
+        stats['hit_ratio'] = hits / lookups if lookups else 0.0
+        stats['lookup_time_avg'] = (
+            stats['lookup_time_total'] / lookups if lookups else 0.0)
+        return stats
+
+
+token_cache = TokenCache(**settings.TOKEN_AUTH_CACHE)
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    """TokenAuthentication без запроса к authtoken_token на каждый вызов.
+
+    Неверные токены и неактивные пользователи не кэшируются: их проверяет
+    родительский класс. Записи отзываются сигналами из api.signals.
+    """
+
+    def authenticate_credentials(self, key):
+        started = time.perf_counter()
+        try:
+            user, token = self._lookup(key)
+        finally:
+            token_cache.observe(time.perf_counter() - started)
+        return copy.copy(user), token
+
+    def _lookup(self, key):
+        # Версия читается до базы: отзыв, закоммиченный во время запроса,
+        # не даст сохранить прочитанное под новой версией
+        version = token_cache.version(key)
+        cached = token_cache.get(key, version)
+        if cached is not None:
+            return cached
+        shared = token_cache.get_shared(key, version)
+        if shared is not None:
+            user_id, created = shared
+            user = get_user_model().objects.filter(
+                pk=user_id, is_active=True).first()
+            if user is not None:
+                token = self.get_model()(key=key, user=user, created=created)
+                token_cache.set(key, user, token, version, shared=False)
+                return user, token
+        user, token = super().authenticate_credentials(key)
+        token_cache.set(key, user, token, version)
+        return user, token
@@ -0,0 +1,107 @@
+import math
+from collections import Counter
+
+from celery import group, uuid
+from django.conf import settings
+
+from api.cache import (claim_inflight, get_batch, get_cached_result,
+                       get_task_errors, get_task_results, params_key,
+                       release_inflight, split_api_response, store_batch)
+from api.tasks import fetch_batch
+
+
+def split_chunks(items):
+    """Режет элементы на куски так, чтобы сообщений было не больше
+    API_BATCH['max_messages']: маленький пакет — по задаче на элемент."""
+    size = max(1, math.ceil(len(items) / settings.API_BATCH['max_messages']))
+    return [items[start:start + size] for start in range(0, len(items), size)]
+
+
+def submit_batch(api_alias, params_list):
+    """Ставит пакет нормализованных параметров одной группой Celery.
+
+    Одинаковые параметры внутри пакета, уже закэшированные результаты и
+    запросы, которые сейчас выполняет другая задача, новых задач не
+    порождают. Возвращает (batch_id, число поставленных элементов).
+    """
+    item_ids = []
+    seen = {}
+    new_items = []
+    for params in params_list:
+        key = params_key(api_alias, params)
+        if key not in seen:
+            cached = get_cached_result(api_alias, params)
+            if cached is not None:
+                seen[key] = cached['task_id']
+            else:
+                new_id = uuid()
+                seen[key] = claim_inflight(api_alias, params, new_id)
+                if seen[key] == new_id:
+                    new_items.append((new_id, params))
+        item_ids.append(seen[key])
+
+    batch_id = uuid()
+    store_batch(batch_id, api_alias, item_ids, params_list)
+    if new_items:
+        try:
+            group(
+                fetch_batch.s(api_alias, chunk).set(queue=api_alias)
+                for chunk in split_chunks(new_items)
+            ).apply_async()
+        except Exception:
+            for task_id, params in new_items:
+                release_inflight(api_alias, params, task_id)
+            raise
+    return batch_id, len(new_items)
+
+
+def batch_status(batch_id, with_results=True):
+    """Сводный статус пакета или None, если пакет неизвестен.
+
+    Результаты элементов вместе с ответами API и ошибки читаются из кэша
+    двумя запросами.
+    """
+    batch = get_batch(batch_id)
+    if batch is None:
+        return None
+    item_ids = batch['items']
+    unique_ids = list(dict.fromkeys(item_ids))
+    results = get_task_results(unique_ids)
+    errors = get_task_errors(
+        [task_id for task_id in unique_ids if task_id not in results])
+
+    counts = Counter()
+    for task_id in item_ids:
+        if task_id in results:
+            counts['SUCCESS'] += 1
+        elif task_id in errors:
+            counts['FAILURE'] += 1
+        else:
+            counts['PENDING'] += 1
+    payload = {
+        'batch_id': batch_id,
+        'api': batch['api'],
+        'total': len(item_ids),
+        'counts': {state: counts[state]
+                   for state in ('SUCCESS', 'FAILURE', 'PENDING')},
+        'done': not counts['PENDING'],
+    }
+    if not with_results:
+        return payload
+
+    items = []
+    for task_id, params in zip(item_ids, batch['params']):
+        item = {'task_id': task_id, 'params': params}
+        if task_id in results:
+            item['status'] = 'SUCCESS'
+            _, response = split_api_response(results[task_id])
+            if response is not None:
+                item.update(response)
+        elif task_id in errors:
+            item['status'] = 'FAILURE'
+            item['error'] = errors[task_id]
+        else:
+            item['status'] = 'PENDING'
+        items.append(item)
+    payload['results'] = items
+    return payload
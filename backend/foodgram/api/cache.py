@@ -0,0 +1,141 @@
+import hashlib
+import json
+
+from django.conf import settings
+from django.core.cache import cache
+
+API_DEFAULT_PARAMS = {
+    'holidays': {'country': 'US', 'year': 2025, 'month': 12, 'day': 25},
+    'weather': {'query': 'New York'},
+}
+
+RESULT_KEY = 'api-result:{}'
+TASK_KEY = 'api-task:{}'
+INFLIGHT_KEY = 'api-inflight:{}'
+ERROR_KEY = 'api-error:{}'
+BATCH_KEY = 'api-batch:{}'
+
+
+def normalize_params(api_alias, api_params):
+    """Параметры запроса к API с подставленными значениями по умолчанию.
+
+    Лишние ключи отбрасываются, числа приводятся к int, в строках
+    схлопываются пробелы. Бросает ValueError/TypeError на мусоре.
+    """
+    api_params = api_params or {}
+    if not isinstance(api_params, dict):
+        raise TypeError('api_params must be an object')
+    params = {}
+    for name, default in API_DEFAULT_PARAMS[api_alias].items():
+        value = api_params.get(name, default)
+        if isinstance(default, int):
+            value = int(value)
+        else:
+            value = ' '.join(str(value).split())
+        params[name] = value
+    return params
+
+
+def params_key(api_alias, params):
+    """Ключ кэша для нормализованных параметров (без учёта регистра)."""
+    payload = json.dumps(
+        [api_alias, {name: str(value).casefold()
+                     for name, value in params.items()}],
+        sort_keys=True,
+        ensure_ascii=False,
+    )
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+def get_cached_result(api_alias, params):
+    """Запись {'task_id', 'result'} из кэша или None."""
+    return cache.get(RESULT_KEY.format(params_key(api_alias, params)))
+
+
+def get_task_result(task_id):
+    """Результат завершённой задачи по её id или None."""
+    return cache.get(TASK_KEY.format(task_id))
+
+
+def get_task_results(task_ids):
+    """Результаты нескольких задач одним запросом: {task_id: result}."""
+    found = cache.get_many([TASK_KEY.format(task_id) for task_id in task_ids])
+    return {task_id: found[TASK_KEY.format(task_id)] for task_id in task_ids
+            if TASK_KEY.format(task_id) in found}
+
+
+def get_task_error(task_id):
+    """Текст ошибки упавшей задачи или None."""
+    return cache.get(ERROR_KEY.format(task_id))
+
+
+def get_task_errors(task_ids):
+    """Ошибки нескольких задач одним запросом: {task_id: error}."""
+    found = cache.get_many([ERROR_KEY.format(task_id) for task_id in task_ids])
+    return {task_id: found[ERROR_KEY.format(task_id)] for task_id in task_ids
+            if ERROR_KEY.format(task_id) in found}
+
+
+def store_error(task_id, error):
+    cache.set(ERROR_KEY.format(task_id), str(error), settings.API_BATCH['ttl'])
+
+
+def get_batch(batch_id):
+    """Запись пакета {'api', 'items', 'params'} или None."""
+    return cache.get(BATCH_KEY.format(batch_id))
+
+
+def store_batch(batch_id, api_alias, item_ids, params_list):
+    cache.set(BATCH_KEY.format(batch_id), {
+        'api': api_alias,
+        'items': item_ids,
+        'params': params_list,
+    }, settings.API_BATCH['ttl'])
+
+
+def split_api_response(result):
+    """Делит результат задачи внешнего API на сведения о записи и ответ
+    API {'data', 'fetched_at'}; у прочих задач ответа нет — None."""
+    if not isinstance(result, dict) or 'data' not in result:
+        return result, None
+    result = dict(result)
+    return result, {'data': result.pop('data'),
+                    'fetched_at': result.pop('fetched_at', None)}
+
+
+def store_task_result(task_id, result, ttl):
+    """Результат задачи, не связанной с внешним API, для task_status."""
+    cache.set(TASK_KEY.format(task_id), result, ttl)
+
+
+def store_result(api_alias, params, task_id, result):
+    ttl = settings.API_RESULT_CACHE_TTL[api_alias]
+    cache.set_many({
+        RESULT_KEY.format(params_key(api_alias, params)): {
+            'task_id': task_id,
+            'result': result,
+        },
+        TASK_KEY.format(task_id): result,
+    }, ttl)
+
+
+def claim_inflight(api_alias, params, task_id):
+    """Занимает слот выполнения для параметров.
+
+    Возвращает id задачи, которая обслужит запрос: переданный task_id,
+    если слот свободен, иначе id уже выполняющейся задачи.
+    """
+    key = INFLIGHT_KEY.format(params_key(api_alias, params))
+    for _ in range(2):
+        if cache.add(key, task_id, settings.API_INFLIGHT_TTL):
+            return task_id
+        current = cache.get(key)
+        if current:
+            return current
+    return task_id
+
+
+def release_inflight(api_alias, params, task_id):
+    key = INFLIGHT_KEY.format(params_key(api_alias, params))
+    if cache.get(key) == task_id:
+        cache.delete(key)
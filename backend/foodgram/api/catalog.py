@@ -0,0 +1,231 @@
+import fcntl
+import logging
+import mmap
+import os
+import struct
+import threading
+import time
+from array import array
+from bisect import bisect_left
+from contextlib import contextmanager
+
+from django.conf import settings
+
+from api.conditional import bump, get_versions
+from recipes.models import Ingredient
+
+LOGGER = logging.getLogger(__name__)
+
+# Ресурс версии каталога в api.conditional: меняется после коммита
+# правки ингредиентов, чтобы пересборка не прочитала незакоммиченное
+RESOURCE = 'ingredient_catalog'
+
+MAGIC = b'FGIC'
+FORMAT_VERSION = 1
+# метка, версия формата, число ингредиентов, версия данных
+HEADER = struct.Struct('=4sII4xd')
+# смещение и длина названия, смещение и длина единицы в блоке строк
+ENTRY_FIELDS = 4
+
+
+def write_snapshot(path, version):
+    """Пишет снимок каталога рядом с path и атомарно подменяет файл.
+
+    Формат: заголовок, отсортированный массив id (int64), для каждого
+    id четыре uint32 — смещения и длины названия и единицы, затем блок
+    строк UTF-8. Одинаковые единицы измерения хранятся один раз.
+    Процессы, уже открывшие старый файл, дочитывают его без помех.
+    """
+    ids = array('q')
+    entries = array('I')
+    blob = bytearray()
+    units = {}
+    rows = Ingredient.objects.order_by('pk').values_list(
+        'pk', 'name', 'measurement_unit').iterator(chunk_size=5000)
+    for pk, name, unit in rows:
+        encoded = name.encode('utf-8')
+        ids.append(pk)
+        entries.extend((len(blob), len(encoded)))
+        blob += encoded
+        if unit not in units:
+            encoded = unit.encode('utf-8')
+            units[unit] = (len(blob), len(encoded))
+            blob += encoded
+        entries.extend(units[unit])
+    temp_path = f'{path}.{os.getpid()}.tmp'
+    with open(temp_path, 'wb') as file:
+        file.write(HEADER.pack(MAGIC, FORMAT_VERSION, len(ids), version))
+        file.write(ids.tobytes())
+        file.write(entries.tobytes())
+        file.write(blob)
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(temp_path, path)
+    return len(ids)
+
+
+class Snapshot:
+    """Открытый только на чтение снимок: память страниц файла общая для
+    всех процессов узла, копий в куче процесса нет."""
+
+    def __init__(self, path):
+        with open(path, 'rb') as file:
+            self.stat_key = _stat_key(os.fstat(file.fileno()))
+            self._map = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, fmt, count, self.version = HEADER.unpack_from(self._map)
+        if magic != MAGIC or fmt != FORMAT_VERSION:
+            raise ValueError(f'{path} is not an ingredient catalog')
+        view = memoryview(self._map)
+        offset = HEADER.size
+        self._ids = view[offset:offset + count * 8].cast('q')
+        offset += count * 8
+        self._entries = view[offset:offset + count * ENTRY_FIELDS * 4].cast(
+            'I')
+        self._blob = offset + count * ENTRY_FIELDS * 4
+
+    def __len__(self):
+        return len(self._ids)
+
+    def get(self, ingredient_id):
+        """(название, единица) или None."""
+        index = bisect_left(self._ids, ingredient_id)
+        if index == len(self._ids) or self._ids[index] != ingredient_id:
+            return None
+        entry = index * ENTRY_FIELDS
+        name_offset, name_length, unit_offset, unit_length = (
+            self._entries[entry:entry + ENTRY_FIELDS])
+        return (self._string(name_offset, name_length),
+                self._string(unit_offset, unit_length))
+
+    def _string(self, offset, length):
+        start = self._blob + offset
+        return self._map[start:start + length].decode('utf-8')
+
+
+def _stat_key(stat):
+    return stat.st_ino, stat.st_mtime_ns, stat.st_size
+
+
+class IngredientCatalog:
+    """Названия и единицы ингредиентов из общего снимка на диске.
+
+    Не чаще раза в check_interval секунд сверяет версию снимка с версией
+    ресурса в кэше. Устаревший снимок пересобирает один процесс узла
+    под эксклюзивным flock, остальные после этого просто переоткрывают
+    файл. Ингредиентов, которых в снимке ещё нет, добирает из базы.
+    """
+
+    def __init__(self, path, check_interval=1.0):
+        self._path = path
+        self._lock_path = f'{path}.lock'
+        self._check_interval = check_interval
+        self._snapshot = None
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    def get(self, ingredient_id):
+        return self.get_many([ingredient_id]).get(ingredient_id)
+
+    def get_many(self, ingredient_ids):
+        """{id: (название, единица)} для найденных ингредиентов."""
+        snapshot = self.snapshot()
+        found = {}
+        missing = []
+        for ingredient_id in ingredient_ids:
+            item = snapshot.get(ingredient_id)
+            if item is None:
+                missing.append(ingredient_id)
+            else:
+                found[ingredient_id] = item
+        if missing:
+            found.update(
+                (pk, (name, unit))
+                for pk, name, unit in Ingredient.objects.filter(
+                    pk__in=missing).values_list(
+                    'pk', 'name', 'measurement_unit'))
+        return found
+
+    def existing(self, ingredient_ids):
+        """Какие из ingredient_ids есть в базе — проверка перед записью.
+
+        Снимок, отставший от версии ресурса в кэше, мог сохранить уже
+        удалённый ингредиент, поэтому тогда отвечает база.
+        """
+        if self.snapshot().version < get_versions(RESOURCE)[0]:
+            return set(Ingredient.objects.filter(
+                pk__in=ingredient_ids).values_list('pk', flat=True))
+        return set(self.get_many(ingredient_ids))
+
+    def snapshot(self):
+        """Текущий Snapshot; при необходимости пересобирается."""
+        now = time.monotonic()
+        if self._snapshot is None or now - self._checked_at >= (
+                self._check_interval):
+            with self._lock:
+                if self._snapshot is None or now - self._checked_at >= (
+                        self._check_interval):
+                    self._refresh()
+                    self._checked_at = now
+        return self._snapshot
+
+    def rebuild(self):
+        """Пересобирает снимок по базе и отмечает новую версию."""
+        with self._locked():
+            version = get_versions(RESOURCE)[0]
+            count = write_snapshot(self._path, version)
+        LOGGER.info('Ingredient catalog rebuilt: %s items', count)
+        return count
+
+    def _refresh(self):
+        version = get_versions(RESOURCE)[0]
+        self._reopen()
+        if self._snapshot is not None and self._snapshot.version >= version:
+            return
+        with self._locked():
+            # Пока ждали блокировку, снимок мог собрать сосед
+            self._reopen()
+            if self._snapshot is None or self._snapshot.version < version:
+                write_snapshot(self._path, version)
+                self._reopen()
+
+    def _reopen(self):
+        try:
+            stat_key = _stat_key(os.stat(self._path))
+        except FileNotFoundError:
+            self._snapshot = None
+            return
+        if self._snapshot is None or self._snapshot.stat_key != stat_key:
+            # Старый mmap закроется сборщиком мусора, когда на него
+            # перестанут ссылаться потоки, которые ещё читают
+            self._snapshot = Snapshot(self._path)
+
+    @contextmanager
+    def _locked(self):
+        with open(self._lock_path, 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def catalog_changed():
+    """Отмечает правку ингредиентов; снимки пересоберутся при обращении."""
+    bump(RESOURCE)
+
+
+_catalog = None
+_catalog_lock = threading.Lock()
+
+
+def get_catalog():
+    """IngredientCatalog процесса, создаётся при первом обращении."""
+    global _catalog
+    if _catalog is None:
+        with _catalog_lock:
+            if _catalog is None:
+                _catalog = IngredientCatalog(**settings.INGREDIENT_CATALOG)
+    return _catalog
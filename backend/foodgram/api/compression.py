@@ -0,0 +1,167 @@
+import threading
+import time
+import zlib
+
+import brotli
+from django.conf import settings
+from django.utils.cache import patch_vary_headers
+from django.utils.deprecation import MiddlewareMixin
+
+# Только ответы API. HTML админки со сжатием не отдаётся: в нём
+# CSRF-токен рядом с отражёнными параметрами запроса (атака BREACH)
+COMPRESSIBLE_TYPES = (
+    'application/json',
+    'application/x-ndjson',
+)
+
+# При равном q выбирается кодировка левее
+ENCODINGS = ('br', 'gzip')
+
+
+class CompressionStats:
+    """Счётчики сжатия по кодировкам: объём до и после, процессорное
+    время на сжатие. Для подбора уровней COMPRESSION['levels']."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stats = {}
+
+    def observe(self, encoding, size_in, size_out, cpu_time):
+        with self._lock:
+            stats = self._stats.setdefault(encoding, {
+                'responses': 0,
+                'bytes_in': 0,
+                'bytes_out': 0,
+                'cpu_time_total': 0.0,
+            })
+            stats['responses'] += 1
+            stats['bytes_in'] += size_in
+            stats['bytes_out'] += size_out
+            stats['cpu_time_total'] += cpu_time
+
+    def stats(self):
+        with self._lock:
+            return {
+                encoding: dict(
+                    stats,
+                    cpu_time_total=round(stats['cpu_time_total'], 4),
+                    ratio=round(stats['bytes_out'] / stats['bytes_in'], 3)
+                    if stats['bytes_in'] else 0.0,
+                    cpu_time_avg=round(
+                        stats['cpu_time_total'] / stats['responses'], 6),
+                )
+                for encoding, stats in self._stats.items()
+            }
+
+
+compression_stats = CompressionStats()
+
+
+def accepted_encoding(header):
+    """br или gzip с наибольшим q из Accept-Encoding, иначе None.
+
+    Кодировка с q=0 не выбирается, в том числе через '*'.
+    """
+    accepted = {}
+    for item in header.split(','):
+        coding, *params = item.split(';')
+        quality = 1.0
+        for param in params:
+            name, _, value = param.strip().partition('=')
+            if name.strip().lower() == 'q':
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        coding = coding.strip().lower()
+        if coding:
+            accepted[coding] = quality
+    default = accepted.get('*', 0.0)
+    best = max(ENCODINGS, key=lambda coding: accepted.get(coding, default))
+    return best if accepted.get(best, default) > 0 else None
+
+
+def compressor(encoding):
+    """Объект с compress(data) и flush() для потокового сжатия."""
+    level = settings.COMPRESSION['levels'][encoding]
+    if encoding == 'gzip':
+        return zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    return _BrotliCompressor(level)
+
+
+class _BrotliCompressor:
+    def __init__(self, quality):
+        self._compressor = brotli.Compressor(quality=quality)
+
+    def compress(self, data):
+        return self._compressor.process(data)
+
+    def flush(self):
+        return self._compressor.finish()
+
+
+class CompressionMiddleware(MiddlewareMixin):
+    """Сжимает ответы gzip или brotli по Accept-Encoding.
+
+    Обычный ответ сжимается, только если он не меньше
+    COMPRESSION['min_size'] и сжатие действительно уменьшило его;
+    потоковый — по типу содержимого, кусками по мере отдачи. ETag
+    становится слабым, как у GZipMiddleware: байты тела другие.
+    """
+
+    def process_response(self, request, response):
+        if response.has_header('Content-Encoding'):
+            return response
+        content_type = response.get('Content-Type', '').lower()
+        if not content_type.startswith(COMPRESSIBLE_TYPES):
+            return response
+        if (not response.streaming
+                and len(response.content) < settings.COMPRESSION['min_size']):
+            return response
+        patch_vary_headers(response, ('Accept-Encoding',))
+        encoding = accepted_encoding(
+            request.META.get('HTTP_ACCEPT_ENCODING', ''))
+        if encoding is None:
+            return response
+
+        if response.streaming:
+            response.streaming_content = self._compress_stream(
+                encoding, response.streaming_content)
+            del response.headers['Content-Length']
+        else:
+            started = time.thread_time()
+            engine = compressor(encoding)
+            content = engine.compress(response.content) + engine.flush()
+            cpu_time = time.thread_time() - started
+            if len(content) >= len(response.content):
+                return response
+            compression_stats.observe(encoding, len(response.content),
+                                      len(content), cpu_time)
+            response.content = content
+            response['Content-Length'] = str(len(content))
+
+        etag = response.get('ETag')
+        if etag and etag.startswith('"'):
+            response['ETag'] = 'W/' + etag
+        response['Content-Encoding'] = encoding
+        return response
+
+    @staticmethod
+    def _compress_stream(encoding, chunks):
+        engine = compressor(encoding)
+        size_in = size_out = 0
+        cpu_time = 0.0
+        for chunk in chunks:
+            started = time.thread_time()
+            data = engine.compress(chunk)
+            cpu_time += time.thread_time() - started
+            size_in += len(chunk)
+            size_out += len(data)
+            if data:
+                yield data
+        started = time.thread_time()
+        data = engine.flush()
+        cpu_time += time.thread_time() - started
+        size_out += len(data)
+        compression_stats.observe(encoding, size_in, size_out, cpu_time)
+        yield data
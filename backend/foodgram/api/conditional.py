@@ -0,0 +1,91 @@
+import functools
+import hashlib
+import time
+
+from django.core.cache import cache
+from django.db import transaction
+from django.utils.cache import get_conditional_response, patch_vary_headers
+from django.utils.http import http_date, quote_etag
+
+VERSION_KEY = 'resource-version:{}'
+
+
+def viewer_resource(user):
+    """Версия данных, от которых зависят флаги конкретного зрителя."""
+    return f'viewer:{user.pk}' if user.is_authenticated else 'viewer:anon'
+
+
+def bump(*resources):
+    """Отмечает изменение ресурсов: версия — время изменения."""
+    now = time.time()
+    cache.set_many(
+        {VERSION_KEY.format(resource): now for resource in resources}, None)
+
+
+def bump_on_commit(*resources):
+    """bump после коммита текущей транзакции: читатель, пришедший до
+    коммита, не получит новый ETag со старым телом."""
+    transaction.on_commit(functools.partial(bump, *resources))
+
+
+def get_versions(*resources):
+    """Версии ресурсов. Потерянная из кэша версия считается текущим
+    моментом, так что вытеснение даёт лишний промах, а не ложный 304."""
+    keys = {VERSION_KEY.format(resource): resource for resource in resources}
+    found = cache.get_many(keys)
+    missing = [key for key in keys if key not in found]
+    if missing:
+        now = time.time()
+        for key in missing:
+            cache.add(key, now, None)
+        found.update(cache.get_many(missing))
+    return [found.get(key, time.time()) for key in keys]
+
+
+class ConditionalGetMixin:
+    """Отвечает 304 на list/retrieve до выборки и сериализации.
+
+    Наследник задаёт get_validator_parts(): список значений, от которых
+    зависит тело ответа (версии, даты изменения). ETag — хэш этих значений,
+    пользователя и полного пути запроса, Last-Modified — максимум времён.
+    """
+
+    conditional_resources = ()
+
+    def get_validator_parts(self):
+        return get_versions(
+            *self.conditional_resources,
+            viewer_resource(self.request.user),
+        )
+
+    def _conditional(self, handler, request, *args, **kwargs):
+        parts = self.get_validator_parts()
+        if parts is None:
+            return handler(request, *args, **kwargs)
+        user = request.user
+        etag = quote_etag(hashlib.sha1(repr([
+            parts,
+            user.pk if user.is_authenticated else None,
+            request.get_full_path(),
+        ]).encode()).hexdigest())
+        last_modified = int(max(parts))
+
+        not_modified = get_conditional_response(
+            request._request, etag=etag, last_modified=last_modified)
+        if not_modified is not None:
+            patch_vary_headers(not_modified, ('Authorization',))
+            return not_modified
+
+        response = handler(request, *args, **kwargs)
+        if response.status_code == 200:
+            response['ETag'] = etag
+            response['Last-Modified'] = http_date(last_modified)
+            response['Cache-Control'] = 'private, no-cache'
+            patch_vary_headers(response, ('Authorization',))
+        return response
+
+    def list(self, request, *args, **kwargs):
+        return self._conditional(super().list, request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self._conditional(super().retrieve, request, *args, **kwargs)
@@ -0,0 +1,157 @@
+from django.db.models import Prefetch
+from rest_framework import serializers
+from rest_framework.exceptions import NotFound
+
+from recipes.models import (Favorite, Follow, IngredientRecipe, Recipe,
+                            RecipeDocument, ShoppingList)
+
+AUTHOR_FIELDS = ('email', 'id', 'username', 'first_name', 'last_name')
+
+
+def build_document(recipe):
+    """Часть ответа RecipeSerializer, одинаковая для всех зрителей.
+
+    recipe должен прийти с автором и ingredientrecipe_set__ingredient.
+    Картинка хранится относительным url, абсолютным он становится
+    при отдаче, где известен хост запроса.
+    """
+    return {
+        'id': recipe.pk,
+        'author': {field: getattr(recipe.author, field)
+                   for field in AUTHOR_FIELDS},
+        'ingredients': [
+            {
+                'id': item.ingredient.pk,
+                'name': item.ingredient.name,
+                'measurement_unit': item.ingredient.measurement_unit,
+                'amount': item.amount,
+            }
+            for item in recipe.ingredientrecipe_set.all()
+        ],
+        'name': recipe.name,
+        'image': recipe.image.url if recipe.image else None,
+        'text': recipe.text,
+        'cooking_time': recipe.cooking_time,
+    }
+
+
+def build_documents(recipe_ids):
+    """Пересобирает документы рецептов одним проходом: три запроса на
+    выборку и один upsert. Возвращает {recipe_id: документ}."""
+    recipes = Recipe.objects.filter(pk__in=recipe_ids).select_related(
+        'author').prefetch_related(Prefetch(
+            'ingredientrecipe_set',
+            queryset=IngredientRecipe.objects.select_related(
+                'ingredient').order_by('pk'),
+        ))
+    documents = [
+        RecipeDocument(recipe_id=recipe.pk, data=build_document(recipe),
+                       source_updated_at=recipe.updated_at)
+        for recipe in recipes
+    ]
+    RecipeDocument.objects.bulk_create(
+        documents,
+        update_conflicts=True,
+        unique_fields=('recipe',),
+        update_fields=('data', 'source_updated_at'),
+    )
+    return {document.recipe_id: document.data for document in documents}
+
+
+def get_documents(recipes):
+    """Документы для рецептов страницы; устаревшие и отсутствующие
+    пересобираются на месте. Документ свежий, пока его source_updated_at
+    совпадает с updated_at рецепта."""
+    updated_at = {recipe.pk: recipe.updated_at for recipe in recipes}
+    fresh = {
+        recipe_id: data
+        for recipe_id, data, source_updated_at
+        in RecipeDocument.objects.filter(recipe__in=updated_at).values_list(
+            'recipe_id', 'data', 'source_updated_at')
+        if source_updated_at == updated_at[recipe_id]
+    }
+    stale = [recipe_id for recipe_id in updated_at if recipe_id not in fresh]
+    if stale:
+        fresh.update(build_documents(stale))
+    return fresh
+
+
+def viewer_flags(user, recipes, documents):
+    """Множества id избранного, корзины и авторов, на которых подписан
+    зритель. Флаги, уже посчитанные аннотациями queryset, не
+    запрашиваются повторно."""
+    if not user.is_authenticated:
+        return set(), set(), set()
+    recipe_ids = [recipe.pk for recipe in recipes]
+    favorited = {recipe.pk for recipe in recipes
+                 if getattr(recipe, 'is_favorited', False)}
+    if not all(hasattr(recipe, 'is_favorited') for recipe in recipes):
+        favorited = set(Favorite.objects.filter(
+            user=user, recipe__in=recipe_ids).values_list(
+            'recipe_id', flat=True))
+    in_cart = {recipe.pk for recipe in recipes
+               if getattr(recipe, 'is_in_shopping_cart', False)}
+    if not all(hasattr(recipe, 'is_in_shopping_cart') for recipe in recipes):
+        in_cart = set(ShoppingList.objects.filter(
+            user=user, recipe__in=recipe_ids).values_list(
+            'recipe_id', flat=True))
+    author_ids = {document['author']['id']
+                  for document in documents.values()}
+    subscribed = set(Follow.objects.filter(
+        user=user, following__in=author_ids).values_list(
+        'following_id', flat=True))
+    return favorited, in_cart, subscribed
+
+
+def render(document, request, favorited, in_cart, subscribed):
+    """Ответ в формате RecipeSerializer: документ плюс флаги зрителя."""
+    image = document['image']
+    if image and request is not None:
+        image = request.build_absolute_uri(image)
+    return {
+        'id': document['id'],
+        'is_favorited': document['id'] in favorited,
+        'is_in_shopping_cart': document['id'] in in_cart,
+        'author': {
+            **document['author'],
+            'is_subscribed': document['author']['id'] in subscribed,
+        },
+        'ingredients': document['ingredients'],
+        'name': document['name'],
+        'image': image,
+        'text': document['text'],
+        'cooking_time': document['cooking_time'],
+    }
+
+
+def render_many(recipes, request):
+    """Ответы для рецептов в их порядке. Рецепт, удалённый между выборкой
+    страницы и пересборкой документа, пропускается."""
+    recipes = list(recipes)
+    if not recipes:
+        return []
+    documents = get_documents(recipes)
+    user = request.user if request is not None else None
+    flags = viewer_flags(user, recipes, documents) if user else (
+        set(), set(), set())
+    return [render(documents[recipe.pk], request, *flags)
+            for recipe in recipes if recipe.pk in documents]
+
+
+class RecipeDocumentListSerializer(serializers.ListSerializer):
+    def to_representation(self, data):
+        return render_many(data, self.context.get('request'))
+
+
+class RecipeDocumentSerializer(serializers.BaseSerializer):
+    """Чтение рецептов из материализованных документов (RecipeDocument)
+    вместо join рецептов, авторов и ингредиентов на каждый запрос."""
+
+    class Meta:
+        list_serializer_class = RecipeDocumentListSerializer
+
+    def to_representation(self, instance):
+        rendered = render_many([instance], self.context.get('request'))
+        if not rendered:
+            raise NotFound()
+        return rendered[0]
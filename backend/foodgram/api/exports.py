@@ -0,0 +1,144 @@
+import csv
+import gzip
+import tempfile
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.files import File
+from django.core.files.storage import default_storage
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import StreamingHttpResponse
+from django.utils import timezone
+
+from recipes.models import Favorite, Recipe
+from users.models import User
+
+# Имя выгрузки -> модель и колонки (values_list)
+EXPORTS = {
+    'recipes': (Recipe, ('id', 'name', 'author_id', 'author__username',
+                         'cooking_time', 'pub_date', 'updated_at')),
+    'users': (User, ('id', 'username', 'email', 'first_name', 'last_name',
+                     'is_active', 'date_joined', 'last_login')),
+    'favorites': (Favorite, ('id', 'user_id', 'recipe_id')),
+}
+
+FORMATS = {
+    'csv': 'text/csv',
+    'ndjson': 'application/x-ndjson',
+}
+
+
+class _Echo:
+    """Буфер для csv.writer, который просто возвращает строку."""
+
+    def write(self, value):
+        return value
+
+
+def iter_rows(queryset, fields):
+    """Строки выгрузки серверным курсором, по EXPORT['chunk_size']."""
+    return queryset.order_by('pk').values_list(*fields).iterator(
+        chunk_size=settings.EXPORT['chunk_size'])
+
+
+def iter_lines(queryset, fields, fmt):
+    """Строки файла выгрузки: заголовок CSV и по строке на запись."""
+    if fmt == 'csv':
+        writer = csv.writer(_Echo())
+        yield writer.writerow(fields)
+        for row in iter_rows(queryset, fields):
+            yield writer.writerow(row)
+        return
+    encoder = DjangoJSONEncoder(ensure_ascii=False)
+    for row in iter_rows(queryset, fields):
+        yield encoder.encode(dict(zip(fields, row))) + '\n'
+
+
+def stream_response(export_name, queryset, fmt):
+    """Отдаёт выгрузку потоком, не собирая её в памяти."""
+    _, fields = EXPORTS[export_name]
+    response = StreamingHttpResponse(
+        (line.encode('utf-8') for line in iter_lines(queryset, fields, fmt)),
+        content_type=f'{FORMATS[fmt]}; charset=utf-8',
+    )
+    response['Content-Disposition'] = (
+        f'attachment; filename="{export_name}.{fmt}"')
+    return response
+
+
+def write_file(export_name, queryset, fmt, file):
+    """Пишет выгрузку в открытый бинарный файл, сжимая gzip.
+    Возвращает число записей."""
+    _, fields = EXPORTS[export_name]
+    rows = -1 if fmt == 'csv' else 0
+    with gzip.GzipFile(fileobj=file, mode='wb') as archive:
+        for line in iter_lines(queryset, fields, fmt):
+            archive.write(line.encode('utf-8'))
+            rows += 1
+    return rows
+
+
+def save_export(name, export_name, queryset, fmt):
+    """Пишет сжатую выгрузку во временный файл на диске и переносит его
+    в хранилище под именем name. Возвращает число записей."""
+    with tempfile.TemporaryFile() as file:
+        rows = write_file(export_name, queryset, fmt, file)
+        file.seek(0)
+        default_storage.save(name, File(file))
+    return rows
+
+
+def is_large(queryset):
+    """Больше ли записей, чем стоит отдавать прямо из запроса."""
+    limit = settings.EXPORT['inline_max_rows']
+    return queryset[:limit + 1].count() > limit
+
+
+def query_spec(request, queryset):
+    """Описание строк выгрузки для фоновой задачи — только JSON-типы.
+
+    Выбранные в админке строки передаются списком id. Если выбраны все
+    строки списка, передаются его параметры (поиск, фильтры) и
+    пользователь: воркер строит тот же список админки заново.
+    """
+    if request.POST.get('select_across') == '1':
+        return {
+            'user_id': request.user.pk,
+            'params': {key: request.GET.getlist(key) for key in request.GET},
+        }
+    return {'pks': list(queryset.values_list('pk', flat=True))}
+
+
+def spec_queryset(export_name, spec):
+    """Queryset выгрузки по описанию из query_spec."""
+    # Админка и RequestFactory нужны только воркеру с большой выгрузкой
+    from django.contrib import admin
+    from django.test import RequestFactory
+
+    model, _ = EXPORTS[export_name]
+    if 'pks' in spec:
+        return model.objects.filter(pk__in=spec['pks'])
+    request = RequestFactory().get('/', spec['params'])
+    request.user = User.objects.get(pk=spec['user_id'])
+    model_admin = admin.site._registry[model]
+    changelist = model_admin.get_changelist_instance(request)
+    return changelist.get_queryset(request)
+
+
+def artifact_name(task_id, export_name, fmt):
+    return f"{settings.EXPORT['dir']}/{task_id}-{export_name}.{fmt}.gz"
+
+
+def purge_expired():
+    """Удаляет готовые выгрузки старше EXPORT['ttl']."""
+    directory = settings.EXPORT['dir']
+    if not default_storage.exists(directory):
+        return 0
+    cutoff = timezone.now() - timedelta(seconds=settings.EXPORT['ttl'])
+    removed = 0
+    for name in default_storage.listdir(directory)[1]:
+        path = f'{directory}/{name}'
+        if default_storage.get_modified_time(path) < cutoff:
+            default_storage.delete(path)
+            removed += 1
+    return removed
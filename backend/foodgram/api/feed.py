@@ -0,0 +1,170 @@
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Count, Q
+
+from recipes.models import Follow, Recipe, TimelineEntry
+
+POPULAR_KEY = 'feed:popular-authors'
+# Авторы, рецепты которых сейчас не раскладываются; хранится без срока,
+# чтобы при пересчёте заметить тех, кто перестал быть популярным
+PULLED_KEY = 'feed:pulled-authors'
+
+
+def popular_authors():
+    """Авторы, чьи рецепты не раскладываются по лентам, а подмешиваются
+    при чтении. Множество пересчитывается раз в FEED['popular_ttl'].
+
+    Рецепты, вышедшие, пока автор был популярным, есть только в таблице
+    рецептов. Опустившийся ниже порога автор подмешивается дальше, пока
+    фоновая задача не дополнит ленты его подписчиков, иначе эти рецепты
+    пропали бы из ленты.
+    """
+    authors = cache.get(POPULAR_KEY)
+    if authors is None:
+        authors = set(Follow.objects.values('following').annotate(
+            followers=Count('id')).filter(
+            followers__gt=settings.FEED['fanout_max_followers']
+        ).values_list('following', flat=True))
+        demoted = cache.get(PULLED_KEY, set()) - authors
+        authors |= demoted
+        cache.set(POPULAR_KEY, authors, settings.FEED['popular_ttl'])
+        cache.set(PULLED_KEY, authors, None)
+        if demoted:
+            # api.tasks импортирует этот модуль
+            from api.tasks import backfill_demoted_authors
+
+            demoted = sorted(demoted)
+            transaction.on_commit(
+                lambda: backfill_demoted_authors.delay(demoted))
+    return authors
+
+
+def mark_popular(author_id):
+    """Сразу подмешивать автора при чтении, не дожидаясь пересчёта."""
+    authors = popular_authors()
+    if author_id not in authors:
+        cache.set(POPULAR_KEY, authors | {author_id},
+                  settings.FEED['popular_ttl'])
+        cache.set(PULLED_KEY, cache.get(PULLED_KEY, set()) | {author_id},
+                  None)
+
+
+def is_popular(author_id):
+    return Follow.objects.filter(following_id=author_id).count() > (
+        settings.FEED['fanout_max_followers'])
+
+
+def fan_out(recipe):
+    """Раскладывает новый рецепт по лентам подписчиков автора.
+
+    Возвращает число подписчиков, получивших запись, или None, если
+    автор слишком популярен и его рецепты читаются напрямую.
+    """
+    if is_popular(recipe.author_id):
+        mark_popular(recipe.author_id)
+        return None
+    follower_ids = list(Follow.objects.filter(
+        following_id=recipe.author_id).values_list('user_id', flat=True))
+    chunk = settings.FEED['chunk']
+    for start in range(0, len(follower_ids), chunk):
+        TimelineEntry.objects.bulk_create((
+            TimelineEntry(user_id=user_id, recipe_id=recipe.pk,
+                          author_id=recipe.author_id,
+                          pub_date=recipe.pub_date)
+            for user_id in follower_ids[start:start + chunk]
+        ), ignore_conflicts=True)
+    return len(follower_ids)
+
+
+def backfill(user, author):
+    """Последние FEED['backfill'] рецептов автора — в ленту подписчика."""
+    if author.pk in popular_authors():
+        return
+    TimelineEntry.objects.bulk_create((
+        TimelineEntry(user=user, recipe_id=recipe_id, author=author,
+                      pub_date=pub_date)
+        for recipe_id, pub_date in Recipe.objects.filter(
+            author=author).order_by('-pub_date').values_list(
+            'pk', 'pub_date')[:settings.FEED['backfill']]
+    ), ignore_conflicts=True)
+
+
+def backfill_followers(author_id):
+    """Последние FEED['backfill'] рецептов автора, переставшего быть
+    популярным, — в ленты всех его подписчиков; после этого автор больше
+    не подмешивается при чтении. Записи, которые уже есть, не
+    дублируются."""
+    if is_popular(author_id):
+        return 0
+    recipes = list(Recipe.objects.filter(author_id=author_id).order_by(
+        '-pub_date').values_list('pk', 'pub_date')[
+        :settings.FEED['backfill']])
+    follower_ids = list(Follow.objects.filter(
+        following_id=author_id).values_list('user_id', flat=True))
+    chunk = max(1, settings.FEED['chunk'] // max(len(recipes), 1))
+    for start in range(0, len(follower_ids), chunk):
+        TimelineEntry.objects.bulk_create((
+            TimelineEntry(user_id=user_id, recipe_id=recipe_id,
+                          author_id=author_id, pub_date=pub_date)
+            for user_id in follower_ids[start:start + chunk]
+            for recipe_id, pub_date in recipes
+        ), ignore_conflicts=True)
+    cache.set(PULLED_KEY, cache.get(PULLED_KEY, set()) - {author_id}, None)
+    return len(follower_ids)
+
+
+def follow(user, author):
+    """Подписка вместе с наполнением ленты."""
+    with transaction.atomic():
+        item = Follow.objects.create(user=user, following=author)
+        backfill(user, author)
+    return item
+
+
+def unfollow(user, author):
+    """Отписка: рецепты автора уходят из ленты."""
+    with transaction.atomic():
+        Follow.objects.filter(user=user, following=author).delete()
+        TimelineEntry.objects.filter(user=user, author=author).delete()
+
+
+def _keyset(queryset, id_field, position, newer):
+    """Записи по ключу (pub_date, id рецепта) старше position — или
+    новее, если newer, — в порядке удаления от неё."""
+    lookup = 'gt' if newer else 'lt'
+    if position is not None:
+        pub_date, recipe_id = position
+        queryset = queryset.filter(
+            Q(**{f'pub_date__{lookup}': pub_date})
+            | Q(pub_date=pub_date, **{f'{id_field}__{lookup}': recipe_id}))
+    sign = '' if newer else '-'
+    return queryset.order_by(f'{sign}pub_date', f'{sign}{id_field}')
+
+
+def feed_page(user, limit, position=None, newer=False):
+    """Ключи (pub_date, id рецепта) страницы ленты, новые первыми.
+
+    Записи ленты пользователя читаются по индексу (user, pub_date,
+    recipe) с позиции position: limit записей старше неё или, если
+    newer, ближайшие новее. Рецепты популярных авторов, на которых он
+    подписан, выбираются так же отдельным запросом и сливаются с ними.
+    Возвращает ключи и признак, что в ту же сторону есть ещё записи.
+    """
+    keys = set(_keyset(
+        TimelineEntry.objects.filter(user=user), 'recipe_id', position,
+        newer).values_list('pub_date', 'recipe_id')[:limit + 1])
+    popular = popular_authors()
+    if popular:
+        authors = list(Follow.objects.filter(
+            user=user, following__in=popular).values_list(
+            'following_id', flat=True))
+        if authors:
+            keys.update(_keyset(
+                Recipe.objects.filter(author_id__in=authors), 'pk',
+                position, newer).values_list('pub_date', 'pk')[:limit + 1])
+    keys = sorted(keys, reverse=not newer)
+    page = keys[:limit]
+    if newer:
+        page.reverse()
+    return page, len(keys) > limit
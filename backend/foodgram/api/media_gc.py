@@ -0,0 +1,128 @@
+import logging
+import os
+import shutil
+import time
+from collections import Counter
+
+from django.conf import settings
+from django.core.files.storage import default_storage
+
+from recipes.models import Recipe
+
+logger = logging.getLogger(__name__)
+
+MODES = ('dry-run', 'quarantine', 'delete')
+
+
+def iter_files(root):
+    """Обходит дерево через os.scandir без рекурсии и без списка всех
+    файлов в памяти: (путь, stat) по одному."""
+    stack = [root]
+    while stack:
+        try:
+            with os.scandir(stack.pop()) as entries:
+                for entry in entries:
+                    if entry.is_dir(follow_symlinks=False):
+                        stack.append(entry.path)
+                    elif entry.is_file(follow_symlinks=False):
+                        yield entry.path, entry.stat(follow_symlinks=False)
+        except FileNotFoundError:
+            continue
+
+
+def iter_batches(items, size):
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def referenced(names):
+    """Какие из имён файлов записаны в Recipe.image — один запрос."""
+    return set(Recipe.objects.filter(image__in=names).values_list(
+        'image', flat=True))
+
+
+class MediaCollector:
+    """Ищет в каталогах загрузок файлы, на которые не ссылается ни один
+    рецепт, и удаляет их или переносит в карантин.
+
+    Дерево читается потоком, имена сверяются с базой пачками по
+    batch_size, так что память не зависит от числа файлов. Файлы моложе
+    min_age не трогаются: загрузка могла ещё не закоммитить рецепт.
+    После каждой пачки — пауза pause секунд, чтобы не забивать диск.
+    """
+
+    def __init__(self, mode='dry-run', min_age=None, batch_size=None,
+                 pause=None, roots=None, quarantine=None):
+        if mode not in MODES:
+            raise ValueError(f'Unknown mode {mode!r}')
+        options = settings.MEDIA_GC
+        self.mode = mode
+        self.min_age = options['min_age'] if min_age is None else min_age
+        self.batch_size = batch_size or options['batch_size']
+        self.pause = options['pause'] if pause is None else pause
+        self.roots = roots or options['roots']
+        self.quarantine = quarantine or options['quarantine']
+        self.media_root = default_storage.path('')
+
+    def collect(self):
+        """Один проход. Возвращает счётчики: scanned, orphans, removed,
+        bytes, purged (удалено из карантина)."""
+        stats = Counter()
+        cutoff = time.time() - self.min_age
+        for root in self.roots:
+            files = iter_files(os.path.join(self.media_root, root))
+            for batch in iter_batches(files, self.batch_size):
+                self._collect_batch(batch, cutoff, stats)
+                if self.pause:
+                    time.sleep(self.pause)
+        if self.mode != 'dry-run':
+            self._purge_quarantine(stats)
+        logger.info('Media GC (%s): %s', self.mode, dict(stats))
+        return stats
+
+    def _collect_batch(self, batch, cutoff, stats):
+        stats['scanned'] += len(batch)
+        names = {
+            os.path.relpath(path, self.media_root).replace(os.sep, '/'):
+                (path, stat)
+            for path, stat in batch if stat.st_mtime < cutoff
+        }
+        for name in names.keys() - referenced(list(names)):
+            path, stat = names[name]
+            stats['orphans'] += 1
+            stats['bytes'] += stat.st_size
+            if self.mode == 'dry-run':
+                logger.info('Orphan %s', name)
+                continue
+            try:
+                if self.mode == 'delete':
+                    os.remove(path)
+                else:
+                    target = os.path.join(self.media_root, self.quarantine,
+                                          name)
+                    os.makedirs(os.path.dirname(target), exist_ok=True)
+                    shutil.move(path, target)
+                    # Отсчёт срока хранения в карантине
+                    os.utime(target)
+            except FileNotFoundError:
+                continue
+            stats['removed'] += 1
+
+    def _purge_quarantine(self, stats):
+        """Окончательно удаляет файлы, пролежавшие в карантине дольше
+        MEDIA_GC['quarantine_days']."""
+        cutoff = time.time() - settings.MEDIA_GC['quarantine_days'] * 86400
+        root = os.path.join(self.media_root, self.quarantine)
+        for path, stat in iter_files(root):
+            if stat.st_mtime < cutoff:
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    continue
+                stats['purged'] += 1
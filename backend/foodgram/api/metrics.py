@@ -0,0 +1,11 @@
+_collectors = {}
+
+
+def register(name, collector):
+    """Регистрирует источник метрик: collector() возвращает dict."""
+    _collectors[name] = collector
+
+
+def collect():
+    """Снимок метрик текущего процесса по всем источникам."""
+    return {name: collector() for name, collector in _collectors.items()}
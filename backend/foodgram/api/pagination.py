@@ -1,5 +1,89 @@
-from rest_framework.pagination import PageNumberPagination
+import json
+from base64 import b64decode, b64encode
+from datetime import datetime
+
+from django.conf import settings
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination, PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+from api.feed import feed_page
 
 
 class CustomPageNumberPagination(PageNumberPagination):
     page_size_query_param = 'limit'
+
+
+class FeedPagination(BasePagination):
+    """Курсор ленты — ключ (pub_date, id рецепта) крайней записи
+    страницы: следующая читается по индексу ленты с этого места, без
+    OFFSET и COUNT, и не съезжает, когда в ленту приходят новые рецепты.
+    """
+
+    cursor_query_param = 'cursor'
+    page_size = settings.FEED['page_size']
+    page_size_query_param = 'limit'
+    max_page_size = 100
+    invalid_cursor_message = 'Invalid cursor'
+
+    def paginate_feed(self, request, user, recipes):
+        """Рецепты страницы ленты user из queryset recipes по порядку."""
+        self.request = request
+        position, newer = self.decode_cursor(request)
+        keys, more = feed_page(user, self.get_page_size(request),
+                               position, newer)
+        self.next_position = self.previous_position = None
+        if keys:
+            if more or newer:
+                self.next_position = keys[-1]
+            if (more and newer) or (position is not None and not newer):
+                self.previous_position = keys[0]
+        found = recipes.in_bulk([recipe_id for _, recipe_id in keys])
+        return [found[recipe_id] for _, recipe_id in keys
+                if recipe_id in found]
+
+    def get_page_size(self, request):
+        try:
+            size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        return min(size, self.max_page_size) if size > 0 else self.page_size
+
+    def decode_cursor(self, request):
+        """Позиция (pub_date, id рецепта) и направление newer из курсора."""
+        encoded = request.query_params.get(self.cursor_query_param)
+        if encoded is None:
+            return None, False
+        try:
+            newer, pub_date, recipe_id = json.loads(
+                b64decode(encoded.encode('ascii')).decode('ascii'))
+            return (datetime.fromisoformat(pub_date), int(recipe_id)), bool(
+                newer)
+        except (TypeError, ValueError, UnicodeError):
+            raise NotFound(self.invalid_cursor_message)
+
+    def encode_cursor(self, position, newer):
+        pub_date, recipe_id = position
+        encoded = b64encode(json.dumps(
+            [int(newer), pub_date.isoformat(), recipe_id]).encode('ascii'))
+        return replace_query_param(self.request.build_absolute_uri(),
+                                   self.cursor_query_param,
+                                   encoded.decode('ascii'))
+
+    def get_next_link(self):
+        if self.next_position is None:
+            return None
+        return self.encode_cursor(self.next_position, newer=False)
+
+    def get_previous_link(self):
+        if self.previous_position is None:
+            return None
+        return self.encode_cursor(self.previous_position, newer=True)
+
+    def get_paginated_response(self, data):
+        return Response({
+            'next': self.get_next_link(),
+            'previous': self.get_previous_link(),
+            'results': data,
+        })
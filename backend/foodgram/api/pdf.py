@@ -0,0 +1,96 @@
+import hashlib
+import hmac
+import io
+import json
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+
+FONT_NAME = 'ShoppingListFont'
+PAGE_MARGIN = 56
+LINE_HEIGHT = 18
+
+_font_registered = False
+
+
+def cart_digest(rows):
+    """Подпись содержимого корзины: имя готового PDF в хранилище.
+
+    HMAC на SECRET_KEY, а не голый хэш: файлы лежат в медиа, и по
+    известному составу корзины имя файла угадать нельзя.
+    """
+    payload = json.dumps(rows, ensure_ascii=False, separators=(',', ':'))
+    return hmac.new(settings.SECRET_KEY.encode('utf-8'),
+                    payload.encode('utf-8'), hashlib.sha256).hexdigest()
+
+
+def artifact_name(digest):
+    return f"{settings.SHOPPING_PDF['dir']}/{digest}.pdf"
+
+
+def get_artifact(digest):
+    """Имя готового PDF в хранилище или None."""
+    name = artifact_name(digest)
+    return name if default_storage.exists(name) else None
+
+
+def save_artifact(digest, content):
+    """Кладёт PDF в хранилище; файл, который успел записать другой
+    воркер, не дублируется."""
+    name = artifact_name(digest)
+    saved = default_storage.save(name, ContentFile(content))
+    if saved != name:
+        default_storage.delete(saved)
+    return name
+
+
+def _register_font():
+    global _font_registered
+    if _font_registered:
+        return
+    from reportlab.pdfbase import pdfmetrics
+    from reportlab.pdfbase.ttfonts import TTFont
+
+    pdfmetrics.registerFont(TTFont(FONT_NAME, settings.SHOPPING_PDF['font']))
+    _font_registered = True
+
+
+def render_shopping_list(rows):
+    """PDF со списком покупок; rows — список [название, единица, итог].
+
+    reportlab импортируется здесь: модуль нужен и веб-процессу (имена
+    готовых файлов), а рендерит только воркер.
+    """
+    from reportlab.lib.pagesizes import A4
+    from reportlab.pdfgen import canvas
+
+    _register_font()
+    buffer = io.BytesIO()
+    pdf = canvas.Canvas(buffer, pagesize=A4)
+    pdf.setTitle('Список покупок')
+    width, height = A4
+    page = 1
+
+    def start_page():
+        pdf.setFont(FONT_NAME, 9)
+        pdf.drawRightString(width - PAGE_MARGIN, PAGE_MARGIN / 2, str(page))
+        pdf.setFont(FONT_NAME, 12)
+        return height - PAGE_MARGIN
+
+    y = start_page()
+    pdf.setFont(FONT_NAME, 18)
+    pdf.drawString(PAGE_MARGIN, y, 'Список покупок')
+    pdf.setFont(FONT_NAME, 12)
+    y -= LINE_HEIGHT * 2
+    for name, unit, amount in rows:
+        if y < PAGE_MARGIN:
+            pdf.showPage()
+            page += 1
+            y = start_page()
+        pdf.drawString(PAGE_MARGIN, y, f'☐ {name} ({unit})')
+        pdf.drawRightString(width - PAGE_MARGIN, y, str(amount))
+        y -= LINE_HEIGHT
+    pdf.showPage()
+    pdf.save()
+    return buffer.getvalue()
@@ -0,0 +1,166 @@
+import logging
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+
+LOGGER = logging.getLogger(__name__)
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS buckets (
+    name TEXT PRIMARY KEY,
+    tokens REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+'''
+
+
+class RateLimited(Exception):
+    """Ждать токена дольше, чем готов вызывающий."""
+
+    def __init__(self, name, retry_after):
+        super().__init__(f'{name} is rate limited, retry in '
+                         f'{retry_after:.2f} s')
+        self.name = name
+        self.retry_after = retry_after
+
+
+def parse_limits(value):
+    """Разбирает строку 'имя=rate:burst,...' в {имя: (rate, burst)}."""
+    limits = {}
+    for item in filter(None, (part.strip() for part in value.split(','))):
+        name, _, spec = item.partition('=')
+        rate, _, burst = spec.partition(':')
+        limits[name.strip()] = (float(rate), float(burst or 1))
+    return limits
+
+
+class _Stats:
+    __slots__ = ('acquired', 'delayed', 'rejected', 'wait_total', 'wait_max')
+
+    def __init__(self):
+        self.acquired = 0
+        self.delayed = 0
+        self.rejected = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+
+class RateLimiter:
+    """Token bucket на каждый внешний API, общий для всех процессов.
+
+    Ведро пополняется на rate токенов в секунду до burst. Состояние вёдер
+    лежит в файле SQLite и меняется в транзакции BEGIN IMMEDIATE, поэтому
+    все воркеры Celery на хосте берут токены из одних вёдер. Если токенов
+    нет, вызывающий резервирует следующий (ведро уходит в минус) и спит до
+    его появления — ждущие обслуживаются по очереди. Если ждать дольше
+    max_wait, ничего не резервируется и бросается RateLimited, чтобы
+    задачу можно было отложить. API без лимита в limits не ограничиваются.
+    """
+
+    def __init__(self, path, limits, max_wait=5.0):
+        self._path = path
+        self._limits = limits
+        self._max_wait = max_wait
+        self._stats = {}
+        self._stats_lock = threading.Lock()
+        with self._db() as db:
+            db.executescript(SCHEMA)
+
+    @contextmanager
+    def _db(self):
+        db = sqlite3.connect(self._path, timeout=30, isolation_level=None)
+        try:
+            yield db
+        finally:
+            db.close()
+
+    def reserve(self, name, max_wait=None):
+        """Забирает токен и возвращает, сколько секунд ждать до вызова."""
+        if name not in self._limits:
+            return 0.0
+        rate, burst = self._limits[name]
+        max_wait = self._max_wait if max_wait is None else max_wait
+        with self._db() as db:
+            db.execute('BEGIN IMMEDIATE')
+            try:
+                now = time.time()
+                row = db.execute(
+                    'SELECT tokens, updated_at FROM buckets WHERE name = ?',
+                    (name,)).fetchone()
+                tokens = burst if row is None else min(
+                    burst, row[0] + max(0.0, now - row[1]) * rate)
+                wait = 0.0 if tokens >= 1 else (1 - tokens) / rate
+                if wait > max_wait:
+                    db.execute('ROLLBACK')
+                    raise RateLimited(name, wait)
+                db.execute(
+                    'INSERT OR REPLACE INTO buckets (name, tokens, '
+                    'updated_at) VALUES (?, ?, ?)', (name, tokens - 1, now))
+                db.execute('COMMIT')
+            except sqlite3.Error:
+                db.execute('ROLLBACK')
+                raise
+        return wait
+
+    def acquire(self, name, max_wait=None):
+        """Ждёт разрешения на вызов API, возвращает время ожидания."""
+        try:
+            wait = self.reserve(name, max_wait)
+        except RateLimited:
+            self._record(name, rejected=True)
+            raise
+        if wait > 0:
+            LOGGER.debug('Waiting %.3f s for a %s token', wait, name)
+            time.sleep(wait)
+        self._record(name, wait)
+        return wait
+
+    def _record(self, name, wait=0.0, rejected=False):
+        with self._stats_lock:
+            stats = self._stats.setdefault(name, _Stats())
+            if rejected:
+                stats.rejected += 1
+                return
+            stats.acquired += 1
+            if wait > 0:
+                stats.delayed += 1
+                stats.wait_total += wait
+                stats.wait_max = max(stats.wait_max, wait)
+
+    def stats(self):
+        """Статистика ожидания токенов в текущем процессе."""
+        with self._stats_lock:
+            return {
+                name: {
+                    'acquired': stats.acquired,
+                    'delayed': stats.delayed,
+                    'rejected': stats.rejected,
+                    'wait_total': round(stats.wait_total, 3),
+                    'wait_avg': round(stats.wait_total / stats.acquired, 3)
+                    if stats.acquired else 0.0,
+                    'wait_max': round(stats.wait_max, 3),
+                }
+                for name, stats in self._stats.items()
+            }
+
+
+_limiter = None
+_limiter_lock = threading.Lock()
+
+
+def get_limiter():
+    """RateLimiter процесса, создаётся при первом обращении."""
+    global _limiter
+    if _limiter is None:
+        with _limiter_lock:
+            if _limiter is None:
+                config = settings.RATE_LIMITER
+                _limiter = RateLimiter(
+                    path=config['path'],
+                    limits=parse_limits(config['limits']),
+                    max_wait=config['max_wait'],
+                )
+    return _limiter
@@ -0,0 +1,307 @@
+import fcntl
+import json
+import logging
+import os
+import sqlite3
+import struct
+import threading
+import time
+import zlib
+from contextlib import contextmanager
+from pathlib import Path
+
+from django.conf import settings
+
+LOGGER = logging.getLogger(__name__)
+
+# длина сжатого тела записи и его crc32
+RECORD_HEADER = struct.Struct('>II')
+SEGMENT_SUFFIX = '.seg'
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS records (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    api TEXT NOT NULL,
+    params_key TEXT NOT NULL,
+    fetched_at REAL NOT NULL,
+    segment INTEGER NOT NULL,
+    offset INTEGER NOT NULL,
+    length INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS records_lookup
+    ON records (api, params_key, fetched_at);
+CREATE INDEX IF NOT EXISTS records_segment ON records (segment);
+'''
+
+
+class CorruptRecordError(Exception):
+    """Запись на диске не сходится с контрольной суммой."""
+
+
+def params_key(params):
+    return json.dumps(params or {}, sort_keys=True, ensure_ascii=False)
+
+
+class ResultsStore:
+    """Хранилище ответов внешних API с дозаписью в сегменты.
+
+    Записи — сжатый zlib JSON в пронумерованных файлах-сегментах, индекс
+    SQLite сопоставляет (api, params, fetched_at) смещению в сегменте.
+    Писатели берут эксклюзивный flock, читатели — разделяемый, так что
+    каталог можно делить между процессами. Запись попадает в индекс только
+    после fsync, а уплотнение пишет живые записи в новый сегмент до
+    переключения индекса: после падения индекс не ссылается в пустоту.
+    """
+
+    def __init__(self, root, segment_max_bytes=16 * 1024 * 1024,
+                 max_age=30 * 24 * 3600, max_bytes=1024 * 1024 * 1024):
+        self._root = Path(root)
+        self._segment_max_bytes = segment_max_bytes
+        self._max_age = max_age
+        self._max_bytes = max_bytes
+        self._root.mkdir(parents=True, exist_ok=True)
+        self._index_path = self._root / 'index.sqlite3'
+        self._lock_path = self._root / '.lock'
+        with self._locked(fcntl.LOCK_EX), self._index() as db:
+            db.executescript(SCHEMA)
+
+    @contextmanager
+    def _locked(self, mode):
+        with open(self._lock_path, 'a') as lock_file:
+            fcntl.flock(lock_file, mode)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    @contextmanager
+    def _index(self):
+        db = sqlite3.connect(self._index_path, timeout=30)
+        try:
+            with db:
+                yield db
+        finally:
+            db.close()
+
+    def _segment_path(self, number):
+        return self._root / f'{number:08d}{SEGMENT_SUFFIX}'
+
+    def _segments(self):
+        return sorted(int(path.stem) for path in self._root.glob(
+            f'*{SEGMENT_SUFFIX}') if path.stem.isdigit())
+
+    def _active_segment(self, incoming):
+        """Номер сегмента для дозаписи; переполненный закрывается."""
+        segments = self._segments()
+        if not segments:
+            return 1, False
+        number = segments[-1]
+        size = self._segment_path(number).stat().st_size
+        if size and size + incoming > self._segment_max_bytes:
+            return number + 1, True
+        return number, False
+
+    @staticmethod
+    def _encode(api, params, fetched_at, data):
+        payload = zlib.compress(json.dumps({
+            'api': api,
+            'params': params,
+            'fetched_at': fetched_at,
+            'data': data,
+        }, ensure_ascii=False).encode('utf-8'))
+        return RECORD_HEADER.pack(len(payload), zlib.crc32(payload)) + payload
+
+    @staticmethod
+    def _verify(segment, offset, raw):
+        """Сжатое тело записи после проверки длины и crc32."""
+        size, crc = RECORD_HEADER.unpack_from(raw)
+        payload = raw[RECORD_HEADER.size:]
+        if size != len(payload) or zlib.crc32(payload) != crc:
+            raise CorruptRecordError(
+                f'Record at {segment}:{offset} is corrupt')
+        return payload
+
+    def _read_raw(self, segment, offset, length):
+        with open(self._segment_path(segment), 'rb') as file:
+            file.seek(offset)
+            raw = file.read(length)
+        return raw, self._verify(segment, offset, raw)
+
+    def append(self, api, params, data, fetched_at=None):
+        """Сохраняет ответ API и возвращает id записи."""
+        fetched_at = fetched_at or time.time()
+        record = self._encode(api, params, fetched_at, data)
+        with self._locked(fcntl.LOCK_EX):
+            segment, rolled_over = self._active_segment(len(record))
+            path = self._segment_path(segment)
+            with open(path, 'ab') as file:
+                offset = file.tell()
+                file.write(record)
+                file.flush()
+                os.fsync(file.fileno())
+            with self._index() as db:
+                record_id = db.execute(
+                    'INSERT INTO records (api, params_key, fetched_at, '
+                    'segment, offset, length) VALUES (?, ?, ?, ?, ?, ?)',
+                    (api, params_key(params), fetched_at, segment, offset,
+                     len(record)),
+                ).lastrowid
+            if rolled_over:
+                self._compact_locked()
+        return record_id
+
+    def get(self, record_id):
+        """Запись {'api', 'params', 'fetched_at', 'data'} или None."""
+        with self._locked(fcntl.LOCK_SH):
+            with self._index() as db:
+                row = db.execute(
+                    'SELECT segment, offset, length FROM records '
+                    'WHERE id = ?', (record_id,)).fetchone()
+            if row is None:
+                return None
+            _, payload = self._read_raw(*row)
+        return json.loads(zlib.decompress(payload))
+
+    def get_many(self, record_ids):
+        """Несколько записей за один проход индекса: {id: запись}.
+
+        Записи читаются по сегментам в порядке смещений, каждый файл
+        открывается один раз.
+        """
+        record_ids = list(set(record_ids))
+        if not record_ids:
+            return {}
+        records = {}
+        with self._locked(fcntl.LOCK_SH):
+            with self._index() as db:
+                rows = []
+                for start in range(0, len(record_ids), 500):
+                    chunk = record_ids[start:start + 500]
+                    rows += db.execute(
+                        'SELECT id, segment, offset, length FROM records '
+                        'WHERE id IN ({})'.format(','.join('?' * len(chunk))),
+                        chunk).fetchall()
+            rows.sort(key=lambda row: (row[1], row[2]))
+            file, file_segment = None, None
+            try:
+                for record_id, segment, offset, length in rows:
+                    if segment != file_segment:
+                        if file is not None:
+                            file.close()
+                        file = open(self._segment_path(segment), 'rb')
+                        file_segment = segment
+                    file.seek(offset)
+                    payload = self._verify(segment, offset, file.read(length))
+                    records[record_id] = json.loads(zlib.decompress(payload))
+            finally:
+                if file is not None:
+                    file.close()
+        return records
+
+    def history(self, api, params, since=None, limit=100):
+        """Сохранённые запросы (api, params), новые первыми."""
+        with self._locked(fcntl.LOCK_SH), self._index() as db:
+            rows = db.execute(
+                'SELECT id, fetched_at FROM records WHERE api = ? AND '
+                'params_key = ? AND fetched_at >= ? '
+                'ORDER BY fetched_at DESC LIMIT ?',
+                (api, params_key(params), since or 0, limit),
+            ).fetchall()
+        return [{'id': row[0], 'fetched_at': row[1]} for row in rows]
+
+    def latest(self, api, params):
+        """Последняя запись для (api, params) или None."""
+        found = self.history(api, params, limit=1)
+        return self.get(found[0]['id']) if found else None
+
+    def compact(self):
+        """Удаляет устаревшие записи и переписывает сегменты с мусором."""
+        with self._locked(fcntl.LOCK_EX):
+            self._compact_locked()
+
+    def _compact_locked(self):
+        started = time.monotonic()
+        for leftover in self._root.glob('*.tmp'):
+            leftover.unlink()
+        with self._index() as db:
+            if self._max_age:
+                db.execute('DELETE FROM records WHERE fetched_at < ?',
+                           (time.time() - self._max_age,))
+            if self._max_bytes:
+                excess = (db.execute(
+                    'SELECT COALESCE(SUM(length), 0) FROM records'
+                ).fetchone()[0] - self._max_bytes)
+                if excess > 0:
+                    doomed, freed = [], 0
+                    for record_id, length in db.execute(
+                            'SELECT id, length FROM records '
+                            'ORDER BY fetched_at'):
+                        if freed >= excess:
+                            break
+                        doomed.append((record_id,))
+                        freed += length
+                    db.executemany('DELETE FROM records WHERE id = ?', doomed)
+            live = dict(db.execute(
+                'SELECT segment, SUM(length) FROM records GROUP BY segment'
+            ).fetchall())
+
+        segments = self._segments()
+        active = segments[-1] if segments else None
+        next_number = (active or 0) + 1
+        for segment in segments:
+            if segment == active:
+                continue
+            path = self._segment_path(segment)
+            if not live.get(segment):
+                path.unlink()
+                continue
+            if live[segment] >= path.stat().st_size:
+                continue
+            self._rewrite_segment(segment, next_number)
+            next_number += 1
+        LOGGER.info('Compacted results store in %.3f s',
+                    time.monotonic() - started)
+
+    def _rewrite_segment(self, segment, new_segment):
+        """Переносит живые записи закрытого сегмента в новый."""
+        with self._index() as db:
+            rows = db.execute(
+                'SELECT id, offset, length FROM records WHERE segment = ? '
+                'ORDER BY offset', (segment,)).fetchall()
+        tmp_path = self._root / f'{new_segment:08d}.tmp'
+        moved = []
+        with open(tmp_path, 'wb') as out:
+            for record_id, offset, length in rows:
+                try:
+                    raw, _ = self._read_raw(segment, offset, length)
+                except CorruptRecordError:
+                    LOGGER.error('Dropping corrupt record %s', record_id)
+                    moved.append((None, None, record_id))
+                    continue
+                moved.append((new_segment, out.tell(), record_id))
+                out.write(raw)
+            out.flush()
+            os.fsync(out.fileno())
+        os.replace(tmp_path, self._segment_path(new_segment))
+        with self._index() as db:
+            db.executemany(
+                'UPDATE records SET segment = ?, offset = ? WHERE id = ?',
+                [row for row in moved if row[0] is not None])
+            db.executemany(
+                'DELETE FROM records WHERE id = ?',
+                [(row[2],) for row in moved if row[0] is None])
+        self._segment_path(segment).unlink()
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_store():
+    """ResultsStore процесса, создаётся при первом обращении."""
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = ResultsStore(**settings.API_RESULTS_STORE)
+    return _store
@@ -1,9 +1,13 @@
 import base64
 from django.core.files.base import ContentFile
+from django.db import transaction
 from djoser.serializers import UserSerializer
 from rest_framework import serializers
 from rest_framework.fields import CurrentUserDefault
 
+from api.catalog import get_catalog
+from api.documents import RecipeDocumentSerializer
+from api.shopping import recipe_edit
 from recipes.models import (Favorite, Follow, Ingredient, IngredientRecipe,
                             Recipe, ShoppingList)
 from users.models import User
@@ -80,7 +84,7 @@ class RecipeSerializer(serializers.ModelSerializer):
                                              many=True, read_only=True)
 
     class Meta:
-        exclude = ('pub_date',)
+        exclude = ('pub_date', 'updated_at')
         model = Recipe
 
 
@@ -96,7 +100,7 @@ class RecipeWriteSerializer(serializers.ModelSerializer):
     )
 
     class Meta:
-        exclude = ('pub_date',)
+        exclude = ('pub_date', 'updated_at')
         read_only_fields = (
             'author',
         )
@@ -113,6 +117,11 @@ class RecipeWriteSerializer(serializers.ModelSerializer):
         if len(ingredients_id_list) != len(set(ingredients_id_list)):
             raise serializers.ValidationError('Ингредиенты не должны '
                                               'повторяться.')
+        ids = [item['id'] for item in attrs.get('ingredientinrecipe_set', [])]
+        unknown = set(ids) - get_catalog().existing(ids)
+        if unknown:
+            raise serializers.ValidationError(
+                f'Нет ингредиентов с id {sorted(unknown)}.')
         return attrs
 
     def get_is_favorited(self, obj):
@@ -124,7 +133,7 @@ class RecipeWriteSerializer(serializers.ModelSerializer):
                                            recipe=obj).exists()
 
     def to_representation(self, instance):
-        serializer = RecipeSerializer(
+        serializer = RecipeDocumentSerializer(
             instance,
             context={'request': self.context.get('request')}
         )
@@ -153,9 +162,10 @@ class RecipeWriteSerializer(serializers.ModelSerializer):
         instance.cooking_time = validated_data.get('cooking_time',
                                                    instance.cooking_time)
         ingredients = validated_data.pop('ingredientinrecipe_set')
-        instance.ingredients.clear()
-        instance.save()
-        self._add_ingredients(instance, ingredients)
+        with transaction.atomic(), recipe_edit(instance):
+            instance.ingredients.clear()
+            self._add_ingredients(instance, ingredients)
+            instance.save()
         return instance
 
 
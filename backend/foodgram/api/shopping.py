@@ -0,0 +1,157 @@
+import threading
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.db import transaction
+
+from api.catalog import get_catalog
+from api.tasks import apply_shopping_deltas
+from recipes.models import (IngredientRecipe, Recipe, ShoppingAggregate,
+                            ShoppingList)
+
+# Рецепты, состав которых сейчас заменяется целиком через recipe_edit
+_editing = threading.local()
+
+
+def recipe_amounts(recipe):
+    """Состав рецепта: {ingredient_id: amount}."""
+    return dict(IngredientRecipe.objects.filter(recipe=recipe).values_list(
+        'ingredient_id', 'amount'))
+
+
+def lock_recipe(recipe):
+    """Блокирует строку рецепта до конца транзакции.
+
+    Корзина читает состав, а правка состава — список корзин под этой
+    блокировкой, поэтому одна из них всегда видит результат другой и
+    приращение не теряется. NO KEY UPDATE не мешает вставкам, которые
+    ссылаются на рецепт (избранное, списки покупок).
+    """
+    list(Recipe.objects.select_for_update(no_key=True).filter(
+        pk=getattr(recipe, 'pk', recipe)).values_list('pk', flat=True))
+
+
+def amounts_delta(old, new):
+    """Разница двух составов в виде {ingredient_id: (amount, count)}."""
+    delta = {}
+    for ingredient_id in old.keys() | new.keys():
+        delta[ingredient_id] = (
+            new.get(ingredient_id, 0) - old.get(ingredient_id, 0),
+            (ingredient_id in new) - (ingredient_id in old),
+        )
+    return delta
+
+
+def add_to_cart(user, recipe):
+    """Кладёт рецепт в список покупок вместе с его итогами."""
+    with transaction.atomic():
+        lock_recipe(recipe)
+        item = ShoppingList.objects.create(user=user, recipe=recipe)
+        ShoppingAggregate.objects.apply_deltas(
+            [user.pk], amounts_delta({}, recipe_amounts(recipe)))
+    return item
+
+
+def remove_from_cart(user, recipe):
+    """Убирает рецепт из списка покупок и вычитает его итоги."""
+    with transaction.atomic():
+        lock_recipe(recipe)
+        deleted, _ = ShoppingList.objects.filter(
+            user=user, recipe=recipe).delete()
+        if deleted:
+            ShoppingAggregate.objects.apply_deltas(
+                [user.pk], amounts_delta(recipe_amounts(recipe), {}))
+    return bool(deleted)
+
+
+def fan_out(recipe, delta):
+    """Раскладывает изменение рецепта по корзинам, где он лежит.
+
+    Небольшое число корзин обновляется в текущей транзакции, для
+    популярных рецептов — фоновой задачей после коммита. Задача получает
+    список корзин на момент правки, прочитанный под lock_recipe: кто
+    положит рецепт позже, и так получит новый состав, а кто успеет
+    убрать — вычтет новый состав, и дельта задачи это выровняет.
+    """
+    if not any(value != (0, 0) for value in delta.values()):
+        return
+    with transaction.atomic():
+        lock_recipe(recipe)
+        user_ids = list(ShoppingList.objects.filter(
+            recipe=recipe).values_list('user_id', flat=True))
+        if not user_ids:
+            return
+        if len(user_ids) <= settings.SHOPPING_FANOUT_INLINE:
+            ShoppingAggregate.objects.apply_deltas(user_ids, delta)
+            return
+        payload = [[ingredient_id, amount, count]
+                   for ingredient_id, (amount, count) in delta.items()]
+        transaction.on_commit(
+            lambda: apply_shopping_deltas.delay(user_ids, payload))
+
+
+def recipe_changed(recipe, old_amounts):
+    """Вызывается после замены состава рецепта."""
+    fan_out(recipe, amounts_delta(old_amounts, recipe_amounts(recipe)))
+
+
+@contextmanager
+def recipe_edit(recipe):
+    """Замена состава рецепта целиком: правки отдельных строк внутри не
+    раскладываются, итоги корзин сдвигаются один раз после замены.
+    Вызывается внутри транзакции: рецепт заблокирован до её конца."""
+    lock_recipe(recipe)
+    old_amounts = recipe_amounts(recipe)
+    editing = getattr(_editing, 'recipe_ids', frozenset())
+    _editing.recipe_ids = editing | {recipe.pk}
+    try:
+        yield
+    finally:
+        _editing.recipe_ids = editing
+    recipe_changed(recipe, old_amounts)
+
+
+def _in_recipe_edit(item):
+    return item.recipe_id in getattr(_editing, 'recipe_ids', ())
+
+
+def item_saving(item):
+    """Перед сохранением строки состава в обход recipe_edit (shell,
+    скрипты): запоминает её прежние ингредиент и количество."""
+    if not item._state.adding and not _in_recipe_edit(item):
+        item._shopping_old = dict(IngredientRecipe.objects.filter(
+            pk=item.pk).values_list('ingredient_id', 'amount'))
+
+
+def item_saved(item):
+    if not _in_recipe_edit(item):
+        fan_out(item.recipe_id, amounts_delta(
+            item.__dict__.pop('_shopping_old', {}),
+            {item.ingredient_id: item.amount}))
+
+
+def item_deleted(item):
+    if not _in_recipe_edit(item):
+        fan_out(item.recipe_id,
+                amounts_delta({item.ingredient_id: item.amount}, {}))
+
+
+def recipe_deleted(recipe):
+    """Вызывается до удаления рецепта, пока состав и корзины на месте."""
+    fan_out(recipe, amounts_delta(recipe_amounts(recipe), {}))
+
+
+def cart_rows(user):
+    """Итоги списка покупок строками [название, единица, итог] по
+    алфавиту. Названия берутся из снимка каталога, без join с
+    ингредиентами."""
+    totals = list(ShoppingAggregate.objects.filter(
+        user=user, recipe_count__gt=0).values_list(
+        'ingredient_id', 'total_amount'))
+    names = get_catalog().get_many(
+        [ingredient_id for ingredient_id, _ in totals])
+    return sorted(
+        [*names[ingredient_id], total_amount]
+        for ingredient_id, total_amount in totals
+        if ingredient_id in names
+    )
@@ -0,0 +1,163 @@
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.db.models import QuerySet
+from django.db.models.signals import (m2m_changed, post_delete, post_save,
+                                      pre_delete, pre_save)
+from django.dispatch import receiver
+from django.utils import timezone
+from rest_framework.authtoken.models import Token
+
+from api.authentication import token_cache
+from api.catalog import catalog_changed
+from api.conditional import bump_on_commit, viewer_resource
+from api.shopping import (item_deleted, item_saved, item_saving,
+                          recipe_deleted)
+from api.tasks import fan_out_recipe, rebuild_recipe_documents
+from recipes.models import (Favorite, Follow, Ingredient, IngredientRecipe,
+                            Recipe, ShoppingList)
+
+User = get_user_model()
+
+# Поля пользователя, которые попадают в ответы API
+USER_PAYLOAD_FIELDS = {'email', 'username', 'first_name', 'last_name'}
+
+
+def only_last_login(update_fields):
+    """Сохранение при входе (djoser token/login) меняет только last_login."""
+    return update_fields is not None and set(update_fields) <= {'last_login'}
+
+
+@receiver(post_delete, sender=Token)
+def invalidate_deleted_token(sender, instance, **kwargs):
+    """Выход (djoser token/logout) и удаление пользователя."""
+    token_cache.invalidate(instance.key)
+
+
+@receiver(post_save, sender=User)
+def invalidate_user_tokens(sender, instance, created, update_fields,
+                           **kwargs):
+    """Смена пароля, is_active в админке и любые правки профиля."""
+    if created or only_last_login(update_fields):
+        return
+    for key in Token.objects.filter(user=instance).values_list(
+            'key', flat=True):
+        token_cache.invalidate(key)
+
+
+@receiver(post_save, sender=Recipe)
+@receiver(post_delete, sender=Recipe)
+@receiver(post_save, sender=IngredientRecipe)
+@receiver(post_delete, sender=IngredientRecipe)
+@receiver(m2m_changed, sender=Recipe.ingredients.through)
+def bump_recipes_version(sender, **kwargs):
+    bump_on_commit('recipes')
+
+
+@receiver(post_save, sender=IngredientRecipe)
+@receiver(post_delete, sender=IngredientRecipe)
+def touch_recipe(sender, instance, **kwargs):
+    """Состав меняется в обход Recipe.save() — документ рецепта устарел."""
+    Recipe.objects.filter(pk=instance.recipe_id).update(
+        updated_at=timezone.now())
+
+
+@receiver(m2m_changed, sender=Recipe.ingredients.through)
+def touch_recipe_ingredients(sender, instance, action, reverse, **kwargs):
+    if action.startswith('post_') and not reverse:
+        Recipe.objects.filter(pk=instance.pk).update(
+            updated_at=timezone.now())
+
+
+def touch_recipes(recipes):
+    """Сдвигает updated_at рецептов и после коммита пересобирает их
+    документы фоном, чтобы первый читатель не собирал их сам."""
+    recipe_ids = list(recipes.values_list('pk', flat=True))
+    if not recipe_ids:
+        return
+    Recipe.objects.filter(pk__in=recipe_ids).update(updated_at=timezone.now())
+    transaction.on_commit(
+        lambda: rebuild_recipe_documents.delay(recipe_ids))
+
+
+@receiver(post_save, sender=User)
+def touch_author_recipes(sender, instance, created, update_fields, **kwargs):
+    """Имя и почта автора входят в документы его рецептов."""
+    if created or (update_fields is not None
+                   and not set(update_fields) & USER_PAYLOAD_FIELDS):
+        return
+    touch_recipes(Recipe.objects.filter(author=instance))
+
+
+@receiver(post_save, sender=Ingredient)
+def touch_ingredient_recipes(sender, instance, created, **kwargs):
+    if not created:
+        touch_recipes(Recipe.objects.filter(ingredients=instance))
+
+
+@receiver(post_save, sender=Recipe)
+def fan_out_new_recipe(sender, instance, created, **kwargs):
+    """Новый рецепт раскладывается по лентам подписчиков фоном."""
+    if created:
+        transaction.on_commit(lambda: fan_out_recipe.delay(instance.pk))
+
+
+@receiver(pre_delete, sender=Recipe)
+def subtract_deleted_recipe(sender, instance, **kwargs):
+    """Удаление рецепта каскадом чистит корзины — вычитаем его итоги."""
+    recipe_deleted(instance)
+
+
+@receiver(pre_save, sender=IngredientRecipe)
+def remember_cart_amounts(sender, instance, raw, **kwargs):
+    if not raw:
+        item_saving(instance)
+
+
+@receiver(post_save, sender=IngredientRecipe)
+def apply_saved_cart_amounts(sender, instance, raw, **kwargs):
+    """Правка состава в обход RecipeWriteSerializer.update и инлайна
+    админки тоже сдвигает итоги корзин."""
+    if not raw:
+        item_saved(instance)
+
+
+@receiver(post_delete, sender=IngredientRecipe)
+def apply_deleted_cart_amounts(sender, instance, origin, **kwargs):
+    """Только удаление самой строки: при каскаде рецепта его итоги уже
+    вычтены, при каскаде ингредиента итоги удаляются вместе с ним."""
+    model = origin.model if isinstance(origin, QuerySet) else type(origin)
+    if model is IngredientRecipe:
+        item_deleted(instance)
+
+
+@receiver(post_save, sender=Ingredient)
+@receiver(post_delete, sender=Ingredient)
+def bump_ingredients_version(sender, **kwargs):
+    bump_on_commit('ingredients')
+    # Снимок каталога пересобирается по закоммиченным данным
+    transaction.on_commit(catalog_changed)
+
+
+@receiver(post_save, sender=User)
+def bump_users_version(sender, update_fields, **kwargs):
+    """Вход не меняет ответов API — ETag после него остаются верными."""
+    if (update_fields is not None
+            and not set(update_fields) & USER_PAYLOAD_FIELDS):
+        return
+    bump_on_commit('users')
+
+
+@receiver(post_delete, sender=User)
+def bump_users_version_deleted(sender, **kwargs):
+    bump_on_commit('users')
+
+
+@receiver(post_save, sender=Favorite)
+@receiver(post_delete, sender=Favorite)
+@receiver(post_save, sender=ShoppingList)
+@receiver(post_delete, sender=ShoppingList)
+@receiver(post_save, sender=Follow)
+@receiver(post_delete, sender=Follow)
+def bump_viewer_version(sender, instance, **kwargs):
+    """Флаги is_favorited/is_in_shopping_cart/is_subscribed зрителя."""
+    bump_on_commit(viewer_resource(instance.user))
@@ -1,69 +1,247 @@
-import json
 import os
-from pathlib import Path
+import time
 
-import requests
 from celery import shared_task
+from celery.utils.log import get_task_logger
+from django.conf import settings
 
+from api.cache import (get_cached_result, normalize_params, release_inflight,
+                       store_error, store_result, store_task_result)
+from api.documents import build_documents
+from api.exports import (artifact_name, purge_expired, save_export,
+                         spec_queryset)
+from api.feed import backfill_followers, fan_out
+from api.media_gc import MediaCollector
+from api.pdf import get_artifact, render_shopping_list, save_artifact
+from api.rate_limiter import RateLimited, get_limiter
+from api.results_store import get_store
+from recipes.models import Recipe, ShoppingAggregate
 
-RESULTS_DIR = Path(os.getenv("API_RESULTS_DIR", "api_results"))
+logger = get_task_logger(__name__)
 
 
-def _save_response(data, filename):
-    RESULTS_DIR.mkdir(parents=True, exist_ok=True)
-    filepath = RESULTS_DIR / filename
-    with open(filepath, "w", encoding="utf-8") as file:
-        json.dump(data, file, indent=2, ensure_ascii=False)
-    return filepath
+def _save_response(api_alias, params, data):
+    """Ответ API пишется в хранилище воркера и возвращается в результате
+    задачи: через общий кэш его читают task_status и batch_status на
+    подах бэкенда, у которых нет доступа к диску воркера."""
+    fetched_at = time.time()
+    record_id = get_store().append(api_alias, params, data, fetched_at)
+    return {"record_id": record_id, "fetched_at": fetched_at, "data": data}
 
 
-@shared_task(bind=True)
-def fetch_holidays(self, api_params):
+def _run_cached(api_alias, task_id, api_params, fetch):
+    """Выполняет fetch(params), если результата ещё нет в кэше.
+
+    Повторная доставка той же задачи или дубль, проскочивший мимо
+    склейки во view, отдают кэшированный результат без запроса к API.
+    """
+    params = normalize_params(api_alias, api_params)
+    keep_slot = False
+    try:
+        cached = get_cached_result(api_alias, params)
+        if cached is not None:
+            return cached["result"]
+        result = fetch(params)
+        store_result(api_alias, params, task_id, result)
+        return result
+    except RateLimited:
+        # Задача будет перезапущена с тем же id: слот остаётся за ней
+        keep_slot = True
+        raise
+    except Exception as error:
+        store_error(task_id, error)
+        raise
+    finally:
+        if not keep_slot:
+            release_inflight(api_alias, params, task_id)
+
+
+def _run_limited(task, api_alias, api_params, fetch):
+    """Откладывает задачу, если лимит внешнего API не даёт вызвать его сразу.
+
+    Короткое ожидание токена проходит внутри задачи, длинное — через
+    retry с countdown, не занимая воркер.
+    """
+    try:
+        return _run_cached(api_alias, task.request.id, api_params, fetch)
+    except RateLimited as error:
+        if task.request.retries >= task.max_retries:
+            store_error(task.request.id, error)
+            release_inflight(api_alias,
+                             normalize_params(api_alias, api_params),
+                             task.request.id)
+            raise
+        raise task.retry(countdown=error.retry_after)
+
+
+def _raise_for_status(api_alias, response):
+    """Ответ с Retry-After, который клиент не стал пересиживать,
+    превращается в RateLimited: задача перезапустится через указанное
+    время, не занимая воркер."""
+    from api.http_client import retry_after
+
+    if response.status_code in (429, 503):
+        wait = retry_after(response)
+        if wait is not None:
+            raise RateLimited(api_alias, wait)
+    response.raise_for_status()
+
+
+def _request_holidays(params):
+    # requests и urllib3 нужны только воркеру, не веб-процессу
+    from api.http_client import get_client
+
     api_key = os.getenv("HOLIDAYS_API_KEY")
     if not api_key:
         raise ValueError("HOLIDAYS_API_KEY is not set")
 
-    response = requests.get(
+    get_limiter().acquire("holidays")
+    response = get_client().get(
         url="https://holidays.abstractapi.com/v1/",
-        params={
-            "api_key": api_key,
-            "country": api_params.get("country", "US"),
-            "year": api_params.get("year", 2025),
-            "month": api_params.get("month", 12),
-            "day": api_params.get("day", 25),
-        },
-        timeout=15,
+        params={"api_key": api_key, **params},
     )
-    response.raise_for_status()
+    _raise_for_status("holidays", response)
+    return _save_response("holidays", params, response.json())
 
-    filename = (
-        "holidays_"
-        f'{api_params.get("country", "US")}_'
-        f'{api_params.get("year", 2025)}_'
-        f'{api_params.get("month", 12)}_'
-        f'{api_params.get("day", 25)}.json'
-    )
-    filepath = _save_response(response.json(), filename)
-    return {"file": str(filepath)}
 
+def _request_weather(params):
+    from api.http_client import get_client
 
-@shared_task(bind=True)
-def fetch_weather(self, api_params):
     api_key = os.getenv("WEATHER_API_KEY")
     if not api_key:
         raise ValueError("WEATHER_API_KEY is not set")
 
-    response = requests.get(
+    get_limiter().acquire("weather")
+    response = get_client().get(
         url="http://api.weatherstack.com/current",
-        params={
-            "access_key": api_key,
-            "query": api_params.get("query", "New York"),
-        },
-        timeout=15,
+        params={"access_key": api_key, "query": params["query"]},
     )
-    response.raise_for_status()
+    _raise_for_status("weather", response)
+    return _save_response("weather", params, response.json())
+
+
+REQUESTS = {
+    "holidays": _request_holidays,
+    "weather": _request_weather,
+}
+
+
+@shared_task(bind=True, max_retries=settings.RATE_LIMIT_MAX_RESCHEDULES)
+def fetch_holidays(self, api_params):
+    return _run_limited(self, "holidays", api_params, _request_holidays)
+
+
+@shared_task(bind=True, max_retries=settings.RATE_LIMIT_MAX_RESCHEDULES)
+def fetch_weather(self, api_params):
+    return _run_limited(self, "weather", api_params, _request_weather)
+
+
+@shared_task(bind=True, max_retries=settings.RATE_LIMIT_MAX_RESCHEDULES)
+def fetch_batch(self, api_alias, items):
+    """Выполняет кусок пакета: items — список пар [task_id, params].
+
+    У каждого элемента свой task_id, под которым результат или ошибка
+    попадают в кэш, так что статус пакета собирается без result backend.
+    Упавший элемент не мешает остальным; при упоре в лимит API
+    перезапускается только необработанный хвост.
+    """
+    failed = 0
+    for index, (task_id, params) in enumerate(items):
+        try:
+            _run_cached(api_alias, task_id, params, REQUESTS[api_alias])
+        except RateLimited as error:
+            rest = items[index:]
+            if self.request.retries >= self.max_retries:
+                for rest_id, rest_params in rest:
+                    store_error(rest_id, error)
+                    release_inflight(api_alias, rest_params, rest_id)
+                raise
+            raise self.retry(args=(api_alias, rest),
+                             countdown=error.retry_after)
+        except Exception:
+            logger.exception("Batch item %s failed", task_id)
+            failed += 1
+    return {"total": len(items), "failed": failed}
+
+
+@shared_task
+def apply_shopping_deltas(user_ids, deltas):
+    """Фоновая раскладка правки популярного рецепта по корзинам.
+
+    deltas — список [ingredient_id, amount, recipe_count].
+    """
+    ShoppingAggregate.objects.apply_deltas(user_ids, {
+        ingredient_id: (amount, count)
+        for ingredient_id, amount, count in deltas
+    })
+
+
+@shared_task(bind=True)
+def render_shopping_pdf(self, rows, digest):
+    """Рендерит PDF списка покупок и кладёт его в хранилище.
+
+    Готовый файл с той же подписью повторно не рендерится. Результат
+    {"file", "digest"} виден через task_status.
+    """
+    try:
+        name = get_artifact(digest) or save_artifact(
+            digest, render_shopping_list(rows))
+        result = {"file": name, "digest": digest}
+        store_task_result(self.request.id, result,
+                          settings.SHOPPING_PDF["ttl"])
+        return result
+    except Exception as error:
+        store_error(self.request.id, error)
+        raise
+    finally:
+        release_inflight("shopping_pdf", {"digest": digest}, self.request.id)
+
+
+@shared_task
+def rebuild_recipe_documents(recipe_ids):
+    """Фоновая пересборка документов рецептов (api.documents)."""
+    for start in range(0, len(recipe_ids), settings.RECIPE_DOCUMENTS_CHUNK):
+        build_documents(
+            recipe_ids[start:start + settings.RECIPE_DOCUMENTS_CHUNK])
+
+
+@shared_task
+def fan_out_recipe(recipe_id):
+    """Раскладка нового рецепта по лентам подписчиков (api.feed)."""
+    recipe = Recipe.objects.filter(pk=recipe_id).only(
+        'id', 'author_id', 'pub_date').first()
+    if recipe is not None:
+        return fan_out(recipe)
+
+
+@shared_task
+def backfill_demoted_authors(author_ids):
+    """Дополнение лент подписчиков авторов, переставших быть
+    популярными (api.feed)."""
+    return sum(backfill_followers(author_id) for author_id in author_ids)
+
+
+@shared_task
+def collect_media_garbage():
+    """Периодическая сборка осиротевших картинок рецептов (api.media_gc)."""
+    return dict(MediaCollector(settings.MEDIA_GC["mode"]).collect())
+
+
+@shared_task(bind=True)
+def export_queryset(self, export_name, spec, fmt):
+    """Большая выгрузка из админки в сжатый файл (api.exports).
 
-    query = api_params.get("query", "New York").replace(" ", "_")
-    filename = f"weather_{query}.json"
-    filepath = _save_response(response.json(), filename)
-    return {"file": str(filepath)}
+    spec — описание строк из query_spec. Результат
+    {"export_file", "rows"} виден через task_status.
+    """
+    try:
+        purge_expired()
+        name = artifact_name(self.request.id, export_name, fmt)
+        rows = save_export(name, export_name,
+                           spec_queryset(export_name, spec), fmt)
+        result = {"export_file": name, "rows": rows}
+        store_task_result(self.request.id, result, settings.EXPORT["ttl"])
+        return result
+    except Exception as error:
+        store_error(self.request.id, error)
+        raise
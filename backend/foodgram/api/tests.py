@@ -0,0 +1,724 @@
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import mock
+from urllib.parse import urlsplit
+
+import requests
+from celery import group
+from celery.exceptions import Retry as CeleryRetry
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection, transaction
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from rest_framework.authtoken.models import Token
+from rest_framework.exceptions import AuthenticationFailed, NotFound
+from rest_framework.test import APIClient
+
+from api import (catalog, http_client, rate_limiter, results_store,
+                 throttling)
+from api.batches import split_chunks
+from api.catalog import IngredientCatalog, catalog_changed
+from api.authentication import (SHARED_KEY, CachedTokenAuthentication,
+                                token_resource, token_cache)
+from api.conditional import bump, get_versions
+from api.documents import RecipeDocumentSerializer, render_many
+from api.feed import (POPULAR_KEY, fan_out, feed_page, follow,
+                      popular_authors, unfollow)
+from api.shopping import add_to_cart, recipe_edit, remove_from_cart
+from api.http_client import CircuitOpenError, HttpClient, retry_after
+from api.tasks import fetch_weather
+from api.throttling import SlidingWindowThrottle
+from foodgram.celery import app
+from recipes.models import (Ingredient, IngredientRecipe, Recipe,
+                            ShoppingAggregate, TimelineEntry)
+from users.models import User
+
+
+class UpstreamStub:
+    """Локальная заглушка внешнего API.
+
+    Отвечает JSON с номером запроса, запоминает путь и порт клиента
+    каждого запроса. statuses — очередь кодов ответа, потом 200;
+    retry_after, если задан, уходит в Retry-After ответов с ошибкой.
+    """
+
+    def __init__(self, delay=0.0):
+        self.delay = delay
+        self.statuses = deque()
+        self.retry_after = None
+        self.requests = []
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_GET(self):
+                stub.requests.append((self.path, self.client_address[1]))
+                time.sleep(stub.delay)
+                status = stub.statuses.popleft() if stub.statuses else 200
+                body = json.dumps({'n': len(stub.requests)}).encode()
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                if status != 200 and stub.retry_after is not None:
+                    self.send_header('Retry-After', stub.retry_after)
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.server.daemon_threads = True
+        self.url = f'http://127.0.0.1:{self.server.server_port}'
+        threading.Thread(target=self.server.serve_forever,
+                         daemon=True).start()
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class StubClient(HttpClient):
+    """HttpClient, который шлёт запросы к любому хосту на заглушку."""
+
+    def __init__(self, stub, **kwargs):
+        super().__init__(**kwargs)
+        self._stub = stub
+
+    def request(self, method, url, **kwargs):
+        path = urlsplit(url).path
+        return super().request(method, f'{self._stub.url}{path}', **kwargs)
+
+
+class LocalStoresMixin:
+    """Файловые хранилища и синглтоны процесса — свои у каждого теста,
+    во временном каталоге; кэш очищается."""
+
+    def setUp(self):
+        super().setUp()
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory, ignore_errors=True)
+        overrides = override_settings(
+            MEDIA_ROOT=os.path.join(directory, 'media'),
+            RATE_LIMITER=dict(settings.RATE_LIMITER, limits='', path=(
+                os.path.join(directory, 'rate_limits.sqlite3'))),
+            THROTTLE={'path': os.path.join(directory, 'throttle.sqlite3')},
+            ADMISSION=dict(settings.ADMISSION,
+                           dir=os.path.join(directory, 'admission')),
+            API_RESULTS_STORE=dict(settings.API_RESULTS_STORE,
+                                   root=os.path.join(directory, 'results')),
+            INGREDIENT_CATALOG=dict(settings.INGREDIENT_CATALOG, path=(
+                os.path.join(directory, 'ingredient_catalog.bin'))),
+        )
+        overrides.enable()
+        self.addCleanup(overrides.disable)
+        for module, name in ((rate_limiter, '_limiter'),
+                             (results_store, '_store'),
+                             (throttling, '_store'),
+                             (throttling, '_controller'),
+                             (catalog, '_catalog'),
+                             (http_client, '_client')):
+            patcher = mock.patch.object(module, name, None)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.addCleanup(setattr, app.conf, 'task_always_eager',
+                        app.conf.task_always_eager)
+        app.conf.task_always_eager = True
+        cache.clear()
+
+
+class UpstreamStubMixin(LocalStoresMixin):
+    """Запросы задач к внешним API уходят на UpstreamStub."""
+
+    def setUp(self):
+        super().setUp()
+        self.stub = UpstreamStub()
+        self.addCleanup(self.stub.close)
+        patcher = mock.patch.object(http_client, '_client',
+                                    StubClient(self.stub, retries=0))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        patcher = mock.patch.dict(os.environ, {'HOLIDAYS_API_KEY': 'key',
+                                               'WEATHER_API_KEY': 'key'})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.user = User.objects.create_user(
+            username='user', email='user@example.com', password='password')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def run_task(self, task_name, params):
+        return self.client.post(f'/api/tasks/{task_name}/', params,
+                                format='json')
+
+    def task_status(self, task_id):
+        return self.client.get(f'/api/tasks/{task_id}/status/').data
+
+
+class ApiTaskCacheTests(UpstreamStubMixin, TestCase):
+    def test_cached_result_is_returned_without_upstream_call(self):
+        first = self.run_task('weather', {'query': 'Paris'})
+        second = self.run_task('weather', {'query': ' Paris '})
+
+        self.assertEqual(first.status_code, 202)
+        self.assertEqual(second.status_code, 200)
+        self.assertEqual(second.data, {'task_id': first.data['task_id'],
+                                       'cached': True})
+        self.assertEqual(len(self.stub.requests), 1)
+        status = self.task_status(second.data['task_id'])
+        self.assertEqual(status['status'], 'SUCCESS')
+        self.assertEqual(status['data'], {'n': 1})
+
+    def test_different_params_are_fetched_separately(self):
+        self.run_task('weather', {'query': 'Paris'})
+        self.run_task('weather', {'query': 'Rome'})
+        self.run_task('holidays', {'country': 'US'})
+
+        self.assertEqual(len(self.stub.requests), 3)
+
+    def test_concurrent_identical_requests_are_coalesced(self):
+        with mock.patch.object(fetch_weather, 'apply_async') as apply_async:
+            first = self.run_task('weather', {'query': 'Oslo'})
+            second = self.run_task('weather', {'query': 'Oslo'})
+
+        self.assertEqual(first.data['task_id'], second.data['task_id'])
+        apply_async.assert_called_once()
+        self.assertEqual(self.stub.requests, [])
+
+        fetch_weather.apply(args=({'query': 'Oslo'},),
+                            task_id=first.data['task_id'])
+        third = self.run_task('weather', {'query': 'Oslo'})
+        self.assertEqual(third.data, {'task_id': first.data['task_id'],
+                                      'cached': True})
+        self.assertEqual(len(self.stub.requests), 1)
+
+    def test_redelivered_task_does_not_call_upstream_again(self):
+        task_id = self.run_task('weather', {'query': 'Kyiv'}).data['task_id']
+        fetch_weather.apply(args=({'query': 'Kyiv'},), task_id=task_id)
+
+        self.assertEqual(len(self.stub.requests), 1)
+
+    def test_failed_task_releases_params_for_retry(self):
+        self.stub.statuses.append(500)
+        failed = self.run_task('weather', {'query': 'Lima'})
+        retried = self.run_task('weather', {'query': 'Lima'})
+
+        self.assertEqual(self.task_status(failed.data['task_id'])['status'],
+                         'FAILURE')
+        self.assertNotEqual(retried.data['task_id'], failed.data['task_id'])
+        self.assertEqual(self.task_status(retried.data['task_id'])['data'],
+                         {'n': 2})
+
+    def test_long_retry_after_reschedules_task(self):
+        self.stub.statuses.append(429)
+        self.stub.retry_after = '3600'
+        with mock.patch.object(fetch_weather, 'retry',
+                               return_value=CeleryRetry()) as retry:
+            result = fetch_weather.apply(args=[{'query': 'Lima'}])
+
+        self.assertEqual(result.state, 'RETRY')
+        retry.assert_called_once_with(countdown=3600)
+        self.assertEqual(len(self.stub.requests), 1)
+
+
+class ApiBatchTests(UpstreamStubMixin, TestCase):
+    def run_batch(self, task_name, items):
+        return self.client.post(f'/api/tasks/{task_name}/batch/', items,
+                                format='json')
+
+    def batch_status(self, batch_id, **params):
+        return self.client.get(f'/api/tasks/batch/{batch_id}/status/',
+                               params).data
+
+    def test_batch_reports_counts_and_merged_results(self):
+        cities = ['Paris', 'paris', 'Rome', 'Oslo', 'Rome']
+        response = self.run_batch('weather', [{'query': city}
+                                              for city in cities])
+
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual((response.data['total'], response.data['queued']),
+                         (5, 3))
+        self.assertEqual(len(self.stub.requests), 3)
+        status = self.batch_status(response.data['batch_id'])
+        self.assertEqual(status['counts'],
+                         {'SUCCESS': 5, 'FAILURE': 0, 'PENDING': 0})
+        self.assertTrue(status['done'])
+        self.assertEqual([item['params']['query'] for item in
+                          status['results']], cities)
+        self.assertEqual(status['results'][0]['data'],
+                         status['results'][1]['data'])
+        self.assertNotIn(
+            'results', self.batch_status(response.data['batch_id'],
+                                         results=0))
+
+    def test_cached_items_are_not_queued_again(self):
+        self.run_task('weather', {'query': 'Paris'})
+        response = self.run_batch('weather', [{'query': 'Paris'},
+                                              {'query': 'Rome'}])
+
+        self.assertEqual(response.data['queued'], 1)
+        self.assertEqual(len(self.stub.requests), 2)
+
+    def test_failed_items_are_counted(self):
+        self.stub.statuses.extend([500, 500])
+        response = self.run_batch('holidays', [{'year': 2024}])
+
+        status = self.batch_status(response.data['batch_id'])
+        self.assertEqual(status['counts']['FAILURE'], 1)
+        self.assertIn('error', status['results'][0])
+
+    def test_invalid_batches_are_rejected(self):
+        self.assertEqual(self.run_batch('weather', {'query': 'x'})
+                         .status_code, 400)
+        self.assertEqual(self.run_batch('weather', [{'query': 'x'}, 5])
+                         .data['detail'], 'Invalid task params at index 1.')
+        self.assertEqual(self.run_batch('unknown', [{}]).status_code, 404)
+        self.assertEqual(
+            self.client.get('/api/tasks/batch/nope/status/').status_code,
+            404)
+
+    @override_settings(API_BATCH=dict(settings.API_BATCH, max_messages=4))
+    def test_large_batch_is_chunked(self):
+        chunks = split_chunks(list(range(11)))
+
+        self.assertEqual([len(chunk) for chunk in chunks], [3, 3, 3, 2])
+        self.assertEqual(len(split_chunks(list(range(3)))), 3)
+
+    def test_batch_submission_latency_per_item(self):
+        """Бенчмарк: постановка N задач одним пакетом против N запросов.
+
+        Задачи не выполняются — сравнивается только путь постановки.
+        """
+        items = 100
+        patchers = (
+            mock.patch.object(SlidingWindowThrottle, 'allow_request',
+                              return_value=True),
+            mock.patch.object(fetch_weather, 'apply_async'),
+            mock.patch.object(group, 'apply_async'),
+        )
+        for patcher in patchers:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+        started = time.perf_counter()
+        for number in range(items):
+            self.run_task('weather', {'query': f'Single {number}'})
+        single = (time.perf_counter() - started) / items
+        started = time.perf_counter()
+        response = self.run_batch('weather', [{'query': f'Batch {number}'}
+                                              for number in range(items)])
+        batched = (time.perf_counter() - started) / items
+
+        self.assertEqual(response.data['queued'], items)
+        self.assertLess(
+            batched * 2, single,
+            f'{single * 1000:.2f} ms per single task, '
+            f'{batched * 1000:.2f} ms per batch item')
+
+
+class IngredientCatalogTests(LocalStoresMixin, TestCase):
+    INGREDIENTS = 5000
+
+    @classmethod
+    def setUpTestData(cls):
+        Ingredient.objects.bulk_create(
+            [Ingredient(name=f'ингредиент {number:05d}',
+                        measurement_unit=('г', 'кг', 'шт')[number % 3])
+             for number in range(cls.INGREDIENTS)], batch_size=5000)
+        cls.ids = list(Ingredient.objects.values_list('pk', flat=True))
+
+    def make_catalog(self, check_interval=0):
+        return IngredientCatalog(settings.INGREDIENT_CATALOG['path'],
+                                 check_interval=check_interval)
+
+    def orm_lookup(self, ids):
+        return {pk: (name, unit) for pk, name, unit in
+                Ingredient.objects.filter(pk__in=ids).values_list(
+                    'pk', 'name', 'measurement_unit')}
+
+    def test_lookups_match_orm(self):
+        catalog = self.make_catalog()
+
+        self.assertEqual(len(catalog.snapshot()), self.INGREDIENTS)
+        self.assertEqual(catalog.get_many(self.ids), self.orm_lookup(self.ids))
+        self.assertIsNone(catalog.get(max(self.ids) + 1))
+
+    def test_snapshot_is_rebuilt_after_ingredient_change(self):
+        catalog = self.make_catalog()
+        catalog.snapshot()
+        ingredient = Ingredient.objects.get(pk=self.ids[0])
+        ingredient.name = 'переименован'
+        with self.captureOnCommitCallbacks(execute=True):
+            ingredient.save()
+
+        self.assertEqual(catalog.get(self.ids[0]), ('переименован', 'г'))
+        self.assertEqual(self.make_catalog().snapshot().version,
+                         catalog.snapshot().version)
+
+    def test_ingredient_missing_from_snapshot_is_read_from_db(self):
+        catalog = self.make_catalog(check_interval=60)
+        catalog.snapshot()
+        new = Ingredient.objects.create(name='новый', measurement_unit='шт')
+
+        self.assertEqual(catalog.get(new.pk), ('новый', 'шт'))
+
+    def test_stale_snapshot_does_not_report_deleted_ingredients(self):
+        catalog = self.make_catalog(check_interval=60)
+        catalog.snapshot()
+        Ingredient.objects.filter(pk=self.ids[0]).delete()
+        catalog_changed()
+
+        self.assertEqual(catalog.existing(self.ids[:2]), {self.ids[1]})
+
+    def test_snapshot_lookup_speed_against_orm(self):
+        """Бенчмарк: состав рецепта (20 ингредиентов) из снимка и из базы."""
+        catalog = self.make_catalog(check_interval=60)
+        catalog.snapshot()
+        batches = [self.ids[start:start + 20]
+                   for start in range(0, self.INGREDIENTS, 20)]
+
+        with self.assertNumQueries(0):
+            started = time.perf_counter()
+            for ids in batches:
+                catalog.get_many(ids)
+            snapshot_time = time.perf_counter() - started
+        started = time.perf_counter()
+        for ids in batches:
+            self.orm_lookup(ids)
+        orm_time = time.perf_counter() - started
+
+        self.assertLess(
+            snapshot_time * 3, orm_time,
+            f'{snapshot_time / len(batches) * 1e6:.0f} мкс из снимка, '
+            f'{orm_time / len(batches) * 1e6:.0f} мкс из базы на рецепт')
+
+
+class ResourceVersionTests(LocalStoresMixin, TestCase):
+    def test_version_changes_only_after_commit(self):
+        before = get_versions('ingredients', 'users')
+        with self.captureOnCommitCallbacks(execute=True):
+            Ingredient.objects.create(name='соль', measurement_unit='г')
+            User.objects.create_user(username='user',
+                                     email='user@example.com')
+            self.assertEqual(get_versions('ingredients', 'users'), before)
+
+        after = get_versions('ingredients', 'users')
+        self.assertGreater(after[0], before[0])
+        self.assertGreater(after[1], before[1])
+
+    def test_rolled_back_write_keeps_version(self):
+        before = get_versions('ingredients')
+        with self.captureOnCommitCallbacks() as callbacks:
+            Ingredient.objects.create(name='соль', measurement_unit='г')
+        callbacks.clear()
+
+        self.assertEqual(get_versions('ingredients'), before)
+
+
+class RecipeDocumentTests(LocalStoresMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        author = User.objects.create_user(
+            username='author', email='author@example.com',
+            password='password')
+        for name in ('first', 'second'):
+            Recipe.objects.create(author=author, name=name, text='text',
+                                  image='recipe.png', cooking_time=10)
+
+    def test_recipe_deleted_after_page_query_is_skipped(self):
+        recipes = list(Recipe.objects.order_by('pk'))
+        Recipe.objects.filter(pk=recipes[0].pk).delete()
+
+        rendered = render_many(recipes, None)
+
+        self.assertEqual([item['id'] for item in rendered], [recipes[1].pk])
+
+    def test_deleted_recipe_is_not_found(self):
+        recipe = Recipe.objects.first()
+        Recipe.objects.filter(pk=recipe.pk).delete()
+
+        with self.assertRaises(NotFound):
+            RecipeDocumentSerializer(recipe).data
+
+
+class ShoppingAggregateTests(LocalStoresMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user(
+            username='user', email='user@example.com', password='password')
+        self.recipe = Recipe.objects.create(
+            author=self.user, name='recipe', text='text',
+            image='recipe.png', cooking_time=10)
+        self.salt, self.sugar = Ingredient.objects.bulk_create([
+            Ingredient(name='соль', measurement_unit='г'),
+            Ingredient(name='сахар', measurement_unit='г'),
+        ])
+        IngredientRecipe.objects.create(
+            recipe=self.recipe, ingredient=self.salt, amount=5)
+
+    def totals(self):
+        return dict(ShoppingAggregate.objects.filter(
+            user=self.user, recipe_count__gt=0).values_list(
+            'ingredient_id', 'total_amount'))
+
+    def test_cart_follows_recipe_edit(self):
+        add_to_cart(self.user, self.recipe)
+        with transaction.atomic(), recipe_edit(self.recipe):
+            self.recipe.ingredients.clear()
+            IngredientRecipe.objects.create(
+                recipe=self.recipe, ingredient=self.sugar, amount=7)
+
+        self.assertEqual(self.totals(), {self.sugar.pk: 7})
+        remove_from_cart(self.user, self.recipe)
+        self.assertEqual(self.totals(), {})
+
+    def test_deltas_do_not_lock_users(self):
+        with CaptureQueriesContext(connection) as queries:
+            ShoppingAggregate.objects.apply_deltas(
+                [self.user.pk], {self.salt.pk: (5, 1)})
+
+        self.assertFalse(any('users_user' in query['sql']
+                             for query in queries))
+        self.assertEqual(self.totals(), {self.salt.pk: 5})
+
+
+@override_settings(FEED=dict(settings.FEED, fanout_max_followers=1))
+class FeedTests(LocalStoresMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.author, self.reader, self.other = User.objects.bulk_create([
+            User(username=name, email=f'{name}@example.com')
+            for name in ('author', 'reader', 'other')])
+        for user in (self.reader, self.other):
+            follow(user, self.author)
+
+    def test_recipes_stay_in_feed_after_author_is_demoted(self):
+        recipe = Recipe.objects.create(
+            author=self.author, name='recipe', text='text',
+            image='recipe.png', cooking_time=10)
+        self.assertIsNone(fan_out(recipe))
+        self.assertEqual(TimelineEntry.objects.count(), 0)
+
+        unfollow(self.other, self.author)
+        cache.delete(POPULAR_KEY)
+        with self.captureOnCommitCallbacks(execute=True):
+            page, _ = feed_page(self.reader, 10)
+
+        self.assertEqual([recipe_id for _, recipe_id in page], [recipe.pk])
+        self.assertTrue(TimelineEntry.objects.filter(
+            user=self.reader, recipe=recipe).exists())
+
+        cache.delete(POPULAR_KEY)
+        page, _ = feed_page(self.reader, 10)
+        self.assertNotIn(self.author.pk, popular_authors())
+        self.assertEqual([recipe_id for _, recipe_id in page], [recipe.pk])
+
+
+class TokenAuthCacheTests(LocalStoresMixin, TestCase):
+    """Кэш токенов: отзыв в другом процессе виден сразу, в общем кэше
+    нет объекта пользователя."""
+
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user(
+            username='user', email='user@example.com', password='password')
+        self.token = Token.objects.create(user=self.user)
+        self.key = self.token.key
+        self.auth = CachedTokenAuthentication()
+        patcher = mock.patch.object(token_cache, '_shared_ttl', 60)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def authenticate(self):
+        return self.auth.authenticate_credentials(self.key)
+
+    def model_queries(self):
+        """Запросы к таблицам моделей; кэш Django в тестах тоже в базе."""
+        with CaptureQueriesContext(connection) as queries:
+            result = self.authenticate()
+        return result, [query['sql'] for query in queries
+                        if 'django_cache' not in query['sql']]
+
+    def test_warm_lookup_skips_database(self):
+        self.authenticate()
+
+        (user, token), queries = self.model_queries()
+        self.assertEqual(queries, [])
+        self.assertEqual((user.pk, token.key), (self.user.pk, self.key))
+
+    def test_shared_cache_holds_only_ids(self):
+        self.authenticate()
+
+        value = cache.get(SHARED_KEY.format(token_resource(self.key)))
+        self.assertEqual(value[:2], (self.user.pk, self.token.created))
+        self.assertNotIn(self.user.password, repr(value))
+
+    def test_shared_entry_is_used_by_other_process(self):
+        self.authenticate()
+        token_cache._entries.pop(self.key)
+
+        (user, token), queries = self.model_queries()
+        self.assertEqual(len(queries), 1)
+        self.assertIn('users_user', queries[0])
+        self.assertEqual((user.pk, token.created),
+                         (self.user.pk, self.token.created))
+
+    def test_revocation_in_other_process_applies_at_once(self):
+        self.authenticate()
+        # Другой процесс деактивировал пользователя: его сигнал меняет
+        # только версию в общем кэше, локальная запись здесь осталась
+        User.objects.filter(pk=self.user.pk).update(is_active=False)
+        bump(token_resource(self.key))
+
+        with self.assertRaises(AuthenticationFailed):
+            self.authenticate()
+
+    def test_logout_revokes_token(self):
+        self.authenticate()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.token.delete()
+
+        with self.assertRaises(AuthenticationFailed):
+            self.authenticate()
+
+
+class UserEndpointsTests(LocalStoresMixin, TestCase):
+    """CustomUserViewSet не ломает остальные эндпоинты djoser."""
+
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user(
+            username='user', email='user@example.com', password='password')
+        self.client = APIClient()
+
+    def test_list_and_me_use_custom_serializer(self):
+        self.client.force_authenticate(self.user)
+
+        self.assertIn('is_subscribed',
+                      self.client.get('/api/users/').data[0])
+        self.assertFalse(self.client.get('/api/users/me/')
+                         .data['is_subscribed'])
+
+    def test_reset_password(self):
+        response = self.client.post('/api/users/reset_password/',
+                                    {'email': 'user@example.com'})
+
+        self.assertEqual(response.status_code, 204)
+
+    def test_set_password(self):
+        self.client.force_authenticate(self.user)
+        response = self.client.post('/api/users/set_password/', {
+            'current_password': 'password', 'new_password': 'n3w-Passw0rd'})
+
+        self.assertEqual(response.status_code, 204)
+        self.user.refresh_from_db()
+        self.assertTrue(self.user.check_password('n3w-Passw0rd'))
+
+    def test_create(self):
+        response = self.client.post('/api/users/', {
+            'email': 'new@example.com', 'username': 'new',
+            'first_name': 'Имя', 'last_name': 'Фамилия',
+            'password': 'n3w-Passw0rd'})
+
+        self.assertEqual(response.status_code, 201)
+
+
+class HttpClientTests(SimpleTestCase):
+    def setUp(self):
+        self.stub = UpstreamStub()
+        self.addCleanup(self.stub.close)
+        self.host = urlsplit(self.stub.url).netloc
+
+    def make_client(self, **kwargs):
+        client = HttpClient(**dict({'backoff_factor': 0}, **kwargs))
+        self.addCleanup(client.close)
+        return client
+
+    def test_connection_is_kept_alive(self):
+        client = self.make_client()
+        for _ in range(5):
+            client.get(f'{self.stub.url}/ping')
+
+        self.assertEqual(len({port for _, port in self.stub.requests}), 1)
+
+    def test_retries_429_and_5xx(self):
+        self.stub.statuses.extend([503, 429])
+        response = self.make_client(retries=3).get(f'{self.stub.url}/ping')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(self.stub.requests), 3)
+
+    def test_returns_last_error_when_retries_run_out(self):
+        self.stub.statuses.extend([502, 502, 502])
+        client = self.make_client(retries=2)
+        response = client.get(f'{self.stub.url}/ping')
+
+        self.assertEqual(response.status_code, 502)
+        self.assertEqual(len(self.stub.requests), 3)
+        self.assertEqual(client.metrics()[self.host]['errors'], 1)
+
+    def test_short_retry_after_is_waited(self):
+        self.stub.statuses.append(429)
+        self.stub.retry_after = '0'
+        response = self.make_client(max_retry_after=1).get(
+            f'{self.stub.url}/ping')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(self.stub.requests), 2)
+
+    def test_long_retry_after_fails_fast(self):
+        self.stub.statuses.extend([429, 429])
+        self.stub.retry_after = '3600'
+        started = time.monotonic()
+        response = self.make_client(max_retry_after=1).get(
+            f'{self.stub.url}/ping')
+
+        self.assertLess(time.monotonic() - started, 1)
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(retry_after(response), 3600)
+        self.assertEqual(len(self.stub.requests), 1)
+
+    def test_read_timeout(self):
+        self.stub.delay = 0.3
+        client = self.make_client(timeout=(1, 0.05), retries=0)
+
+        with self.assertRaises(requests.RequestException):
+            client.get(f'{self.stub.url}/slow')
+        self.assertEqual(client.metrics()[self.host]['errors'], 1)
+
+    def test_circuit_opens_and_recovers(self):
+        self.stub.statuses.extend([500, 500])
+        client = self.make_client(retries=0, failure_threshold=2,
+                                  reset_timeout=0.2)
+        for _ in range(2):
+            client.get(f'{self.stub.url}/ping')
+
+        with self.assertRaises(CircuitOpenError):
+            client.get(f'{self.stub.url}/ping')
+        self.assertEqual(len(self.stub.requests), 2)
+        metrics = client.metrics()[self.host]
+        self.assertEqual((metrics['circuit'], metrics['rejected']),
+                         ('open', 1))
+
+        time.sleep(0.25)
+        self.assertEqual(client.get(f'{self.stub.url}/ping').status_code,
+                         200)
+        self.assertEqual(client.metrics()[self.host]['circuit'], 'closed')
+
+    def test_latency_metrics_per_host(self):
+        client = self.make_client()
+        for _ in range(3):
+            client.get(f'{self.stub.url}/ping')
+
+        metrics = client.metrics()[self.host]
+        self.assertEqual(metrics['requests'], 3)
+        self.assertGreater(metrics['max_latency'], 0)
+        self.assertLessEqual(metrics['p50_latency'], metrics['max_latency'])
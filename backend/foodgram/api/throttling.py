@@ -0,0 +1,287 @@
+import fcntl
+import functools
+import logging
+import math
+import os
+import sqlite3
+import threading
+import time
+
+from django.conf import settings
+from rest_framework.exceptions import APIException
+from rest_framework.throttling import SimpleRateThrottle
+
+LOGGER = logging.getLogger(__name__)
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS windows (
+    key TEXT NOT NULL,
+    start INTEGER NOT NULL,
+    hits INTEGER NOT NULL,
+    expires REAL NOT NULL,
+    PRIMARY KEY (key, start)
+);
+CREATE INDEX IF NOT EXISTS windows_expires ON windows (expires);
+'''
+
+# Раз в сколько обращений процесс чистит отжившие окна
+CLEANUP_EVERY = 1000
+
+
+class ThrottleStats:
+    """Счётчики процесса: пропущено и отклонено по классам эндпоинтов,
+    для троттлинга и для контроля одновременных запросов."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stats = {}
+
+    def observe(self, kind, scope, outcome):
+        with self._lock:
+            stats = self._stats.setdefault(kind, {}).setdefault(scope, {})
+            stats[outcome] = stats.get(outcome, 0) + 1
+
+    def stats(self):
+        with self._lock:
+            return {kind: {scope: dict(stats)
+                           for scope, stats in scopes.items()}
+                    for kind, scopes in self._stats.items()}
+
+
+throttle_stats = ThrottleStats()
+
+
+def sliding_window_wait(previous, current, limit, period, elapsed):
+    """Через сколько секунд скользящее окно пропустит ещё один запрос.
+
+    Окно оценивается по двум фиксированным: текущему (current запросов,
+    прошло elapsed секунд) и предыдущему, вклад которого убывает
+    линейно. 0 — запрос можно пропустить сейчас.
+    """
+    weight = 1 - elapsed / period
+    if previous * weight + current + 1 <= limit:
+        return 0.0
+    if current + 1 > limit:
+        return period - elapsed
+    # Доля предыдущего окна должна упасть до (limit - current - 1)
+    target = 1 - (limit - current - 1) / previous
+    return max(0.0, (target - elapsed / period) * period)
+
+
+class SlidingWindowStore:
+    """Счётчики скользящих окон в общем файле SQLite узла.
+
+    Обращение — одна транзакция BEGIN IMMEDIATE на соединении потока:
+    все процессы gunicorn на узле видят одни и те же счётчики, а
+    в журнале WAL читатели не ждут писателя.
+    """
+
+    def __init__(self, path):
+        self._path = path
+        self._local = threading.local()
+        self._calls = 0
+        self._db().executescript(SCHEMA)
+
+    def _db(self):
+        db = getattr(self._local, 'db', None)
+        if db is None:
+            db = sqlite3.connect(self._path, timeout=5,
+                                 isolation_level=None)
+            db.execute('PRAGMA journal_mode=WAL')
+            db.execute('PRAGMA synchronous=NORMAL')
+            self._local.db = db
+        return db
+
+    def hit(self, windows):
+        """Учитывает запрос во всех окнах [(ключ, лимит, период)], если
+        все они позволяют; иначе не учитывает нигде. Возвращает 0 или
+        сколько секунд ждать — по самому дальнему окну."""
+        db = self._db()
+        now = time.time()
+        db.execute('BEGIN IMMEDIATE')
+        try:
+            waits = []
+            for key, limit, period in windows:
+                start = int(now // period * period)
+                hits = dict(db.execute(
+                    'SELECT start, hits FROM windows WHERE key = ? '
+                    'AND start IN (?, ?)', (key, start, start - period)))
+                waits.append(sliding_window_wait(
+                    hits.get(start - period, 0), hits.get(start, 0), limit,
+                    period, now - start))
+            wait = max(waits, default=0.0)
+            if not wait:
+                db.executemany(
+                    'INSERT INTO windows (key, start, hits, expires) '
+                    'VALUES (?, ?, 1, ?) ON CONFLICT (key, start) '
+                    'DO UPDATE SET hits = hits + 1',
+                    [(key, int(now // period * period),
+                      int(now // period * period) + 2 * period)
+                     for key, _, period in windows])
+            db.execute('COMMIT')
+        except sqlite3.Error:
+            db.execute('ROLLBACK')
+            raise
+        self._calls += 1
+        if self._calls % CLEANUP_EVERY == 0:
+            db.execute('DELETE FROM windows WHERE expires < ?', (now,))
+        return wait
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_store():
+    """SlidingWindowStore процесса, создаётся при первом обращении."""
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = SlidingWindowStore(settings.THROTTLE['path'])
+    return _store
+
+
+class SlidingWindowThrottle(SimpleRateThrottle):
+    """Троттлинг класса дорогих эндпоинтов по скользящему окну.
+
+    Класс задаёт scope; частоты берутся из DEFAULT_THROTTLE_RATES по
+    ключам '<scope>.user' (пользователь, для анонимов — адрес) и
+    '<scope>.ip' (адрес: много аккаунтов за одним адресом). Оба окна
+    проверяются в одной транзакции, и запрос, отклонённый одним, не
+    расходует другое. Нет частоты — нет ограничения. История запросов
+    не гоняется через кэш Django, как у стандартных троттлов DRF:
+    в SlidingWindowStore лежат только счётчики.
+    """
+
+    KINDS = ('user', 'ip')
+
+    def __init__(self):
+        self.windows = {}
+        for kind in self.KINDS:
+            rate = self.THROTTLE_RATES.get(f'{self.scope}.{kind}')
+            if rate is not None:
+                self.windows[kind] = self.parse_rate(rate)
+        self._wait = 0.0
+
+    def allow_request(self, request, view):
+        if not self.windows:
+            return True
+        idents = {'ip': self.get_ident(request)}
+        idents['user'] = (f'u{request.user.pk}'
+                          if request.user and request.user.is_authenticated
+                          else idents['ip'])
+        self._wait = get_store().hit([
+            (f'{self.scope}:{kind}:{idents[kind]}', limit, period)
+            for kind, (limit, period) in self.windows.items()
+        ])
+        throttle_stats.observe('throttle', self.scope,
+                               'rejected' if self._wait else 'allowed')
+        return not self._wait
+
+    def wait(self):
+        return self._wait
+
+
+def scoped_throttles(scope):
+    """Троттл класса эндпоинтов scope для throttle_classes."""
+    return [type('SlidingWindowThrottle', (SlidingWindowThrottle,),
+                 {'scope': scope})]
+
+
+class Overloaded(APIException):
+    """Класс эндпоинтов занят: все слоты одновременных запросов заняты."""
+
+    status_code = 503
+    default_detail = 'Сервис перегружен, повторите запрос позже.'
+    default_code = 'overloaded'
+
+    def __init__(self, wait):
+        super().__init__()
+        # DRF ставит заголовок Retry-After из wait
+        self.wait = math.ceil(wait)
+
+
+def parse_slots(value):
+    """Разбирает строку 'класс=слоты,...' в {класс: слоты}."""
+    slots = {}
+    for item in filter(None, (part.strip() for part in value.split(','))):
+        name, _, count = item.partition('=')
+        slots[name.strip()] = int(count)
+    return slots
+
+
+class AdmissionController:
+    """Ограничение одновременных запросов класса эндпоинтов на узле.
+
+    У класса limit слотов — файлов, которые процесс держит под
+    неблокирующим flock, пока обрабатывает запрос. Упавший процесс
+    отпускает слот вместе с дескриптором, так что слоты не протекают.
+    Нет свободного слота — запрос сразу отклоняется с 503 и Retry-After,
+    а не копится в очереди gunicorn.
+    """
+
+    def __init__(self, directory, limits, retry_after=1.0):
+        self._directory = directory
+        self._limits = limits
+        self._retry_after = retry_after
+        os.makedirs(directory, exist_ok=True)
+
+    def acquire(self, name):
+        """Открытый файл занятого слота или None, если класс без лимита."""
+        if name not in self._limits:
+            return None
+        for slot in range(self._limits[name]):
+            slot_file = open(
+                os.path.join(self._directory, f'{name}.{slot}.lock'), 'a')
+            try:
+                fcntl.flock(slot_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                slot_file.close()
+                continue
+            throttle_stats.observe('admission', name, 'admitted')
+            return slot_file
+        throttle_stats.observe('admission', name, 'rejected')
+        LOGGER.warning('Admission rejected for %s', name)
+        raise Overloaded(self._retry_after)
+
+    @staticmethod
+    def release(slot_file):
+        if slot_file is not None:
+            fcntl.flock(slot_file, fcntl.LOCK_UN)
+            slot_file.close()
+
+
+_controller = None
+_controller_lock = threading.Lock()
+
+
+def get_controller():
+    """AdmissionController процесса, создаётся при первом обращении."""
+    global _controller
+    if _controller is None:
+        with _controller_lock:
+            if _controller is None:
+                config = settings.ADMISSION
+                _controller = AdmissionController(
+                    directory=config['dir'],
+                    limits=parse_slots(config['slots']),
+                    retry_after=config['retry_after'],
+                )
+    return _controller
+
+
+def admission(name):
+    """Декоратор view: не больше ADMISSION-лимита запросов класса name
+    одновременно на узле."""
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            controller = get_controller()
+            slot = controller.acquire(name)
+            try:
+                return view(*args, **kwargs)
+            finally:
+                controller.release(slot)
+        return wrapper
+    return decorator
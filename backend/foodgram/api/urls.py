@@ -1,10 +1,12 @@
 from django.urls import include, path
 from rest_framework import routers
 
-from api.views import (IngredientViewSet,
+from api.views import (CustomUserViewSet, IngredientViewSet,
                        ListSubscribeViewSet, RecipeViewSet,
-                       download_shopping_cart, favorite, run_api_task,
-                       shopping, subscribe, task_status)
+                       batch_status_view, download_shopping_cart,
+                       download_shopping_cart_pdf, favorite, metrics,
+                       run_api_batch, run_api_task, shopping, subscribe,
+                       task_status)
 
 router_v1 = routers.DefaultRouter()
 
@@ -12,15 +14,23 @@ router_v1.register(r'ingredients', IngredientViewSet, basename='ingredients')
 router_v1.register(r'users/subscriptions', ListSubscribeViewSet,
                    basename='get_subscribe')
 router_v1.register(r'recipes', RecipeViewSet, basename='recipes')
+router_v1.register(r'users', CustomUserViewSet, basename='users')
 
 function_urls = [
     path('recipes/download_shopping_cart/', download_shopping_cart,
          name='download_shopping_cart'),
+    path('recipes/download_shopping_cart/pdf/', download_shopping_cart_pdf,
+         name='download_shopping_cart_pdf'),
     path('recipes/<int:recipe_id>/favorite/', favorite, name='favorite'),
     path('users/<int:user_id>/subscribe/', subscribe, name='subscribe'),
     path('recipes/<int:recipe_id>/shopping_cart/', shopping, name='shopping'),
+    path('tasks/batch/<str:batch_id>/status/', batch_status_view,
+         name='batch_status'),
     path('tasks/<str:task_name>/', run_api_task, name='run_api_task'),
+    path('tasks/<str:task_name>/batch/', run_api_batch,
+         name='run_api_batch'),
     path('tasks/<str:task_id>/status/', task_status, name='task_status'),
+    path('metrics/', metrics, name='metrics'),
 
 ]
 
@@ -1,25 +1,40 @@
+from django.conf import settings as django_settings
 from django.contrib.auth import get_user_model
 from django.db.models import Exists, OuterRef, Value
-from django.http import HttpResponse
+from django.core.files.storage import default_storage
+from django.http import FileResponse, HttpResponse
 from django.shortcuts import get_object_or_404
+from django.urls import reverse
 from django_filters.rest_framework import DjangoFilterBackend
-from djoser.conf import settings
 from djoser.views import UserViewSet
+from celery import uuid
 from celery.result import AsyncResult
 from rest_framework import permissions, status, viewsets, mixins
-from rest_framework.decorators import action, api_view, permission_classes
-from rest_framework.permissions import IsAuthenticated
+from rest_framework.decorators import (action, api_view, permission_classes,
+                                       throttle_classes)
+from rest_framework.permissions import IsAdminUser, IsAuthenticated
 from rest_framework.response import Response
 
+from api.batches import batch_status, submit_batch
+from api.cache import (claim_inflight, get_cached_result, get_task_error,
+                       get_task_result, normalize_params, release_inflight,
+                       split_api_response)
+from api.conditional import ConditionalGetMixin, get_versions, viewer_resource
+from api.documents import RecipeDocumentSerializer
+from api.feed import follow, unfollow
 from api.filters import IngredientFilter, RecipeFilter
+from api.metrics import collect
+from api.pdf import cart_digest, get_artifact
+from api.pagination import FeedPagination
 from api.permissions import IsAuthor
 from api.serializers import (CustomUserSerializer, FavoriteSerializer,
-                             FollowSerializer, IngredientRecipe,
-                             IngredientSerializer, RecipeSerializer,
+                             FollowSerializer, IngredientSerializer,
                              RecipeWriteSerializer, ShoppingCardSerializer)
-from api.tasks import fetch_holidays, fetch_weather
+from api.shopping import add_to_cart, cart_rows, remove_from_cart
+from api.tasks import fetch_holidays, fetch_weather, render_shopping_pdf
+from api.throttling import admission, scoped_throttles
 
-from recipes.models import (Favorite, Follow, Ingredient, Recipe, ShoppingList)
+from recipes.models import Favorite, Ingredient, Recipe, ShoppingList
 
 User = get_user_model()
 TASKS_BY_NAME = {
@@ -43,18 +58,22 @@ class ListViewSet(
     pass
 
 
-class IngredientViewSet(ListRetriveViewSet):
+class IngredientViewSet(ConditionalGetMixin, ListRetriveViewSet):
     queryset = Ingredient.objects.all()
     serializer_class = IngredientSerializer
     pagination_class = None
     search_fields = ('^name',)
     filterset_class = IngredientFilter
 
+    def get_validator_parts(self):
+        return get_versions('ingredients')
 
-class CustomUserViewSet(UserViewSet):
+
+class CustomUserViewSet(ConditionalGetMixin, UserViewSet):
     serializer_class = CustomUserSerializer
     queryset = User.objects.all()
     permission_classes = (permissions.IsAuthenticatedOrReadOnly,)
+    conditional_resources = ('users',)
 
     def get_serializer_context(self):
         context = super().get_serializer_context()
@@ -62,15 +81,11 @@ class CustomUserViewSet(UserViewSet):
         return context
 
     def get_serializer_class(self):
-        if self.action == "create":
-            if settings.USER_CREATE_PASSWORD_RETYPE:
-                return settings.SERIALIZERS.user_create_password_retype
-            return settings.SERIALIZERS.user_create
-        if self.action == "set_password":
-            if settings.SET_PASSWORD_RETYPE:
-                return settings.SERIALIZERS.set_password_retype
-            return settings.SERIALIZERS.set_password
-        return self.serializer_class
+        # Остальные действия djoser (reset_password, activation и т.д.)
+        # работают со своими сериализаторами
+        if self.action in ("list", "retrieve", "me"):
+            return self.serializer_class
+        return super().get_serializer_class()
 
     @action(["get"], detail=False)
     def me(self, request, *args, **kwargs):
@@ -78,15 +93,58 @@ class CustomUserViewSet(UserViewSet):
         return self.retrieve(request, *args, **kwargs)
 
 
-class RecipeViewSet(viewsets.ModelViewSet):
+class RecipeViewSet(ConditionalGetMixin, viewsets.ModelViewSet):
     filter_backends = (DjangoFilterBackend, )
     filterset_class = RecipeFilter
     ordering = ('-pub_date',)
+    conditional_resources = ('recipes', 'users', 'ingredients')
+
+    def get_validator_parts(self):
+        if self.action != 'retrieve':
+            return super().get_validator_parts()
+        try:
+            updated_at = Recipe.objects.filter(
+                pk=self.kwargs['pk']
+            ).values_list('updated_at', flat=True).first()
+        except (TypeError, ValueError):
+            updated_at = None
+        if updated_at is None:
+            return None
+        return [
+            updated_at.timestamp(),
+            *get_versions('users', 'ingredients',
+                          viewer_resource(self.request.user)),
+        ]
+
+    def _is_deep_page(self):
+        """Страница списка далеко от начала: дорогой OFFSET в базе."""
+        page = self.request.query_params.get("page", "")
+        limit = self.request.query_params.get("limit", "")
+        return (self.action == "list" and page.isdigit() and limit.isdigit()
+                and (int(page) - 1) * int(limit)
+                >= django_settings.RECIPES_DEEP_OFFSET)
+
+    def get_throttles(self):
+        if self._is_deep_page():
+            return [throttle() for throttle in
+                    scoped_throttles("recipes_deep")]
+        return super().get_throttles()
+
+    def list(self, request, *args, **kwargs):
+        if self._is_deep_page():
+            return admission("recipes_deep")(super().list)(
+                request, *args, **kwargs)
+        return super().list(request, *args, **kwargs)
 
     def get_queryset(self):
         user = self.request.user
+        recipes = Recipe.objects.all()
+        if self.request.method == 'GET':
+            # Тело ответа берётся из документа рецепта
+            recipes = recipes.only('id', 'author_id', 'pub_date',
+                                   'updated_at')
         if user.is_authenticated:
-            return Recipe.objects.annotate(
+            return recipes.annotate(
                 is_favorited=Exists(
                     Favorite.objects.filter(user=user, recipe=OuterRef('pk'))
                 ),
@@ -94,18 +152,20 @@ class RecipeViewSet(viewsets.ModelViewSet):
                     ShoppingList.objects.filter(user=user,
                                                 recipe=OuterRef('pk'))
                 )
-            ).all()
-        return Recipe.objects.annotate(
+            )
+        return recipes.annotate(
             is_favorited=Value(False),
             is_in_shopping_cart=Value(False)
-        ).all()
+        )
 
     def get_serializer_class(self):
         if self.request.method == 'GET':
-            return RecipeSerializer
+            return RecipeDocumentSerializer
         return RecipeWriteSerializer
 
     def get_permissions(self):
+        if self.action == 'feed':
+            return (permissions.IsAuthenticated(),)
         if self.request.method in permissions.SAFE_METHODS:
             return (permissions.AllowAny(),)
         return (permissions.IsAuthenticated(), IsAuthor(),)
@@ -113,6 +173,14 @@ class RecipeViewSet(viewsets.ModelViewSet):
     def perform_create(self, serializer):
         serializer.save(author=self.request.user)
 
+    @action(["get"], detail=False, pagination_class=FeedPagination)
+    def feed(self, request):
+        """Рецепты авторов, на которых подписан пользователь."""
+        page = self.paginator.paginate_feed(request, request.user,
+                                            self.get_queryset())
+        serializer = self.get_serializer(page, many=True)
+        return self.get_paginated_response(serializer.data)
+
     def get_serializer_context(self):
         context = super().get_serializer_context()
         context["request"] = self.request
@@ -171,17 +239,14 @@ def subscribe(request, user_id):
             context={'request': request, 'user_id': user_id}
         )
         serializer.is_valid(raise_exception=True)
-        serializer.save(user=request.user, following=following)
+        serializer.instance = follow(request.user, following)
         return Response(serializer.data, status=status.HTTP_201_CREATED)
     serializer = FollowSerializer(
         data=request.data,
         context={'request': request, 'user_id': user_id}
     )
     serializer.is_valid(raise_exception=True)
-    Follow.objects.filter(
-        user=request.user,
-        following=following
-    ).delete()
+    unfollow(request.user, following)
     return Response(status=status.HTTP_204_NO_CONTENT)
 
 
@@ -194,37 +259,28 @@ def shopping(request, recipe_id):
             context={'request': request, 'recipe_id': recipe_id}
         )
         serializer.is_valid(raise_exception=True)
-        serializer.save(user=request.user,
-                        recipe=get_object_or_404(Recipe, id=recipe_id))
+        serializer.instance = add_to_cart(
+            request.user, get_object_or_404(Recipe, id=recipe_id))
         return Response(serializer.data, status=status.HTTP_201_CREATED)
     serializer = ShoppingCardSerializer(
         data=request.data,
         context={'request': request, 'recipe_id': recipe_id}
     )
     serializer.is_valid(raise_exception=True)
-    ShoppingList.objects.filter(
-        user=request.user,
-        recipe=get_object_or_404(Recipe, id=recipe_id)
-    ).delete()
+    remove_from_cart(request.user, get_object_or_404(Recipe, id=recipe_id))
     return Response(status=status.HTTP_204_NO_CONTENT)
 
 
 @api_view(["GET"])
 @permission_classes([IsAuthenticated])
+@throttle_classes(scoped_throttles("shopping_download"))
+@admission("shopping")
 def download_shopping_cart(request):
-    ingredients = IngredientRecipe.objects.filter(
-        recipe__shopping_recipe__user=request.user
-    )
-    shopping_data = {}
-    for ingredient in ingredients:
-        if str(ingredient.ingredient) in shopping_data:
-            shopping_data[f'{str(ingredient.ingredient)}'] += ingredient.amount
-        else:
-            shopping_data[f'{str(ingredient.ingredient)}'] = ingredient.amount
     filename = "shopping-list.txt"
-    content = ''
-    for ingredient, amount in shopping_data.items():
-        content += f"{ingredient} - {amount};\n"
+    content = ''.join(
+        f"{name}, {unit} - {amount};\n"
+        for name, unit, amount in cart_rows(request.user)
+    )
     response = HttpResponse(content, content_type='text/plain',
                             status=status.HTTP_200_OK)
     response['Content-Disposition'] = 'attachment; filename={0}'.format(
@@ -232,8 +288,34 @@ def download_shopping_cart(request):
     return response
 
 
+@api_view(["GET"])
+@permission_classes([IsAuthenticated])
+@throttle_classes(scoped_throttles("shopping_download"))
+@admission("shopping")
+def download_shopping_cart_pdf(request):
+    rows = cart_rows(request.user)
+    digest = cart_digest(rows)
+    name = get_artifact(digest)
+    if name is not None:
+        return FileResponse(default_storage.open(name),
+                            as_attachment=True,
+                            filename="shopping-list.pdf",
+                            content_type="application/pdf")
+    new_task_id = uuid()
+    task_id = claim_inflight("shopping_pdf", {"digest": digest}, new_task_id)
+    if task_id == new_task_id:
+        try:
+            render_shopping_pdf.apply_async(args=(rows, digest),
+                                            task_id=task_id)
+        except Exception:
+            release_inflight("shopping_pdf", {"digest": digest}, task_id)
+            raise
+    return Response({"task_id": task_id}, status=status.HTTP_202_ACCEPTED)
+
+
 @api_view(["POST"])
 @permission_classes([IsAuthenticated])
+@throttle_classes(scoped_throttles("api_tasks"))
 def run_api_task(request, task_name):
     task = TASKS_BY_NAME.get(task_name)
     if not task:
@@ -241,17 +323,108 @@ def run_api_task(request, task_name):
             {"detail": "Unknown task name."},
             status=status.HTTP_404_NOT_FOUND,
         )
-    async_result = task.delay(request.data or {})
-    return Response({"task_id": async_result.id}, status=status.HTTP_202_ACCEPTED)
+    try:
+        api_params = normalize_params(task_name, request.data)
+    except (TypeError, ValueError):
+        return Response(
+            {"detail": "Invalid task params."},
+            status=status.HTTP_400_BAD_REQUEST,
+        )
+    cached = get_cached_result(task_name, api_params)
+    if cached is not None:
+        return Response(
+            {"task_id": cached["task_id"], "cached": True},
+            status=status.HTTP_200_OK,
+        )
+    new_task_id = uuid()
+    task_id = claim_inflight(task_name, api_params, new_task_id)
+    if task_id == new_task_id:
+        try:
+            task.apply_async(args=(api_params,), task_id=task_id)
+        except Exception:
+            release_inflight(task_name, api_params, task_id)
+            raise
+    return Response({"task_id": task_id}, status=status.HTTP_202_ACCEPTED)
+
+
+@api_view(["POST"])
+@permission_classes([IsAuthenticated])
+@throttle_classes(scoped_throttles("api_tasks"))
+def run_api_batch(request, task_name):
+    if task_name not in TASKS_BY_NAME:
+        return Response(
+            {"detail": "Unknown task name."},
+            status=status.HTTP_404_NOT_FOUND,
+        )
+    items = request.data
+    max_items = django_settings.API_BATCH["max_items"]
+    if not isinstance(items, list) or not items:
+        return Response(
+            {"detail": "Expected a non-empty list of task params."},
+            status=status.HTTP_400_BAD_REQUEST,
+        )
+    if len(items) > max_items:
+        return Response(
+            {"detail": f"A batch can hold at most {max_items} items."},
+            status=status.HTTP_400_BAD_REQUEST,
+        )
+    params_list = []
+    for index, item in enumerate(items):
+        try:
+            params_list.append(normalize_params(task_name, item))
+        except (TypeError, ValueError):
+            return Response(
+                {"detail": f"Invalid task params at index {index}."},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+    batch_id, queued = submit_batch(task_name, params_list)
+    return Response(
+        {"batch_id": batch_id, "total": len(params_list), "queued": queued},
+        status=status.HTTP_202_ACCEPTED,
+    )
+
+
+@api_view(["GET"])
+@permission_classes([IsAuthenticated])
+def batch_status_view(request, batch_id):
+    with_results = request.query_params.get("results", "1") not in (
+        "0", "false")
+    payload = batch_status(batch_id, with_results=with_results)
+    if payload is None:
+        return Response(
+            {"detail": "Unknown batch id."},
+            status=status.HTTP_404_NOT_FOUND,
+        )
+    return Response(payload, status=status.HTTP_200_OK)
 
 
 @api_view(["GET"])
 @permission_classes([IsAuthenticated])
 def task_status(request, task_id):
-    result = AsyncResult(task_id)
-    payload = {"task_id": task_id, "status": result.status}
-    if result.successful():
-        payload["result"] = result.result
-    elif result.failed():
-        payload["error"] = str(result.result)
+    cached = get_task_result(task_id)
+    error = get_task_error(task_id) if cached is None else None
+    if cached is not None:
+        payload = {"task_id": task_id, "status": "SUCCESS", "result": cached}
+    elif error is not None:
+        payload = {"task_id": task_id, "status": "FAILURE", "error": error}
+    else:
+        result = AsyncResult(task_id)
+        payload = {"task_id": task_id, "status": result.status}
+        if result.successful():
+            payload["result"] = result.result
+        elif result.failed():
+            payload["error"] = str(result.result)
+    task_result, response = split_api_response(payload.get("result"))
+    if response is not None:
+        payload["result"] = task_result
+        payload.update(response)
+    elif isinstance(task_result, dict) and "file" in task_result:
+        payload["download_url"] = request.build_absolute_uri(
+            reverse("download_shopping_cart_pdf"))
     return Response(payload, status=status.HTTP_200_OK)
+
+
+@api_view(["GET"])
+@permission_classes([IsAdminUser])
+def metrics(request):
+    return Response(collect(), status=status.HTTP_200_OK)
@@ -1,5 +1,7 @@
 import os
 
+from celery.schedules import schedule
+
 
 RABBITMQ_HOST = os.getenv("RABBITMQ_HOST", "rabbitmq")
 RABBITMQ_PORT = os.getenv("RABBITMQ_PORT", "5672")
@@ -23,3 +25,12 @@ task_routes = {
     "api.tasks.fetch_holidays": {"queue": "holidays"},
     "api.tasks.fetch_weather": {"queue": "weather"},
 }
+
+# Периодические задачи; beat запускается вместе с воркером (-B)
+beat_schedule = {
+    "collect-media-garbage": {
+        "task": "api.tasks.collect_media_garbage",
+        "schedule": schedule(
+            int(os.getenv("MEDIA_GC_INTERVAL", 60 * 60 * 24))),
+    },
+}
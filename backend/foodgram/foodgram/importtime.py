@@ -0,0 +1,80 @@
+import os
+import re
+import subprocess
+import sys
+import time
+from collections import defaultdict
+
+from django.conf import settings
+
+# Что импортирует процесс до готовности: gunicorn — приложение и URLconf
+# (её грузит первый запрос), воркер — Django и модули задач
+TARGETS = {
+    'wsgi': (
+        'import foodgram.wsgi\n'
+        'from django.urls import get_resolver\n'
+        'get_resolver().url_patterns\n'
+    ),
+    'celery': (
+        'from foodgram.celery import app\n'
+        'app.loader.import_default_modules()\n'
+    ),
+}
+
+LINE = re.compile(r'import time:\s+(\d+) \|\s+(\d+) \| *(\S+)')
+
+
+class ImportProfile:
+    """Замер импорта: records — тройки (модуль, собственное и накопленное
+    время импорта в мкс)."""
+
+    def __init__(self, target, wall_ms, records):
+        self.target = target
+        self.wall_ms = wall_ms
+        self.records = records
+
+    @property
+    def total_ms(self):
+        return sum(record[1] for record in self.records) / 1000
+
+    def top(self, limit):
+        """Модули с наибольшим накопленным временем импорта."""
+        return sorted(self.records, key=lambda record: record[2],
+                      reverse=True)[:limit]
+
+    def by_package(self, limit):
+        """Собственное время импорта по пакетам верхнего уровня, мс."""
+        packages = defaultdict(int)
+        for name, self_us, _ in self.records:
+            packages[name.split('.')[0]] += self_us
+        return sorted(((name, us / 1000) for name, us in packages.items()),
+                      key=lambda item: item[1], reverse=True)[:limit]
+
+
+def parse(output):
+    """Записи из вывода python -X importtime."""
+    return [
+        (match[3], int(match[1]), int(match[2]))
+        for match in map(LINE.match, output.splitlines()) if match
+    ]
+
+
+def measure(target):
+    """Холодный старт target в отдельном интерпретаторе."""
+    env = dict(os.environ)
+    env.setdefault('DJANGO_SETTINGS_MODULE', 'foodgram.settings')
+    started = time.perf_counter()
+    completed = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', TARGETS[target]],
+        cwd=settings.BASE_DIR, env=env, capture_output=True, text=True,
+    )
+    wall_ms = (time.perf_counter() - started) * 1000
+    if completed.returncode:
+        raise RuntimeError(completed.stderr.strip().splitlines()[-1])
+    return ImportProfile(target, wall_ms, parse(completed.stderr))
+
+
+def best_of(target, repeat):
+    """Лучший из repeat замеров: меньше всего шума от соседей по CPU."""
+    return min((measure(target) for _ in range(repeat)),
+               key=lambda profile: profile.total_ms)
@@ -36,12 +36,18 @@ INSTALLED_APPS = [
     'api.apps.ApiConfig',
     'recipes.apps.RecipesConfig',
     'users.apps.UsersConfig',
-    'colorfield',
-    'django_extensions',
 ]
 
+# Приложения для разработки (shell_plus, graph_models и т.п.) не нужны
+# в подах и воркере и только удлиняют их старт: включаются DEV_APPS=1
+if os.getenv('DEV_APPS', '0') == '1':
+    INSTALLED_APPS += [
+        'django_extensions',
+    ]
+
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
+    'api.compression.CompressionMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -85,6 +91,101 @@ DATABASES = {
     }
 }
 
+CACHES = {
+    'default': {
+        'BACKEND': os.getenv('CACHE_BACKEND',
+                             'django.core.cache.backends.db.DatabaseCache'),
+        'LOCATION': os.getenv('CACHE_LOCATION', 'django_cache'),
+    }
+}
+
+# Время жизни кэшированных ответов внешних API, секунды
+API_RESULT_CACHE_TTL = {
+    'holidays': int(os.getenv('HOLIDAYS_CACHE_TTL', 60 * 60 * 24 * 30)),
+    'weather': int(os.getenv('WEATHER_CACHE_TTL', 60 * 10)),
+}
+
+# Сколько держится слот склейки одинаковых запросов к API
+API_INFLIGHT_TTL = int(os.getenv('API_INFLIGHT_TTL', 120))
+
+# Сколько корзин с рецептом обновляется прямо в запросе при правке его
+# состава; больше — фоновой задачей (api.shopping.fan_out)
+SHOPPING_FANOUT_INLINE = int(os.getenv('SHOPPING_FANOUT_INLINE', 100))
+
+# Сколько документов рецептов (api.documents) собирается за один проход
+# фоновой задачи и команды rebuild_recipe_documents
+RECIPE_DOCUMENTS_CHUNK = int(os.getenv('RECIPE_DOCUMENTS_CHUNK', 500))
+
+# Лента подписок (api.feed): авторы с большим числом подписчиков
+# подмешиваются при чтении вместо раскладки по лентам; сколько рецептов
+# автора попадает в ленту при подписке; размер куска раскладки
+FEED = {
+    'fanout_max_followers': int(os.getenv('FEED_FANOUT_MAX_FOLLOWERS',
+                                          10000)),
+    'popular_ttl': int(os.getenv('FEED_POPULAR_TTL', 300)),
+    'backfill': int(os.getenv('FEED_BACKFILL', 50)),
+    'chunk': int(os.getenv('FEED_CHUNK', 1000)),
+    'page_size': int(os.getenv('FEED_PAGE_SIZE', 10)),
+}
+
+# PDF списка покупок (api.pdf): каталог в медиа, шрифт с кириллицей и
+# время жизни id задачи рендеринга для task_status
+SHOPPING_PDF = {
+    'dir': os.getenv('SHOPPING_PDF_DIR', 'shopping_lists'),
+    'font': os.getenv('SHOPPING_PDF_FONT',
+                      '/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf'),
+    'ttl': int(os.getenv('SHOPPING_PDF_TTL', 60 * 60)),
+}
+
+# Пакетный запуск задач (api.batches): предел размера пакета, число
+# сообщений в группе Celery (большие пакеты режутся на куски) и время
+# жизни записи пакета и ошибок задач
+API_BATCH = {
+    'max_items': int(os.getenv('API_BATCH_MAX_ITEMS', 1000)),
+    'max_messages': int(os.getenv('API_BATCH_MAX_MESSAGES', 100)),
+    'ttl': int(os.getenv('API_BATCH_TTL', 60 * 60 * 24)),
+}
+
+# Общий клиент исходящих HTTP-запросов (api.http_client)
+HTTP_CLIENT = {
+    'timeout': (float(os.getenv('HTTP_CONNECT_TIMEOUT', 3.05)),
+                float(os.getenv('HTTP_READ_TIMEOUT', 15))),
+    'retries': int(os.getenv('HTTP_RETRIES', 3)),
+    'backoff_factor': float(os.getenv('HTTP_BACKOFF_FACTOR', 0.5)),
+    'pool_maxsize': int(os.getenv('HTTP_POOL_MAXSIZE', 10)),
+    'failure_threshold': int(os.getenv('HTTP_BREAKER_FAILURES', 5)),
+    'reset_timeout': float(os.getenv('HTTP_BREAKER_RESET', 30)),
+    # Более долгий Retry-After не ждём в запросе, задача уходит в retry
+    'max_retry_after': float(os.getenv('HTTP_MAX_RETRY_AFTER', 30)),
+}
+
+# Хранилище ответов внешних API (api.results_store)
+API_RESULTS_STORE = {
+    'root': os.getenv('API_RESULTS_DIR', 'api_results'),
+    'segment_max_bytes': int(os.getenv('API_RESULTS_SEGMENT_BYTES',
+                                       16 * 1024 * 1024)),
+    'max_age': float(os.getenv('API_RESULTS_MAX_AGE', 30 * 24 * 3600)),
+    'max_bytes': int(os.getenv('API_RESULTS_MAX_BYTES', 1024 * 1024 * 1024)),
+}
+
+# Снимок каталога ингредиентов (api.catalog): файл, который процессы
+# узла читают через mmap, и как часто сверять его версию с кэшем, с
+INGREDIENT_CATALOG = {
+    'path': os.getenv('INGREDIENT_CATALOG_PATH', 'ingredient_catalog.bin'),
+    'check_interval': float(os.getenv('INGREDIENT_CATALOG_CHECK', 1.0)),
+}
+
+# Лимиты запросов к внешним API (api.rate_limiter): 'имя=rate:burst,...'.
+# Бакеты общие для процессов узла, у consumer'ов rabbitmq свои: в деплое
+# каждой стороне задаётся половина лимита (helm/app/charts/worker)
+RATE_LIMITER = {
+    'path': os.getenv('RATE_LIMIT_DB', 'rate_limits.sqlite3'),
+    'limits': os.getenv('RATE_LIMITS', 'holidays=1:1,weather=2:5'),
+    'max_wait': float(os.getenv('RATE_LIMIT_MAX_WAIT', 5)),
+}
+# Сколько раз задача откладывается, если токена пришлось бы ждать дольше
+RATE_LIMIT_MAX_RESCHEDULES = int(os.getenv('RATE_LIMIT_MAX_RESCHEDULES', 10))
+
 # Password validation
 # https://docs.djangoproject.com/en/4.2/ref/settings/#auth-password-validators
 
@@ -123,10 +224,89 @@ STATIC_URL = '/backend_static/'
 
 STATIC_ROOT = os.path.join(BASE_DIR, 'backend_static')
 
+# STATIC_STORAGE=hashed: collectstatic пишет имена с хэшем содержимого,
+# манифест и сжатые .gz/.br копии (foodgram.storage). Без collectstatic
+# (runserver) манифеста нет, поэтому по умолчанию — обычное хранилище
+STATIC_STORAGE = os.getenv('STATIC_STORAGE', 'plain')
+
+STORAGES = {
+    'default': {
+        'BACKEND': 'django.core.files.storage.FileSystemStorage',
+    },
+    'staticfiles': {
+        'BACKEND': (
+            'foodgram.storage.CompressedManifestStaticFilesStorage'
+            if STATIC_STORAGE == 'hashed'
+            else 'django.contrib.staticfiles.storage.StaticFilesStorage'
+        ),
+    },
+}
+
+# Предел точного подсчёта строк в списках админки
+# (recipes.admin_tools.EstimatedCountPaginator)
+ADMIN_COUNT_LIMIT = int(os.getenv('ADMIN_COUNT_LIMIT', 10000))
+
+# Сжатие ответов (api.compression): минимальный размер тела и уровни;
+# степень сжатия и время CPU видны в /api/metrics/ (compression)
+COMPRESSION = {
+    'min_size': int(os.getenv('COMPRESSION_MIN_SIZE', 1024)),
+    'levels': {
+        'gzip': int(os.getenv('COMPRESSION_GZIP_LEVEL', 6)),
+        'br': int(os.getenv('COMPRESSION_BROTLI_QUALITY', 5)),
+    },
+}
+
+# Сжатие статики: потоки и минимальный размер файла
+STATIC_COMPRESS = {
+    'workers': int(os.getenv('STATIC_COMPRESS_WORKERS', 4)),
+    'min_size': int(os.getenv('STATIC_COMPRESS_MIN_SIZE', 256)),
+}
+
 MEDIA_URL = '/backend_media/'
 
 MEDIA_ROOT = os.path.join(BASE_DIR, 'backend_media')
 
+# Сборка осиротевших файлов медиа (api.media_gc): каталоги загрузок
+# относительно MEDIA_ROOT, режим периодической задачи (dry-run,
+# quarantine, delete), минимальный возраст файла, размер пачки сверки с
+# базой, пауза между пачками и срок хранения в карантине. Период задачи
+# задаёт MEDIA_GC_INTERVAL в foodgram.celeryconfig
+MEDIA_GC = {
+    'roots': os.getenv('MEDIA_GC_ROOTS',
+                       'backend-media/recipes/images').split(','),
+    'mode': os.getenv('MEDIA_GC_MODE', 'quarantine'),
+    'min_age': int(os.getenv('MEDIA_GC_MIN_AGE', 60 * 60)),
+    'batch_size': int(os.getenv('MEDIA_GC_BATCH_SIZE', 1000)),
+    'pause': float(os.getenv('MEDIA_GC_PAUSE', 0.05)),
+    'quarantine': os.getenv('MEDIA_GC_QUARANTINE', 'gc-quarantine'),
+    'quarantine_days': int(os.getenv('MEDIA_GC_QUARANTINE_DAYS', 7)),
+}
+
+# Выгрузки для аналитики (api.exports): строк за один проход серверного
+# курсора, предел выгрузки прямо из админки (больше — фоновой задачей),
+# каталог сжатых файлов в медиа и срок их хранения
+EXPORT = {
+    'chunk_size': int(os.getenv('EXPORT_CHUNK_SIZE', 2000)),
+    'inline_max_rows': int(os.getenv('EXPORT_INLINE_MAX_ROWS', 50000)),
+    'dir': os.getenv('EXPORT_DIR', 'exports'),
+    'ttl': int(os.getenv('EXPORT_TTL', 60 * 60 * 24)),
+}
+
+# Бюджет холодного старта gunicorn (с URLconf) и воркера Celery: суммарное
+# время импортов, мс, и число загруженных модулей. Время шумит от
+# соседей по CPU, число модулей — нет и ловит новую тяжёлую зависимость
+# на старте. Проверка — python3 manage.py profile_imports --check
+IMPORT_BUDGET = {
+    'wsgi': {
+        'ms': int(os.getenv('IMPORT_BUDGET_WSGI_MS', 900)),
+        'modules': int(os.getenv('IMPORT_BUDGET_WSGI_MODULES', 1050)),
+    },
+    'celery': {
+        'ms': int(os.getenv('IMPORT_BUDGET_CELERY_MS', 900)),
+        'modules': int(os.getenv('IMPORT_BUDGET_CELERY_MODULES', 1075)),
+    },
+}
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/4.2/ref/settings/#default-auto-field
 
@@ -134,11 +314,55 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': [
-        'rest_framework.authentication.TokenAuthentication',
+        'api.authentication.CachedTokenAuthentication',
     ],
     'DEFAULT_PAGINATION_CLASS': 'api.pagination.CustomPageNumberPagination',
+    # Частоты для api.throttling: '<класс эндпоинтов>.<user|ip>'
+    'DEFAULT_THROTTLE_RATES': {
+        'shopping_download.user': os.getenv('THROTTLE_SHOPPING_USER',
+                                            '30/min'),
+        'shopping_download.ip': os.getenv('THROTTLE_SHOPPING_IP', '120/min'),
+        'api_tasks.user': os.getenv('THROTTLE_API_TASKS_USER', '60/min'),
+        'api_tasks.ip': os.getenv('THROTTLE_API_TASKS_IP', '240/min'),
+        'recipes_deep.user': os.getenv('THROTTLE_RECIPES_DEEP_USER',
+                                       '30/min'),
+        'recipes_deep.ip': os.getenv('THROTTLE_RECIPES_DEEP_IP', '120/min'),
+    },
+    # Адрес клиента для троттлинга по IP — из X-Forwarded-For от nginx
+    'NUM_PROXIES': int(os.getenv('NUM_PROXIES', 1)),
+}
+
+# Троттлинг дорогих эндпоинтов (api.throttling): файл SQLite со
+# счётчиками скользящих окон, общий для процессов узла
+THROTTLE = {
+    'path': os.getenv('THROTTLE_DB', 'throttle.sqlite3'),
+}
+
+# Одновременные запросы классов эндпоинтов на узле (api.throttling):
+# слоты 'класс=число,...', каталог файлов-слотов и Retry-After для 503
+ADMISSION = {
+    'dir': os.getenv('ADMISSION_DIR', 'admission'),
+    'slots': os.getenv('ADMISSION_SLOTS', 'shopping=4,recipes_deep=4'),
+    'retry_after': float(os.getenv('ADMISSION_RETRY_AFTER', 1)),
+}
+
+# Смещение в списке рецептов, с которого страница считается глубокой:
+# OFFSET заставляет базу пройти все предыдущие строки
+RECIPES_DEEP_OFFSET = int(os.getenv('RECIPES_DEEP_OFFSET', 1000))
+
+# Кэш токенов для api.authentication.CachedTokenAuthentication.
+# Отзыв токена виден всем процессам сразу через версию в общем кэше
+# Django; ttl ограничивает жизнь локальной записи, shared_ttl > 0
+# включает общий слой с парой (user_id, token_created).
+TOKEN_AUTH_CACHE = {
+    'max_size': int(os.getenv('TOKEN_AUTH_CACHE_SIZE', 10000)),
+    'ttl': float(os.getenv('TOKEN_AUTH_CACHE_TTL', 30)),
+    'shared_ttl': int(os.getenv('TOKEN_AUTH_SHARED_CACHE_TTL', 0)),
 }
 
 DJOSER = {
-    'LOGIN_FIELD': 'email'
+    'LOGIN_FIELD': 'email',
+    # Ссылка из письма users/reset_password/ (uid и token для
+    # users/reset_password_confirm/)
+    'PASSWORD_RESET_CONFIRM_URL': 'reset-password/{uid}/{token}',
 }
\ No newline at end of file
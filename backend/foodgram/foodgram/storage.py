@@ -0,0 +1,67 @@
+import gzip
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import brotli
+from django.conf import settings
+from django.contrib.staticfiles.storage import ManifestStaticFilesStorage
+
+COMPRESSIBLE = ('.css', '.js', '.map', '.json', '.svg', '.txt', '.html',
+                '.xml', '.ttf', '.eot', '.otf')
+
+
+class CompressedManifestStaticFilesStorage(ManifestStaticFilesStorage):
+    """Статика с хэшем содержимого в имени и сжатыми копиями рядом.
+
+    После обычной обработки ManifestStaticFilesStorage (хэшированные
+    копии и манифест staticfiles.json) хэшированные текстовые файлы
+    сжимаются в .gz и .br в нескольких процессах. Имя с хэшем меняется
+    вместе с содержимым, поэтому уже сжатый файл при повторном
+    collectstatic пропускается, а nginx может отдавать всё это
+    с immutable.
+    """
+
+    def url(self, name, force=False):
+        # Режим включают только после collectstatic, так что хэшированные
+        # имена отдаются и при DEBUG, который иначе их отключает
+        return super().url(name, force=True)
+
+    def post_process(self, paths, dry_run=False, **options):
+        hashed = []
+        for name, hashed_name, processed in super().post_process(
+                paths, dry_run=dry_run, **options):
+            if hashed_name and not isinstance(processed, Exception):
+                hashed.append(hashed_name)
+            yield name, hashed_name, processed
+        if dry_run:
+            return
+        hashed.append(self.manifest_name)
+        paths = [
+            self.path(name) for name in dict.fromkeys(hashed)
+            if name.endswith(COMPRESSIBLE) and (
+                name == self.manifest_name
+                or not os.path.exists(self.path(name) + '.br'))
+        ]
+        # Сжатие упирается в CPU — в отдельных процессах
+        with ProcessPoolExecutor(
+                max_workers=settings.STATIC_COMPRESS['workers']) as pool:
+            list(pool.map(compress_file, paths, [
+                settings.STATIC_COMPRESS['min_size']] * len(paths)))
+
+
+def compress_file(path, min_size):
+    """Пишет рядом с файлом path.gz и path.br."""
+    with open(path, 'rb') as file:
+        content = file.read()
+    if len(content) < min_size:
+        return
+    # mtime=0: одинаковое содержимое даёт одинаковый .gz
+    _write(path + '.gz', gzip.compress(content, 9, mtime=0))
+    _write(path + '.br', brotli.compress(content))
+
+
+def _write(path, content):
+    temp_path = f'{path}.{os.getpid()}.tmp'
+    with open(temp_path, 'wb') as file:
+        file.write(content)
+    os.replace(temp_path, path)
@@ -1,6 +1,10 @@
 from django.contrib import admin
-from django.db.models import Count, OuterRef
+from django.db.models import Count, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
 
+from api.shopping import recipe_edit
+from recipes.admin_tools import (AuthorFilter, ExportActionsMixin,
+                                 ScalableAdminMixin)
 from recipes.models import Favorite, Ingredient, Recipe
 
 
@@ -9,31 +13,38 @@ class IngredientsInline(admin.TabularInline):
 
     model = Recipe.ingredients.through
     extra = 3
+    autocomplete_fields = (
+        'ingredient',
+    )
+
+    def get_queryset(self, request):
+        # Строка инлайна выводит __str__: ингредиент и рецепт
+        return super().get_queryset(request).select_related(
+            'ingredient', 'recipe')
 
 
 @admin.register(Ingredient)
-class IngredientAdmin(admin.ModelAdmin):
+class IngredientAdmin(ScalableAdminMixin, admin.ModelAdmin):
     """Панель администратора для ингредиентов."""
 
     list_display = (
         'name',
         'measurement_unit',
     )
-    list_filter = (
-        'name',
-    )
     list_per_page = 50
     search_fields = (
         'name',
     )
-    search_help_text = ('Поиск по названию')
+    search_help_text = ('Поиск по началу названия')
     actions_on_bottom = True
 
 
 @admin.register(Recipe)
-class RecipeAdmin(admin.ModelAdmin):
+class RecipeAdmin(ExportActionsMixin, ScalableAdminMixin, admin.ModelAdmin):
     """Панель администратора для рецептов."""
 
+    export_name = 'recipes'
+
     list_display = (
         'id',
         'name',
@@ -54,16 +65,28 @@ class RecipeAdmin(admin.ModelAdmin):
     readonly_fields = (
         'favorite_count',
     )
-    list_filter = (
+    autocomplete_fields = (
+        'author',
+    )
+    list_select_related = (
         'author',
+    )
+    list_filter = (
+        AuthorFilter,
+        ('pub_date', admin.DateFieldListFilter),
+    )
+    search_fields = (
         'name',
     )
+    search_help_text = ('Поиск по началу названия')
 
     def get_queryset(self, request):
+        # Подзапрос на строку страницы, а не GROUP BY по всей таблице
         return Recipe.objects.annotate(
-            favorite_count=Count(
-                Favorite.objects.filter(recipe=OuterRef('pk')).values('id')
-            )
+            favorite_count=Coalesce(Subquery(
+                Favorite.objects.filter(recipe=OuterRef('pk')).values(
+                    'recipe').annotate(count=Count('pk')).values('count')
+            ), Value(0))
         )
 
     @admin.display(
@@ -72,3 +95,28 @@ class RecipeAdmin(admin.ModelAdmin):
     )
     def favorite_count(self, obj):
         return obj.favorite_count
+
+    def save_related(self, request, form, formsets, change):
+        """Правки состава в инлайне раскладываются по корзинам разом."""
+        with recipe_edit(form.instance):
+            super().save_related(request, form, formsets, change)
+
+
+@admin.register(Favorite)
+class FavoriteAdmin(ExportActionsMixin, ScalableAdminMixin, admin.ModelAdmin):
+    """Панель администратора для избранного."""
+
+    export_name = 'favorites'
+    list_display = (
+        'id',
+        'user',
+        'recipe',
+    )
+    list_select_related = (
+        'user',
+        'recipe',
+    )
+    autocomplete_fields = (
+        'user',
+        'recipe',
+    )
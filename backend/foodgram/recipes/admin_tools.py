@@ -0,0 +1,183 @@
+import os
+
+from django.conf import settings
+from django.contrib import admin, messages
+from django.contrib.admin.views.main import PAGE_VAR
+from django.core.exceptions import PermissionDenied
+from django.core.files.storage import default_storage
+from django.core.paginator import Paginator
+from django.db import connections
+from django.db.models import Q
+from django.http import FileResponse
+from django.shortcuts import redirect
+from django.urls import path, reverse
+from django.utils.functional import cached_property
+from django.utils.html import format_html
+
+from api.cache import get_task_error, get_task_result
+from api.exports import is_large, query_spec, stream_response
+from api.tasks import export_queryset
+
+
+def estimate_rows(model, using):
+    """Оценка числа строк таблицы из статистики PostgreSQL или None."""
+    connection = connections[using]
+    if connection.vendor != 'postgresql':
+        return None
+    with connection.cursor() as cursor:
+        cursor.execute(
+            'SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass',
+            [model._meta.db_table])
+        row = cursor.fetchone()
+    # -1: таблицу ещё не анализировали
+    return row[0] if row and row[0] >= 0 else None
+
+
+class EstimatedCountPaginator(Paginator):
+    """Пагинатор без полного COUNT(*).
+
+    Без фильтров число строк берётся из статистики планировщика, если
+    таблица большая; с фильтрами считается не дальше ADMIN_COUNT_LIMIT
+    строк, так что последние страницы большого результата недоступны,
+    но запрос не пробегает всю таблицу.
+    """
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        limit = settings.ADMIN_COUNT_LIMIT
+        if not queryset.query.where:
+            estimate = estimate_rows(queryset.model, queryset.db)
+            if estimate is not None and estimate > limit:
+                return estimate
+        return queryset[:limit].count()
+
+
+class InputFilter(admin.SimpleListFilter):
+    """Фильтр с полем ввода вместо списка всех значений."""
+
+    template = 'admin/input_filter.html'
+    placeholder = ''
+
+    def lookups(self, request, model_admin):
+        return ()
+
+    def has_output(self):
+        return True
+
+    def choices(self, changelist):
+        yield {
+            'selected': self.value() is None,
+            'query_string': changelist.get_query_string(
+                remove=[self.parameter_name]),
+            'display': 'Все',
+            'parameter_name': self.parameter_name,
+            'value': self.value(),
+            'placeholder': self.placeholder,
+            'hidden_params': [
+                (name, value) for name, value in changelist.params.items()
+                if name not in (self.parameter_name, PAGE_VAR)
+            ],
+        }
+
+
+class AuthorFilter(InputFilter):
+    """Автор по id, почте или username — точное совпадение по индексу."""
+
+    title = 'автору'
+    parameter_name = 'author'
+    placeholder = 'id, почта или username'
+
+    def queryset(self, request, queryset):
+        value = (self.value() or '').strip()
+        if not value:
+            return queryset
+        if value.isdigit():
+            return queryset.filter(author_id=value)
+        if '@' in value:
+            return queryset.filter(author__email=value)
+        return queryset.filter(author__username=value)
+
+
+class ScalableAdminMixin:
+    """Списки админки, которые не деградируют на миллионах строк.
+
+    Вместо полного COUNT — оценка (EstimatedCountPaginator), без второго
+    COUNT по всей таблице для «показать все». Поиск — по префиксу с учётом
+    регистра: LIKE 'term%' использует индексы *_like, которые Django
+    создаёт в PostgreSQL для индексированных CharField, а icontains
+    по умолчанию читает всю таблицу.
+    """
+
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+
+    def get_search_results(self, request, queryset, search_term):
+        term = search_term.strip()
+        if not term:
+            return queryset, False
+        condition = Q()
+        for field in self.search_fields:
+            condition |= Q(**{f'{field}__startswith': term})
+        return queryset.filter(condition), False
+
+
+class ExportActionsMixin:
+    """Действия «выгрузить в CSV/NDJSON» для выбранных или всех
+    отфильтрованных строк.
+
+    Выгрузка до EXPORT['inline_max_rows'] строк отдаётся потоком прямо
+    из запроса, серверным курсором; большая уходит в фоновую задачу,
+    которая пишет сжатый файл, а в админке появляется ссылка на него.
+    Набор колонок задаёт export_name — ключ api.exports.EXPORTS.
+    """
+
+    export_name = None
+    actions = ('export_csv', 'export_ndjson')
+
+    def get_urls(self):
+        info = self.model._meta.app_label, self.model._meta.model_name
+        return [
+            path('exports/<str:task_id>/',
+                 self.admin_site.admin_view(self.export_download_view),
+                 name='%s_%s_export' % info),
+        ] + super().get_urls()
+
+    @admin.action(description='Выгрузить в CSV')
+    def export_csv(self, request, queryset):
+        return self._export(request, queryset, 'csv')
+
+    @admin.action(description='Выгрузить в NDJSON')
+    def export_ndjson(self, request, queryset):
+        return self._export(request, queryset, 'ndjson')
+
+    def _export(self, request, queryset, fmt):
+        if not is_large(queryset):
+            return stream_response(self.export_name, queryset, fmt)
+        task = export_queryset.delay(self.export_name,
+                                     query_spec(request, queryset), fmt)
+        info = self.model._meta.app_label, self.model._meta.model_name
+        self.message_user(request, format_html(
+            'Выгрузка большая и готовится в фоне: '
+            '<a href="{}">скачать</a>, когда будет готова.',
+            reverse('admin:%s_%s_export' % info, args=[task.id])))
+        return None
+
+    def export_download_view(self, request, task_id):
+        if not self.has_view_permission(request):
+            raise PermissionDenied
+        result = get_task_result(task_id)
+        if not isinstance(result, dict) or 'export_file' not in result:
+            error = get_task_error(task_id)
+            if error is not None:
+                self.message_user(request, f'Выгрузка не удалась: {error}',
+                                  messages.ERROR)
+            else:
+                self.message_user(request, 'Выгрузка ещё готовится или '
+                                  'срок её хранения истёк.', messages.WARNING)
+            info = self.model._meta.app_label, self.model._meta.model_name
+            return redirect('admin:%s_%s_changelist' % info)
+        name = result['export_file']
+        return FileResponse(default_storage.open(name, 'rb'),
+                            as_attachment=True,
+                            filename=os.path.basename(name))
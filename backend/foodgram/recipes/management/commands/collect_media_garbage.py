@@ -0,0 +1,39 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from api.media_gc import MODES, MediaCollector
+
+
+class Command(BaseCommand):
+    """Поиск картинок, на которые не ссылается ни один рецепт
+    Вызов python3 manage.py collect_media_garbage [--mode delete]
+    по умолчанию только показывает, что было бы удалено
+    """
+
+    help = 'Сборка осиротевших файлов медиа'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--mode', choices=MODES, default='dry-run',
+                            help='dry-run, quarantine или delete')
+        parser.add_argument('--min-age', type=int,
+                            help='Не трогать файлы моложе, секунд')
+        parser.add_argument('--batch-size', type=int,
+                            help='Файлов в одной сверке с базой')
+        parser.add_argument('--pause', type=float,
+                            help='Пауза между пачками, секунд')
+
+    def handle(self, *args, **options):
+        """Тело команды."""
+        try:
+            collector = MediaCollector(
+                options['mode'],
+                min_age=options['min_age'],
+                batch_size=options['batch_size'],
+                pause=options['pause'],
+            )
+        except NotImplementedError:
+            raise CommandError('Хранилище медиа не на локальном диске')
+        stats = collector.collect()
+        print(f"Режим {options['mode']}: просмотрено {stats['scanned']}, "
+              f"осиротевших {stats['orphans']} ({stats['bytes']} байт), "
+              f"убрано {stats['removed']}, удалено из карантина "
+              f"{stats['purged']}")
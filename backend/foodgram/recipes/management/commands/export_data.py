@@ -0,0 +1,45 @@
+import sys
+
+from django.core.management.base import BaseCommand
+
+from api.exports import EXPORTS, FORMATS, iter_lines, write_file
+
+
+class Command(BaseCommand):
+    """Выгрузка рецептов, пользователей или избранного для аналитики
+    Вызов python3 manage.py export_data recipes --format ndjson
+    --output recipes.ndjson.gz; без --output пишет в stdout
+    """
+
+    help = 'Потоковая выгрузка в CSV или NDJSON'
+
+    def add_arguments(self, parser):
+        parser.add_argument('export', choices=EXPORTS)
+        parser.add_argument('--format', choices=FORMATS, default='csv')
+        parser.add_argument('--output',
+                            help='Файл; с окончанием .gz — сжатый gzip')
+        parser.add_argument('--since-id', type=int,
+                            help='Только записи с id больше этого')
+
+    def handle(self, *args, **options):
+        """Тело команды."""
+        export_name, fmt = options['export'], options['format']
+        model, fields = EXPORTS[export_name]
+        queryset = model.objects.all()
+        if options['since_id'] is not None:
+            queryset = queryset.filter(pk__gt=options['since_id'])
+        output = options['output']
+        if not output:
+            for line in iter_lines(queryset, fields, fmt):
+                sys.stdout.write(line)
+            return
+        if output.endswith('.gz'):
+            with open(output, 'wb') as file:
+                rows = write_file(export_name, queryset, fmt, file)
+        else:
+            rows = -1 if fmt == 'csv' else 0
+            with open(output, 'w', encoding='utf-8', newline='') as file:
+                for line in iter_lines(queryset, fields, fmt):
+                    file.write(line)
+                    rows += 1
+        print(f'Выгружено {rows} записей в {output}')
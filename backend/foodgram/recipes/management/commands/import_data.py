@@ -2,6 +2,7 @@ import json
 
 from django.core.management.base import BaseCommand
 
+from api.catalog import get_catalog
 from recipes.models import Ingredient
 
 
@@ -28,3 +29,5 @@ class Command(BaseCommand):
                       f"Текст - {error}")
 
         print('Загрузка ингредиентов завершена')
+        count = get_catalog().rebuild()
+        print(f'Снимок каталога ингредиентов: {count}')
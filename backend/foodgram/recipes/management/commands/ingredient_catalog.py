@@ -0,0 +1,50 @@
+import random
+import time
+
+from django.core.management.base import BaseCommand
+
+from api.catalog import get_catalog
+from recipes.models import Ingredient
+
+
+class Command(BaseCommand):
+    """Снимок каталога ингредиентов для всех процессов узла
+    Вызов python3 manage.py ingredient_catalog --rebuild
+    или --bench 1000 — сравнить выборку из снимка и из базы
+    """
+
+    help = 'Пересборка и замер снимка каталога ингредиентов'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rebuild', action='store_true',
+                            help='Пересобрать снимок сейчас')
+        parser.add_argument('--bench', type=int, default=0,
+                            help='Число выборок для замера')
+        parser.add_argument('--batch', type=int, default=20,
+                            help='Ингредиентов в одной выборке')
+
+    def handle(self, *args, **options):
+        """Тело команды."""
+        catalog = get_catalog()
+        if options['rebuild']:
+            print(f'Снимок пересобран: {catalog.rebuild()} ингредиентов')
+        snapshot = catalog.snapshot()
+        print(f'В снимке {len(snapshot)} ингредиентов, '
+              f'версия {snapshot.version}')
+        if not options['bench']:
+            return
+        ids = list(Ingredient.objects.values_list('pk', flat=True))
+        batches = [random.sample(ids, min(options['batch'], len(ids)))
+                   for _ in range(options['bench'])]
+        started = time.perf_counter()
+        for batch in batches:
+            catalog.get_many(batch)
+        from_snapshot = time.perf_counter() - started
+        started = time.perf_counter()
+        for batch in batches:
+            dict(Ingredient.objects.filter(pk__in=batch).values_list(
+                'pk', 'name'))
+        from_database = time.perf_counter() - started
+        print(f'Снимок: {from_snapshot / len(batches) * 1e6:.1f} мкс, '
+              f'база: {from_database / len(batches) * 1e6:.1f} мкс '
+              f'на выборку из {options["batch"]}')
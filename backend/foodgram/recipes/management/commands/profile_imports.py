@@ -0,0 +1,56 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from foodgram.importtime import TARGETS, best_of
+
+
+class Command(BaseCommand):
+    """Время импорта модулей при холодном старте приложения и воркера
+    Вызов python3 manage.py profile_imports [wsgi celery] [--check]
+    с --check завершается ошибкой при превышении IMPORT_BUDGET
+    """
+
+    help = 'Профиль импортов при старте процесса'
+
+    def add_arguments(self, parser):
+        parser.add_argument('targets', nargs='*',
+                            help='wsgi, celery; по умолчанию оба')
+        parser.add_argument('--top', type=int, default=25,
+                            help='Сколько модулей показать')
+        parser.add_argument('--repeat', type=int, default=3,
+                            help='Замеров, берётся лучший')
+        parser.add_argument('--check', action='store_true',
+                            help='Сверить с бюджетом IMPORT_BUDGET')
+
+    def handle(self, *args, **options):
+        """Тело команды."""
+        unknown = set(options['targets']) - set(TARGETS)
+        if unknown:
+            raise CommandError(f'Неизвестные цели: {", ".join(unknown)}')
+        over_budget = []
+        for target in options['targets'] or TARGETS:
+            try:
+                profile = best_of(target, options['repeat'])
+            except RuntimeError as error:
+                raise CommandError(f'{target}: {error}')
+            budget = settings.IMPORT_BUDGET[target]
+            modules = len(profile.records)
+            print(f'{target}: импорты {profile.total_ms:.0f} мс '
+                  f'(бюджет {budget["ms"]}), модулей {modules} '
+                  f'(бюджет {budget["modules"]}), процесс '
+                  f'{profile.wall_ms:.0f} мс')
+            print('  накопленное, мс   модуль')
+            for name, _, cumulative_us in profile.top(options['top']):
+                print(f'  {cumulative_us / 1000:>14.1f}   {name}')
+            print('  собственное, мс   пакет')
+            for name, total in profile.by_package(options['top']):
+                print(f'  {total:>14.1f}   {name}')
+            if profile.total_ms > budget['ms']:
+                over_budget.append(f'{target} {profile.total_ms:.0f} мс '
+                                   f'> {budget["ms"]}')
+            if modules > budget['modules']:
+                over_budget.append(f'{target} {modules} модулей '
+                                   f'> {budget["modules"]}')
+        if options['check'] and over_budget:
+            raise CommandError('Превышен бюджет старта: '
+                               + ', '.join(over_budget))
@@ -0,0 +1,43 @@
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from api.documents import build_documents
+from recipes.models import Recipe
+
+
+def build_chunk(recipe_ids):
+    try:
+        return len(build_documents(recipe_ids))
+    finally:
+        # У каждого потока своё соединение с БД
+        connection.close()
+
+
+class Command(BaseCommand):
+    """Пересборка документов рецептов для чтения
+    Вызов python3 manage.py rebuild_recipe_documents [--workers N]
+    после развёртывания или правок в обход ORM
+    """
+
+    help = 'Пересборка документов рецептов'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=4,
+                            help='Сколько кусков собирать параллельно')
+        parser.add_argument('--chunk-size', type=int,
+                            default=settings.RECIPE_DOCUMENTS_CHUNK,
+                            help='Рецептов в одном куске')
+
+    def handle(self, *args, **options):
+        """Тело команды."""
+        recipe_ids = list(Recipe.objects.order_by('pk').values_list(
+            'pk', flat=True))
+        size = options['chunk_size']
+        chunks = [recipe_ids[start:start + size]
+                  for start in range(0, len(recipe_ids), size)]
+        with ThreadPoolExecutor(max_workers=options['workers']) as pool:
+            built = sum(pool.map(build_chunk, chunks))
+        print(f'Пересобрано документов рецептов: {built}')
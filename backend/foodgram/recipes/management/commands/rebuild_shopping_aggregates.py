@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+
+from recipes.models import ShoppingAggregate
+
+
+class Command(BaseCommand):
+    """Пересчёт итогов списков покупок с нуля
+    Вызов python3 manage.py rebuild_shopping_aggregates [user_id ...]
+    после правок составов в обход API (админка, импорт)
+    """
+
+    help = 'Пересчёт итогов списков покупок'
+
+    def add_arguments(self, parser):
+        parser.add_argument('user_ids', nargs='*', type=int,
+                            help='Только эти пользователи')
+
+    def handle(self, *args, **options):
+        """Тело команды."""
+        ShoppingAggregate.objects.rebuild(options['user_ids'] or None)
+        print('Итоги списков покупок пересчитаны')
@@ -0,0 +1,55 @@
+# Generated by Django 4.2.1 on 2026-10-19 10:31
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+from django.db.models import Count, Sum
+
+
+def fill_shopping_aggregate(apps, schema_editor):
+    IngredientRecipe = apps.get_model('recipes', 'IngredientRecipe')
+    ShoppingAggregate = apps.get_model('recipes', 'ShoppingAggregate')
+    totals = IngredientRecipe.objects.filter(
+        recipe__shopping_recipe__isnull=False).values(
+        'recipe__shopping_recipe__user', 'ingredient').annotate(
+        total=Sum('amount'), recipes=Count('id'))
+    ShoppingAggregate.objects.bulk_create((
+        ShoppingAggregate(
+            user_id=row['recipe__shopping_recipe__user'],
+            ingredient_id=row['ingredient'],
+            total_amount=row['total'],
+            recipe_count=row['recipes'],
+        )
+        for row in totals.iterator()
+    ), batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('recipes', '0003_recipe_updated_at'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ShoppingAggregate',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('total_amount', models.IntegerField(default=0, verbose_name='Количество')),
+                ('recipe_count', models.IntegerField(default=0, verbose_name='Число рецептов')),
+                ('ingredient', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='recipes.ingredient')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='shopping_aggregate', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': 'Итог списка покупок',
+                'verbose_name_plural': 'Итоги списков покупок',
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='shoppingaggregate',
+            constraint=models.UniqueConstraint(fields=('user', 'ingredient'), name='unique_shopping_aggregate'),
+        ),
+        migrations.RunPython(fill_shopping_aggregate,
+                             migrations.RunPython.noop),
+    ]
@@ -1,5 +1,6 @@
 from django.core.validators import MinValueValidator
-from django.db import models
+from django.db import models, transaction
+from django.db.models import Count, F, Sum
 
 from users.models import User
 
@@ -61,9 +62,18 @@ class Recipe(models.Model):
         auto_now_add=True,
         db_index=True,
     )
+    updated_at = models.DateTimeField(
+        'Дата изменения',
+        auto_now=True,
+        db_index=True,
+    )
 
     class Meta:
         ordering = ('-pub_date',)
+        indexes = (
+            models.Index(fields=['author', '-pub_date', '-id'],
+                         name='recipe_author_pub_date'),
+        )
         verbose_name = 'Рецепт'
         verbose_name_plural = 'Рецепты'
 
@@ -71,6 +81,30 @@ class Recipe(models.Model):
         return self.name
 
 
+class RecipeDocument(models.Model):
+    """Готовая к отдаче часть ответа по рецепту (api.documents).
+
+    Документ актуален, пока source_updated_at совпадает с updated_at
+    рецепта; правки автора и ингредиентов сдвигают updated_at рецептов.
+    """
+
+    recipe = models.OneToOneField(
+        Recipe,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name='document',
+    )
+    data = models.JSONField('Документ')
+    source_updated_at = models.DateTimeField('Собран по версии рецепта')
+
+    class Meta:
+        verbose_name = 'Документ рецепта'
+        verbose_name_plural = 'Документы рецептов'
+
+    def __str__(self):
+        return f'Документ {self.recipe_id}'
+
+
 class IngredientRecipe(models.Model):
     recipe = models.ForeignKey(
         Recipe,
@@ -178,3 +212,151 @@ class ShoppingList(models.Model):
 
     def __str__(self) -> str:
         return f'{self.recipe} в списке покупок у {self.user}'
+
+
+class ShoppingAggregateManager(models.Manager):
+    BATCH_SIZE = 500
+
+    def apply_deltas(self, user_ids, deltas):
+        """Прибавляет deltas {ingredient_id: (amount, recipe_count)}
+        к итогам каждого пользователя из user_ids.
+
+        Блокируются только строки итогов, по возрастанию (user, ingredient),
+        а сами суммы сдвигаются через F(): параллельные изменения одной
+        корзины не теряют приращений и не держат строку пользователя.
+        Обнулившиеся строки остаются (выгрузка их не показывает) и
+        убираются rebuild: удаление под конкурентной раскладкой потеряло бы
+        её дельту.
+        """
+        deltas = {ingredient_id: delta for ingredient_id, delta
+                  in sorted(deltas.items()) if delta != (0, 0)}
+        user_ids = sorted(set(user_ids))
+        if not deltas or not user_ids:
+            return
+        for start in range(0, len(user_ids), self.BATCH_SIZE):
+            with transaction.atomic():
+                self._apply_batch(
+                    user_ids[start:start + self.BATCH_SIZE], deltas)
+
+    def _apply_batch(self, user_ids, deltas):
+        # Недостающие строки создаются пустыми; встречная вставка той же
+        # пары — не ошибка
+        self.bulk_create([
+            self.model(user_id=user_id, ingredient_id=ingredient_id)
+            for user_id in user_ids for ingredient_id in deltas
+        ], ignore_conflicts=True)
+        list(self.select_for_update().filter(
+            user_id__in=user_ids, ingredient_id__in=deltas).order_by(
+            'user_id', 'ingredient_id').values_list('pk', flat=True))
+        for ingredient_id, (amount, recipe_count) in deltas.items():
+            self.filter(
+                user_id__in=user_ids, ingredient_id=ingredient_id).update(
+                total_amount=F('total_amount') + amount,
+                recipe_count=F('recipe_count') + recipe_count,
+            )
+
+    def rebuild(self, user_ids=None):
+        """Пересчитывает итоги с нуля по спискам покупок."""
+        carts = IngredientRecipe.objects.filter(
+            recipe__shopping_recipe__isnull=False)
+        if user_ids is not None:
+            carts = carts.filter(recipe__shopping_recipe__user__in=user_ids)
+        totals = carts.values(
+            'recipe__shopping_recipe__user', 'ingredient').annotate(
+            total=Sum('amount'), recipes=Count('id'))
+        with transaction.atomic():
+            stale = self.all()
+            if user_ids is not None:
+                stale = stale.filter(user__in=user_ids)
+            stale.delete()
+            self.bulk_create((
+                self.model(
+                    user_id=row['recipe__shopping_recipe__user'],
+                    ingredient_id=row['ingredient'],
+                    total_amount=row['total'],
+                    recipe_count=row['recipes'],
+                )
+                for row in totals.iterator()
+            ), batch_size=self.BATCH_SIZE)
+
+
+class ShoppingAggregate(models.Model):
+    """Итог списка покупок пользователя по одному ингредиенту.
+
+    Поддерживается инкрементально (api.shopping), чтобы выгрузка списка
+    читала по строке на ингредиент вместо join по всем рецептам корзины.
+    recipe_count может ненадолго уйти в минус, пока фоновая задача
+    раскладывает правку популярного рецепта по корзинам.
+    """
+
+    user = models.ForeignKey(
+        User,
+        related_name='shopping_aggregate',
+        on_delete=models.CASCADE,
+    )
+    ingredient = models.ForeignKey(
+        Ingredient,
+        on_delete=models.CASCADE,
+    )
+    total_amount = models.IntegerField('Количество', default=0)
+    recipe_count = models.IntegerField('Число рецептов', default=0)
+
+    objects = ShoppingAggregateManager()
+
+    class Meta:
+        constraints = (
+            models.UniqueConstraint(
+                fields=['user', 'ingredient', ],
+                name='unique_shopping_aggregate'
+            ),
+        )
+        verbose_name = 'Итог списка покупок'
+        verbose_name_plural = 'Итоги списков покупок'
+
+    def __str__(self) -> str:
+        return f'{self.ingredient} - {self.total_amount} у {self.user}'
+
+
+class TimelineEntry(models.Model):
+    """Рецепт в ленте подписок пользователя (api.feed).
+
+    Заполняется фоновой раскладкой нового рецепта по подписчикам автора;
+    рецепты авторов с очень большим числом подписчиков в ленты не
+    раскладываются и подмешиваются при чтении.
+    """
+
+    user = models.ForeignKey(
+        User,
+        related_name='timeline',
+        on_delete=models.CASCADE,
+    )
+    recipe = models.ForeignKey(
+        Recipe,
+        related_name='timeline_entries',
+        on_delete=models.CASCADE,
+    )
+    author = models.ForeignKey(
+        User,
+        related_name='+',
+        on_delete=models.CASCADE,
+    )
+    pub_date = models.DateTimeField('Дата публикации рецепта')
+
+    class Meta:
+        constraints = (
+            models.UniqueConstraint(
+                fields=['user', 'recipe', ],
+                name='unique_timeline_entry'
+            ),
+        )
+        indexes = (
+            models.Index(fields=['user', '-pub_date', '-recipe'],
+                         name='timeline_user_pub_date'),
+            models.Index(fields=['user', 'author'],
+                         name='timeline_user_author'),
+        )
+        verbose_name = 'Запись ленты'
+        verbose_name_plural = 'Записи лент'
+
+    def __str__(self) -> str:
+        return f'{self.recipe} в ленте {self.user}'
@@ -0,0 +1,151 @@
+import os
+from unittest import mock
+
+from django.conf import settings
+from django.db import connection
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+
+from foodgram.importtime import TARGETS, best_of, measure
+from recipes.models import Favorite, Ingredient, IngredientRecipe, Recipe
+from users.models import User
+
+
+@override_settings(ADMIN_COUNT_LIMIT=1000)
+class ScalableAdminTests(TestCase):
+    """Списки админки на большой базе: число запросов не зависит от
+    числа строк, COUNT не пробегает всю таблицу."""
+
+    INGREDIENTS = 50000
+    USERS = 20000
+    RECIPES = 20000
+    # Сессия, пользователь, COUNT, страница, подзапросы select_related —
+    # с запасом, но без запроса на строку
+    MAX_QUERIES = 8
+
+    @classmethod
+    def setUpTestData(cls):
+        Ingredient.objects.bulk_create(
+            [Ingredient(name=f'ingredient {number:06d}',
+                        measurement_unit='г')
+             for number in range(cls.INGREDIENTS)], batch_size=5000)
+        User.objects.bulk_create(
+            [User(username=f'user{number}', email=f'user{number}@test.ru',
+                  first_name='Имя', last_name='Фамилия', password='!')
+             for number in range(cls.USERS)], batch_size=5000)
+        user_ids = list(User.objects.values_list('pk', flat=True)[:1000])
+        Recipe.objects.bulk_create(
+            [Recipe(name=f'recipe {number:06d}',
+                    author_id=user_ids[number % len(user_ids)],
+                    image='recipe.png', text='text', cooking_time=10)
+             for number in range(cls.RECIPES)], batch_size=5000)
+        recipe_ids = list(Recipe.objects.values_list('pk', flat=True))
+        ingredient_ids = list(Ingredient.objects.values_list(
+            'pk', flat=True)[:1000])
+        IngredientRecipe.objects.bulk_create(
+            [IngredientRecipe(recipe_id=recipe_id,
+                              ingredient_id=ingredient_ids[
+                                  (recipe_id + shift) % len(ingredient_ids)],
+                              amount=1)
+             for recipe_id in recipe_ids[:5000] for shift in range(3)],
+            batch_size=5000)
+        Favorite.objects.bulk_create(
+            [Favorite(user_id=user_ids[0], recipe_id=recipe_id)
+             for recipe_id in recipe_ids[:5000]], batch_size=5000)
+        cls.author = User.objects.get(pk=user_ids[3])
+        cls.recipe = Recipe.objects.get(pk=recipe_ids[0])
+        cls.admin = User.objects.create_superuser(
+            username='admin', email='admin@test.ru', password='password')
+
+    def setUp(self):
+        self.client.force_login(self.admin)
+
+    def get(self, url):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200, url)
+        return response, [query['sql'] for query in queries]
+
+    def test_changelists_run_bounded_queries(self):
+        urls = (
+            '/admin/recipes/ingredient/',
+            '/admin/recipes/ingredient/?q=ingredient 0001',
+            '/admin/recipes/recipe/',
+            '/admin/recipes/recipe/?o=4',
+            f'/admin/recipes/recipe/?author={self.author.pk}',
+            f'/admin/recipes/recipe/?author={self.author.email}',
+            '/admin/recipes/recipe/?q=recipe 0199',
+            '/admin/recipes/favorite/',
+            '/admin/users/user/',
+            '/admin/users/user/?q=user777',
+            '/admin/users/user/?is_active__exact=1',
+        )
+        for url in urls:
+            with self.subTest(url=url):
+                _, queries = self.get(url)
+                self.assertLessEqual(len(queries), self.MAX_QUERIES)
+                for sql in queries:
+                    if sql.startswith('SELECT COUNT('):
+                        self.assertIn('LIMIT', sql)
+
+    def test_changelist_count_is_capped(self):
+        response, _ = self.get('/admin/recipes/recipe/')
+
+        self.assertEqual(response.context['cl'].result_count, 1000)
+        self.assertFalse(response.context['cl'].show_full_result_count)
+
+    def test_filters_are_inputs_not_value_lists(self):
+        response, _ = self.get('/admin/recipes/recipe/')
+
+        content = response.content.decode()
+        self.assertIn('name="author"', content)
+        self.assertNotIn(f'?author={self.author.pk}"', content)
+        self.assertNotIn(self.author.email, content)
+
+    def test_recipe_page_uses_autocomplete(self):
+        response, queries = self.get(
+            f'/admin/recipes/recipe/{self.recipe.pk}/change/')
+
+        # Виджет автодополнения читает выбранный ингредиент своей строки
+        rows = self.recipe.ingredients.count()
+        self.assertLessEqual(len(queries), self.MAX_QUERIES + rows)
+        content = response.content.decode()
+        self.assertIn('admin-autocomplete', content)
+        self.assertLess(content.count('<option'), 50)
+
+    def test_autocomplete_is_paginated(self):
+        for url in (
+            '/admin/autocomplete/?app_label=recipes&'
+            'model_name=ingredientrecipe&field_name=ingredient&'
+            'term=ingredient 00',
+            '/admin/autocomplete/?app_label=recipes&model_name=recipe&'
+            'field_name=author&term=user1',
+        ):
+            with self.subTest(url=url):
+                response, queries = self.get(url)
+                self.assertLessEqual(len(queries), self.MAX_QUERIES)
+                self.assertTrue(response.json()['pagination']['more'])
+
+
+class ImportBudgetTests(SimpleTestCase):
+    """Холодный старт приложения и воркера укладывается в IMPORT_BUDGET."""
+
+    def test_cold_start_within_budget(self):
+        for target in TARGETS:
+            with self.subTest(target=target):
+                profile = best_of(target, 3)
+                budget = settings.IMPORT_BUDGET[target]
+                slowest = ', '.join(
+                    f'{name} {cumulative_us / 1000:.0f} мс'
+                    for name, _, cumulative_us in profile.top(5))
+                self.assertLessEqual(profile.total_ms, budget['ms'],
+                                     slowest)
+                self.assertLessEqual(len(profile.records),
+                                     budget['modules'], slowest)
+
+    def test_dev_apps_are_not_loaded(self):
+        with mock.patch.dict(os.environ, {'DEV_APPS': '0'}):
+            profile = measure('wsgi')
+
+        modules = {name for name, _, _ in profile.records}
+        self.assertNotIn('django_extensions', modules)
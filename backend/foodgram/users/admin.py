@@ -1,12 +1,16 @@
 from django.contrib import admin
 
+from recipes.admin_tools import ExportActionsMixin, ScalableAdminMixin
 from users.models import User
 
 
 @admin.register(User)
-class CustomUserAdmin(admin.ModelAdmin):
+class CustomUserAdmin(ExportActionsMixin, ScalableAdminMixin,
+                      admin.ModelAdmin):
     """Панель администратора для пользователей."""
 
+    export_name = 'users'
+
     list_display = (
         'id',
         'username',
@@ -19,6 +23,12 @@ class CustomUserAdmin(admin.ModelAdmin):
         'is_active',
     )
     list_filter = (
+        'is_active',
+        'is_staff',
+        ('date_joined', admin.DateFieldListFilter),
+    )
+    search_fields = (
         'email',
         'username',
     )
+    search_help_text = ('Поиск по началу почты или username')
@@ -1,25 +1,52 @@
 import logging
+import os
+import random
 import pika
+from pika.adapters.select_connection import IOLoop
 
 LOG_FORMAT = ('%(levelname) -10s %(asctime)s %(name) -30s %(funcName) '
               '-35s %(lineno) -5d: %(message)s')
 LOGGER = logging.getLogger(__name__)
 logging.basicConfig(level=logging.DEBUG, format=LOG_FORMAT)
 
+DEFAULT_CHANNEL = 'default'
+
 
 class RabbitMqConnection:
-    def __init__(self, amqp_url, on_ready_callback):
+    def __init__(self, amqp_url, on_ready_callback, reconnect_delay=None,
+                 max_reconnect_delay=None):
         """
         Initialize the RabbitMqConnection object.
 
+        The connection survives broker restarts: when it is lost or cannot
+        be opened it is re-established after a jittered exponential backoff,
+        and every channel registered with open_channel() is reopened and
+        handed to its callback again, so consumers and publishers sharing
+        the connection re-register themselves.
+
         :param str amqp_url: The AMQP URL used to connect to RabbitMQ
+        :param callable on_ready_callback: Called with this object once the
+            default channel is open for the first time
+        :param float reconnect_delay: Base backoff delay in seconds
+            (RECONNECT_DELAY, default 1)
+        :param float max_reconnect_delay: Backoff cap in seconds
+            (RECONNECT_MAX_DELAY, default 60)
         """
         self.amqp_url = amqp_url
+        self._ioloop = None
         self._connection = None
-        self._channel = None
         self._stopping = False
         self._ready = False
         self._on_ready_callback = on_ready_callback
+        self._reconnect_delay = reconnect_delay or float(
+            os.getenv('RECONNECT_DELAY', 1))
+        self._max_reconnect_delay = max_reconnect_delay or float(
+            os.getenv('RECONNECT_MAX_DELAY', 60))
+        self._reconnect_attempts = 0
+        # имя канала -> callback, который получает канал после каждого open
+        self._channel_callbacks = {DEFAULT_CHANNEL: self._on_default_channel}
+        self._channels = {}
+        self._channel_attempts = {}
 
     def connect(self):
         """
@@ -33,17 +60,43 @@ class RabbitMqConnection:
             pika.URLParameters(self.amqp_url),
             on_open_callback=self.on_connection_open,
             on_open_error_callback=self.on_connection_open_error,
-            on_close_callback=self.close)
+            on_close_callback=self.on_connection_closed,
+            custom_ioloop=self._ioloop)
+
+    def _backoff(self, attempt):
+        """Full-jitter exponential backoff delay for the given attempt."""
+        ceiling = min(self._max_reconnect_delay,
+                      self._reconnect_delay * 2 ** attempt)
+        return random.uniform(0, ceiling)
+
+    def _reconnect(self):
+        if self._stopping:
+            return
+        self._connection = self.connect()
+
+    def _schedule_reconnect(self):
+        """Drop the channels and connect again after a backoff delay."""
+        self._ready = False
+        self._channels.clear()
+        if self._stopping:
+            self._ioloop.stop()
+            return
+        delay = self._backoff(self._reconnect_attempts)
+        self._reconnect_attempts += 1
+        LOGGER.warning('Reconnecting in %.1f seconds (attempt %s)',
+                       delay, self._reconnect_attempts)
+        self._ioloop.call_later(delay, self._reconnect)
 
     def on_connection_open(self, _unused_connection):
         """This method is called by pika once the connection to RabbitMQ has
-        been established. It passes the handle to the connection object in
-        case we need it, but in this case, we'll just mark it unused.
+        been established. Every registered channel is (re)opened.
 
         :param pika.SelectConnection _unused_connection: The connection
         """
         LOGGER.info('Connection opened')
-        self.open_channel()
+        self._reconnect_attempts = 0
+        for name in list(self._channel_callbacks):
+            self._open_channel(name)
 
     def on_connection_open_error(self, _unused_connection, err):
         """This method is called by pika if the connection to RabbitMQ
@@ -52,75 +105,143 @@ class RabbitMqConnection:
         :param pika.SelectConnection _unused_connection: The connection
         :param Exception err: The error
         """
-        LOGGER.error('Connection open failed, reopening in 5 seconds: %s', err)
-        self._connection.ioloop.call_later(5, self._connection.ioloop.stop)
+        LOGGER.error('Connection open failed: %s', err)
+        self._schedule_reconnect()
+
+    def on_connection_closed(self, _unused_connection, reason):
+        """This method is invoked by pika when the connection to RabbitMQ is
+        closed. Unless we are stopping, a reconnect is scheduled.
 
-    def open_channel(self):
+        :param pika.connection.Connection _unused_connection: The connection
+        :param Exception reason: exception representing reason for loss of
+            connection.
+        """
+        if not self._stopping:
+            LOGGER.warning('Connection closed: %s', reason)
+        self._schedule_reconnect()
+
+    def open_channel(self, name, on_open_callback):
+        """Register a named channel on this connection.
+
+        The channel is opened now if the connection is up, and again after
+        every reconnect or unexpected channel close; on_open_callback gets
+        the new pika channel each time.
+
+        :param str name: Channel name, unique per connection
+        :param callable on_open_callback: Called with the opened channel
+        """
+        self._channel_callbacks[name] = on_open_callback
+        if self.is_connect():
+            self._open_channel(name)
+
+    def _open_channel(self, name):
         """This method will open a new channel with RabbitMQ by issuing the
         Channel.Open RPC command. When RabbitMQ confirms the channel is open
         by sending the Channel.OpenOK RPC reply, the on_channel_open method
         will be invoked.
         """
-        LOGGER.info('Creating a new channel')
-        self._connection.channel(on_open_callback=self.on_channel_open)
-
-    def on_channel_open(self, channel):
-        """This method is invoked by pika when the channel has been opened.
-        The channel object is passed in so we can make use of it.
+        if name not in self._channel_callbacks or not self.is_connect():
+            return
+        LOGGER.info('Creating channel %s', name)
+        self._connection.channel(on_open_callback=lambda channel: (
+            self.on_channel_open(name, channel)))
 
-        Since the channel is now open, we'll declare the exchange to use.
+    def on_channel_open(self, name, channel):
+        """This method is invoked by pika when a channel has been opened.
 
+        :param str name: The channel name
         :param pika.channel.Channel channel: The channel object
-
         """
-        LOGGER.info('Channel opened')
-        self._channel = channel
-        self._ready = True
-        self.add_on_channel_close_callback()
+        LOGGER.info('Channel %s opened', name)
+        self._channels[name] = channel
+        self._channel_attempts.pop(name, None)
+        channel.add_on_close_callback(
+            lambda closed, reason: self.on_channel_closed(name, closed,
+                                                          reason))
+        callback = self._channel_callbacks.get(name)
+        if callback:
+            callback(channel)
 
-        if self._on_ready_callback:
+    def _on_default_channel(self, _unused_channel):
+        first_time = not self._ready and self._on_ready_callback is not None
+        self._ready = True
+        if first_time:
             LOGGER.info('Calling ready callback')
-            self._on_ready_callback(self)
+            callback, self._on_ready_callback = self._on_ready_callback, None
+            callback(self)
 
-    def add_on_channel_close_callback(self):
-        """This method tells pika to call the on_channel_closed method if
-        RabbitMQ unexpectedly closes the channel.
-        """
-        LOGGER.info('Adding channel close callback')
-        self._channel.add_on_close_callback(self.on_channel_closed)
+    def on_channel_closed(self, name, channel, reason):
+        """Invoked by pika when a channel is closed.
 
-    def on_channel_closed(self, channel, reason):
-        """Invoked by pika when RabbitMQ unexpectedly closes the channel.
-        Channels are usually closed if you attempt to do something that
-        violates the protocol, such as re-declare an exchange or queue with
-        different parameters. In this case, we'll close the connection
-        to shutdown the object.
+        A channel closed by the broker (for example after re-declaring a
+        queue with different parameters) is reopened after a backoff delay;
+        the connection and the other channels keep running. Channels closed
+        with close_channel() or together with the connection are left alone.
 
+        :param str name: The channel name
         :param pika.channel.Channel channel: The closed channel
         :param Exception reason: why the channel was closed
         """
-        LOGGER.warning('Channel %i was closed: %s', channel, reason)
-        self._channel = None
-        if not self._stopping and self._connection and self._connection.is_open:
-            self._stopping = True
-            self._connection.close()
+        LOGGER.info('Channel %s (%i) was closed: %s', name, channel,
+                    reason)
+        if self._channels.get(name) is channel:
+            del self._channels[name]
+        if name == DEFAULT_CHANNEL:
+            self._ready = False
+        if (self._stopping or name not in self._channel_callbacks
+                or not self.is_connect()):
+            return
+        attempt = self._channel_attempts.get(name, 0)
+        self._channel_attempts[name] = attempt + 1
+        delay = self._backoff(attempt)
+        LOGGER.warning('Reopening channel %s in %.1f seconds', name, delay)
+        self._ioloop.call_later(delay, lambda: self._open_channel(name))
+
+    def close_channel(self, name):
+        """Close a named channel for good; it is not reopened afterwards.
+
+        :param str name: The channel name
+        """
+        self._channel_callbacks.pop(name, None)
+        channel = self._channels.pop(name, None)
+        if channel is not None and channel.is_open:
+            channel.close()
 
     @property
     def channel(self):
         if not self._ready:
             raise RuntimeError("Connection not ready")
-        return self._channel
+        return self._channels.get(DEFAULT_CHANNEL)
 
     @property
     def ready(self):
-        return self._ready and self._channel and self._channel.is_open
+        channel = self._channels.get(DEFAULT_CHANNEL)
+        return bool(self._ready and channel and channel.is_open)
 
-    def close(self, _unused_connection=None, _unused_reason=None):
-        """This method closes the connection to RabbitMQ."""
+    def add_callback_threadsafe(self, callback):
+        """Schedule a callback on the IOLoop thread from any other thread.
+
+        :param callable callback: The callback to run
+        """
+        self._ioloop.add_callback_threadsafe(callback)
+
+    def call_later(self, delay, callback):
+        """Schedule a callback on the IOLoop after delay seconds.
+
+        :param float delay: Delay in seconds
+        :param callable callback: The callback to run
+        """
+        return self._ioloop.call_later(delay, callback)
+
+    def close(self):
+        """This method closes the connection to RabbitMQ for good; the
+        IOLoop stops once the broker confirms the close."""
+        self._stopping = True
         if self._connection is not None and self._connection.is_open:
             LOGGER.info('Closing connection')
-            self._stopping = True
             self._connection.close()
+        elif self._ioloop is not None:
+            self._ioloop.stop()
 
     def is_connect(self):
         """
@@ -128,10 +249,10 @@ class RabbitMqConnection:
 
         :return: True if the connection is established, False otherwise
         """
-        return self._connection and self._connection.is_open
+        return bool(self._connection and self._connection.is_open)
 
     def run(self):
-        """Запуск IOLoop"""
+        """Запуск IOLoop; возвращается после close()"""
+        self._ioloop = IOLoop()
         self._connection = self.connect()
-        self._connection.ioloop.start()
-
+        self._ioloop.start()
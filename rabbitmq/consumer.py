@@ -12,22 +12,22 @@ def on_connection_ready(connection, queue_name, vault_helper):
     """Callback вызываемый когда подключение готово"""
     exchange = 'api_tasks_exchange'
     
-    # Инициализируем exchange и очередь
-    initializer = RabbitMQInitializer(connection, queues=[queue_name], exchange=exchange)
-    initializer.init()
-    
     # Определяем какой consumer использовать на основе имени очереди
     if queue_name == 'holidays_queue' or queue_name == 'holidays':
-        consumer = HolidaysConsumer(connection, queue_name, vault_helper, 'holidays')
+        consumer = HolidaysConsumer(connection, queue_name, vault_helper,
+                                    'holidays', exchange=exchange)
     elif queue_name == 'weather_queue' or queue_name == 'weather':
-        consumer = WeatherConsumer(connection, queue_name, vault_helper, 'weather')
+        consumer = WeatherConsumer(connection, queue_name, vault_helper,
+                                   'weather', exchange=exchange)
     else:
         print(f"Unknown queue: {queue_name}")
         print("Available queues: holidays_queue, weather_queue")
         sys.exit(1)
     
-    # Запускаем consumer
-    consumer.start_consuming()
+    # Инициализируем exchange и очереди, затем запускаем consumer
+    initializer = RabbitMQInitializer(connection, queues=[queue_name],
+                                      exchange=exchange)
+    initializer.init(on_done=consumer.start_consuming)
     
     # IOLoop уже запущен в connection.run(), ничего дополнительного не нужно
 
@@ -0,0 +1,333 @@
+#!/usr/bin/env python3
+"""Хост, запускающий несколько consumer'ов в одном процессе"""
+import argparse
+import collections
+import importlib
+import json
+import logging
+import os
+import signal
+import sys
+import time
+from broker_connection import RabbitMqConnection
+from http_client import get_client
+from initializer import RabbitMQInitializer, routing_key_for
+from rate_limiter import get_limiter
+from vault_helper import VaultHelper
+
+LOGGER = logging.getLogger(__name__)
+
+EXCHANGE = 'api_tasks_exchange'
+
+# Очередь -> класс consumer'а и его настройки; переопределяется --config
+DEFAULT_CONSUMERS = {
+    'holidays_queue': {
+        'consumer': 'consumers:HolidaysConsumer',
+        'api_alias': 'holidays',
+    },
+    'weather_queue': {
+        'consumer': 'consumers:WeatherConsumer',
+        'api_alias': 'weather',
+    },
+}
+
+
+def load_class(path):
+    """
+    Import a consumer class.
+
+    :param str path: 'module:Class', or a bare class name from consumers
+    :return: The class
+    """
+    module_name, _, class_name = path.rpartition(':')
+    module = importlib.import_module(module_name or 'consumers')
+    return getattr(module, class_name)
+
+
+class ConsumerSpec:
+    def __init__(self, queue, consumer_class, api_alias, workers=None,
+                 prefetch_count=None):
+        """
+        Initialize the ConsumerSpec object.
+
+        :param str queue: The queue to consume from
+        :param type consumer_class: An ApiConsumer subclass
+        :param str api_alias: The API alias passed to the consumer
+        :param int workers: Concurrent handlers for this queue
+        :param int prefetch_count: Unacked messages the broker may push
+        """
+        self.queue = queue
+        self.consumer_class = consumer_class
+        self.api_alias = api_alias
+        self.workers = workers
+        self.prefetch_count = prefetch_count
+
+    @classmethod
+    def from_config(cls, queue, entry):
+        """
+        Build a spec from one entry of the consumers map.
+
+        :param str queue: The queue name (the map key)
+        :param dict entry: consumer, api_alias, workers, prefetch_count
+        :raises ValueError: If the entry is incomplete
+        """
+        try:
+            consumer_class = load_class(entry['consumer'])
+        except (KeyError, ImportError, AttributeError) as error:
+            raise ValueError(f'Bad consumer for {queue}: {error!r}')
+        return cls(
+            queue,
+            consumer_class,
+            entry.get('api_alias', routing_key_for(queue)),
+            workers=entry.get('workers'),
+            prefetch_count=entry.get('prefetch_count'),
+        )
+
+    def build(self, connection, vault_helper, **kwargs):
+        return self.consumer_class(
+            connection, self.queue, vault_helper, self.api_alias,
+            workers=self.workers, prefetch_count=self.prefetch_count,
+            **kwargs)
+
+
+def load_specs(path=None, queues=None):
+    """
+    Read the queue -> consumer map.
+
+    :param str path: JSON file with the map, DEFAULT_CONSUMERS if None
+    :param list queues: Only run these queues (all if empty)
+    :return: list of ConsumerSpec
+    :raises ValueError: If a queue is unknown or an entry is invalid
+    """
+    config = DEFAULT_CONSUMERS
+    if path:
+        with open(path, encoding='utf-8') as file:
+            config = json.load(file)
+    unknown = set(queues or ()) - set(config)
+    if unknown:
+        raise ValueError(f'Unknown queues: {", ".join(sorted(unknown))}')
+    return [ConsumerSpec.from_config(queue, entry)
+            for queue, entry in config.items()
+            if not queues or queue in queues]
+
+
+class ConsumerSupervisor:
+    STOP_POLL_INTERVAL = 0.1
+    METRICS_INTERVAL = float(os.getenv('CONSUMER_METRICS_INTERVAL', 60))
+
+    def __init__(self, connection: RabbitMqConnection, specs, vault_helper,
+                 exchange=EXCHANGE, max_restarts=None, restart_window=None,
+                 restart_delay=None):
+        """
+        Initialize the ConsumerSupervisor object.
+
+        All consumers share the connection (one channel each), the Vault
+        helper with its secret cache and the process-wide HTTP client. When
+        a consumer's handler raises, only that consumer is stopped, its
+        unacked messages go back to the queue, and it is started again after
+        an exponential delay. A queue that fails more than max_restarts
+        times within restart_window seconds is given up on; the other
+        queues keep running.
+
+        :param RabbitMqConnection connection: The shared connection
+        :param list specs: ConsumerSpec objects to run
+        :param VaultHelper vault_helper: Shared secrets helper
+        :param str exchange: The tasks exchange
+        :param int max_restarts: CONSUMER_MAX_RESTARTS, default 5
+        :param float restart_window: CONSUMER_RESTART_WINDOW, default 300
+        :param float restart_delay: CONSUMER_RESTART_DELAY, default 1
+        """
+        self._connection = connection
+        self._specs = {spec.queue: spec for spec in specs}
+        self._vault_helper = vault_helper
+        self._exchange = exchange
+        self._max_restarts = max_restarts or int(
+            os.getenv('CONSUMER_MAX_RESTARTS', 5))
+        self._restart_window = restart_window or float(
+            os.getenv('CONSUMER_RESTART_WINDOW', 300))
+        self._restart_delay = restart_delay or float(
+            os.getenv('CONSUMER_RESTART_DELAY', 1))
+        self._consumers = {}
+        self._stopping_consumers = []
+        self._restarts = collections.defaultdict(collections.deque)
+        self._failed = set()
+        self._stopping = False
+
+    def start(self):
+        """Declare the topology for every queue, then start the consumers."""
+        initializer = RabbitMQInitializer(
+            self._connection, queues=list(self._specs),
+            exchange=self._exchange)
+        initializer.init(on_done=self._start_all)
+
+    def _start_all(self):
+        for queue in self._specs:
+            self._start(queue)
+        if self.METRICS_INTERVAL:
+            self._connection.call_later(self.METRICS_INTERVAL,
+                                        self._log_metrics)
+
+    def _log_metrics(self):
+        """Periodically log queue status, rate limit waits and HTTP stats."""
+        if self._stopping:
+            return
+        LOGGER.info('Consumers: %s', self.status)
+        LOGGER.info('Rate limits: %s', get_limiter().stats())
+        LOGGER.info('HTTP client: %s', get_client().metrics())
+        self._connection.call_later(self.METRICS_INTERVAL, self._log_metrics)
+
+    def _start(self, queue):
+        if self._stopping:
+            return
+        consumer = self._specs[queue].build(
+            self._connection, self._vault_helper, exchange=self._exchange,
+            on_failure=self._on_failure)
+        self._consumers[queue] = consumer
+        try:
+            consumer.start_consuming()
+        except Exception as error:
+            self._on_failure(consumer, error)
+
+    def _on_failure(self, consumer, error):
+        """Stop a failed consumer and schedule its restart."""
+        queue = consumer.queue_name
+        if self._consumers.get(queue) is not consumer:
+            # Этот экземпляр уже остановлен после предыдущей ошибки
+            return
+        del self._consumers[queue]
+        LOGGER.error('Consumer for %s failed: %r', queue, error,
+                     exc_info=error)
+        self._retire(consumer)
+        if self._stopping:
+            return
+
+        now = time.monotonic()
+        restarts = self._restarts[queue]
+        while restarts and now - restarts[0] > self._restart_window:
+            restarts.popleft()
+        if len(restarts) >= self._max_restarts:
+            LOGGER.critical('Consumer for %s failed %s times in %s s, giving '
+                            'up on it', queue, len(restarts) + 1,
+                            self._restart_window)
+            self._failed.add(queue)
+            return
+        restarts.append(now)
+        delay = self._restart_delay * 2 ** (len(restarts) - 1)
+        LOGGER.warning('Restarting consumer for %s in %s s', queue, delay)
+        self._connection.call_later(delay, lambda: self._start(queue))
+
+    def _retire(self, consumer):
+        self._stopping_consumers = [
+            retired for retired in self._stopping_consumers
+            if not retired.is_closed]
+        self._stopping_consumers.append(consumer)
+        try:
+            consumer.stop_consuming()
+        except Exception:
+            LOGGER.exception('Could not stop consumer for %s',
+                             consumer.queue_name)
+
+    def stop(self):
+        """Stop every consumer, then close the connection once drained."""
+        if self._stopping:
+            return
+        LOGGER.info('Stopping consumers')
+        self._stopping = True
+        consumers, self._consumers = list(self._consumers.values()), {}
+        for consumer in consumers:
+            self._retire(consumer)
+        self._close_when_stopped()
+
+    def _close_when_stopped(self):
+        if not all(consumer.is_closed
+                   for consumer in self._stopping_consumers):
+            self._connection.call_later(self.STOP_POLL_INTERVAL,
+                                        self._close_when_stopped)
+            return
+        self._vault_helper.close()
+        self._connection.close()
+
+    @property
+    def status(self):
+        """
+        State of every queue.
+
+        :return: dict queue -> {'state': running|restarting|failed,
+            'restarts': restarts within the window, 'in_flight': messages}
+        """
+        status = {}
+        for queue in self._specs:
+            consumer = self._consumers.get(queue)
+            if queue in self._failed:
+                state = 'failed'
+            elif consumer is not None:
+                state = 'running'
+            else:
+                state = 'restarting'
+            status[queue] = {
+                'state': state,
+                'restarts': len(self._restarts[queue]),
+                'in_flight': consumer.in_flight if consumer else 0,
+            }
+        return status
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Run several API consumers on one RabbitMQ connection')
+    parser.add_argument(
+        'queues', nargs='*',
+        help='Queues to consume (default: every queue in the map)')
+    parser.add_argument(
+        '--config', default=os.getenv('CONSUMER_HOST_CONFIG'),
+        help='JSON map {queue: {"consumer": "module:Class", "api_alias": '
+             '..., "workers": N, "prefetch_count": N}}')
+    args = parser.parse_args()
+
+    try:
+        specs = load_specs(args.config, args.queues)
+    except (OSError, ValueError) as e:
+        print(f"Error: {e}")
+        sys.exit(1)
+
+    # Один пул HTTP-соединений на все очереди: по соединению на обработчик
+    os.environ.setdefault('HTTP_POOL_MAXSIZE', str(max(10, sum(
+        spec.workers or int(os.getenv('CONSUMER_WORKERS', 1))
+        for spec in specs))))
+
+    # Получаем учетные данные из Vault один раз на процесс
+    vault_helper = VaultHelper()
+    rabbitmq_credentials = vault_helper.get_rabbitmq_credentials()
+
+    # Формируем AMQP URL
+    host = os.getenv('RABBITMQ_HOST', 'localhost')
+    port = os.getenv('RABBITMQ_PORT', '5672')
+    amqp_url = (f'amqp://{rabbitmq_credentials["username"]}:'
+                f'{rabbitmq_credentials["password"]}@{host}:{port}/%2F')
+
+    supervisor = None
+
+    def on_connection_ready(connection):
+        nonlocal supervisor
+        supervisor = ConsumerSupervisor(connection, specs, vault_helper)
+        supervisor.start()
+
+    connection = RabbitMqConnection(amqp_url,
+                                    on_ready_callback=on_connection_ready)
+
+    def on_signal(_signum, _frame):
+        if supervisor is None:
+            connection.add_callback_threadsafe(connection.close)
+        else:
+            connection.add_callback_threadsafe(supervisor.stop)
+
+    signal.signal(signal.SIGTERM, on_signal)
+    signal.signal(signal.SIGINT, on_signal)
+
+    # Запускаем; run() возвращается после закрытия соединения
+    connection.run()
+    print("Consumer host stopped")
+
+
+if __name__ == '__main__':
+    main()
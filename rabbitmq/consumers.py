@@ -1,11 +1,21 @@
 from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
 import logging
 import functools
+import itertools
+import os
+import threading
 from broker_connection import RabbitMqConnection
+from initializer import (ATTEMPT_HEADER, MAX_ATTEMPTS, dead_letter_exchange,
+                         retry_exchange, retry_level, retry_level_for_delay,
+                         retry_queue)
 from vault_helper import VaultHelper
 import json
+import pika
 import requests
-from pathlib import Path
+from http_client import get_client
+from rate_limiter import RateLimited, get_limiter
+from results_store import get_store
 
 LOG_FORMAT = ('%(levelname) -10s %(asctime)s %(name) -30s %(funcName) '
               '-35s %(lineno) -5d: %(message)s')
@@ -14,23 +24,78 @@ logging.basicConfig(level=logging.DEBUG, format=LOG_FORMAT)
 
 
 class BaseConsumer(ABC):
-    def __init__(self, connection: RabbitMqConnection, queue_name):
+    DRAIN_POLL_INTERVAL = 0.1
+    _instance_ids = itertools.count(1)
+
+    def __init__(self, connection: RabbitMqConnection, queue_name,
+                 workers=None, prefetch_count=None,
+                 exchange='api_tasks_exchange', on_failure=None):
+        """
+        Initialize the BaseConsumer object.
+
+        With workers > 1 the consumer runs in concurrent mode: deliveries
+        are handed to a thread pool so the IOLoop thread stays free for
+        heartbeats, and acks are marshalled back onto the IOLoop.
+
+        :param connection: RabbitMqConnection
+        :param str queue_name: The name of the queue to consume from
+        :param int workers: Worker threads (CONSUMER_WORKERS, default 1)
+        :param int prefetch_count: Unacked messages the broker may push
+            (CONSUMER_PREFETCH, default: number of workers)
+        :param str exchange: Exchange whose retry and dead-letter
+            exchanges failed messages are routed to
+        :param callable on_failure: Called as on_failure(consumer, error)
+            on the IOLoop when a message handler raises; without it the
+            exception propagates as before
+        """
         self._connection = connection
-        self._channel = connection.channel
+        self._channel = None
         self._consuming = False
         self._consumer_tag = None
         self._queue_name = queue_name
+        # Каждый экземпляр получает свой канал: перезапущенный consumer
+        # не пересекается с каналом, который ещё закрывает предыдущий
+        self._channel_name = f'{queue_name}#{next(self._instance_ids)}'
+        self._exchange = exchange
+        self._on_failure = on_failure
+        self._closed = False
+        self._workers = workers or int(os.getenv('CONSUMER_WORKERS', 1))
+        self._prefetch_count = prefetch_count or int(
+            os.getenv('CONSUMER_PREFETCH', self._workers))
+        self._executor = None
+        self._in_flight = set()
+        self._in_flight_lock = threading.Lock()
+        if self._workers > 1:
+            self._executor = ThreadPoolExecutor(
+                max_workers=self._workers,
+                thread_name_prefix=f'{queue_name}-worker')
 
     def start_consuming(self):
+        """Open the consumer's own channel and consume from it.
+
+        The channel is registered with the connection, so after a reconnect
+        it is reopened and consuming resumes on its own.
+        """
         if not self._connection.ready:
             raise RuntimeError("RabbitMQ connection is not ready")
 
-        LOGGER.info('Starting consumer for queue: %s', self._queue_name)
+        self._connection.open_channel(self._channel_name,
+                                      self.on_channel_open)
 
-        self._channel.basic_qos(prefetch_count=1)
+    def on_channel_open(self, channel):
+        """Called by the connection every time the consumer channel opens.
+
+        :param pika.channel.Channel channel: The new channel
+        """
+        LOGGER.info('Starting consumer for queue: %s (workers=%s, '
+                    'prefetch=%s)', self._queue_name, self._workers,
+                    self._prefetch_count)
+
+        self._channel = channel
+        self._channel.basic_qos(prefetch_count=self._prefetch_count)
         self._consumer_tag = self._channel.basic_consume(
             self._queue_name,
-            self.on_message,
+            self._deliver if self._executor is None else self.dispatch,
             auto_ack=False
         )
 
@@ -38,28 +103,198 @@ class BaseConsumer(ABC):
 
         LOGGER.info('Consumer started with tag: %s', self._consumer_tag)
 
+    def _deliver(self, channel, basic_deliver, properties, body):
+        """Run the handler on the IOLoop (single-threaded mode)."""
+        try:
+            self.on_message(channel, basic_deliver, properties, body)
+        except Exception as error:
+            if self._on_failure is None:
+                raise
+            self._on_failure(self, error)
+
+    def dispatch(self, channel, basic_deliver, properties, body):
+        """Hand a delivery to the worker pool (concurrent mode only)."""
+        future = self._executor.submit(
+            self.on_message, channel, basic_deliver, properties, body)
+        with self._in_flight_lock:
+            self._in_flight.add(future)
+        future.add_done_callback(self._on_worker_done)
+
+    def _on_worker_done(self, future):
+        with self._in_flight_lock:
+            self._in_flight.discard(future)
+        error = future.exception()
+        if error is not None:
+            LOGGER.error('Message handler failed: %r', error,
+                         exc_info=error)
+            if self._on_failure is not None:
+                self._run_on_ioloop(self._on_failure, self, error)
+
+    @property
+    def in_flight(self):
+        with self._in_flight_lock:
+            return len(self._in_flight)
+
+    def _run_on_ioloop(self, callback, *args):
+        """Run a channel operation on the IOLoop thread.
+
+        Channel methods are not thread-safe, so worker threads schedule
+        them with add_callback_threadsafe instead of calling them directly.
+        """
+        if self._executor is None:
+            callback(*args)
+        else:
+            self._connection.add_callback_threadsafe(
+                functools.partial(callback, *args))
+
     @abstractmethod
     def on_message(self, _unused_channel, basic_deliver, properties, body):
         pass
 
-    def acknowledge_message(self, delivery_tag):
+    @staticmethod
+    def _channel_gone(channel, delivery_tag):
+        """Delivery tags are only valid on the channel that delivered them.
+
+        If that channel was lost (e.g. the broker restarted) the broker
+        redelivers the message on the new channel, so the late ack is
+        dropped instead of being sent with a foreign delivery tag.
+        """
+        if channel is not None and channel.is_open:
+            return False
+        LOGGER.warning('Channel of message %s is closed, the broker will '
+                       'redeliver it', delivery_tag)
+        return True
+
+    def acknowledge_message(self, delivery_tag, channel=None):
         """Acknowledge the message delivery from RabbitMQ by sending a
         Basic.Ack RPC method for the delivery tag.
 
         :param int delivery_tag: The delivery tag from the Basic.Deliver frame
+        :param pika.channel.Channel channel: The channel the message came
+            from, defaults to the current one
 
         """
         LOGGER.info('Acknowledging message %s', delivery_tag)
-        self._channel.basic_ack(delivery_tag)
+        self._run_on_ioloop(self._ack, channel or self._channel, delivery_tag)
+
+    def _ack(self, channel, delivery_tag):
+        if not self._channel_gone(channel, delivery_tag):
+            channel.basic_ack(delivery_tag)
+
+    def _republish_and_ack(self, channel, exchange, routing_key,
+                           delivery_tag, properties, body, headers):
+        """Publish a copy of the message elsewhere, then ack the original.
+
+        Runs on the IOLoop so the publish always precedes the ack.
+        """
+        if self._channel_gone(channel, delivery_tag):
+            return
+        channel.basic_publish(
+            exchange,
+            routing_key,
+            body,
+            pika.BasicProperties(
+                app_id=properties.app_id,
+                content_type=properties.content_type,
+                message_id=properties.message_id,
+                delivery_mode=2,
+                headers=headers,
+            ),
+        )
+        channel.basic_ack(delivery_tag)
+
+    def dead_letter(self, basic_deliver, properties, body, reason,
+                    channel=None):
+        """Move a message to <queue>.dead and ack it.
+
+        :param Exception reason: Why the message could not be processed
+        :param pika.channel.Channel channel: The channel the message came
+            from, defaults to the current one
+        """
+        LOGGER.error('Dead-lettering message %s: %r',
+                     basic_deliver.delivery_tag, reason)
+        headers = dict(properties.headers or {})
+        headers['x-last-error'] = repr(reason)[:500]
+        self._run_on_ioloop(
+            self._republish_and_ack,
+            channel or self._channel,
+            dead_letter_exchange(self._exchange),
+            self._queue_name,
+            basic_deliver.delivery_tag,
+            properties,
+            body,
+            headers,
+        )
+
+    def retry_later(self, basic_deliver, properties, body, reason,
+                    channel=None):
+        """Send a message to the retry queue of its backoff level and ack it.
+
+        The attempt number travels in the x-attempt header; once it reaches
+        MAX_ATTEMPTS the message is dead-lettered instead.
+
+        :param Exception reason: Why the attempt failed
+        :param pika.channel.Channel channel: The channel the message came
+            from, defaults to the current one
+        """
+        headers = dict(properties.headers or {})
+        attempt = int(headers.get(ATTEMPT_HEADER, 0)) + 1
+        if attempt >= MAX_ATTEMPTS:
+            self.dead_letter(basic_deliver, properties, body, reason,
+                             channel)
+            return
+        headers[ATTEMPT_HEADER] = attempt
+        headers['x-last-error'] = repr(reason)[:500]
+        queue = retry_queue(self._queue_name, retry_level(attempt))
+        LOGGER.warning('Attempt %s for message %s failed, retrying via %s: '
+                       '%r', attempt, basic_deliver.delivery_tag, queue,
+                       reason)
+        self._run_on_ioloop(
+            self._republish_and_ack,
+            channel or self._channel,
+            retry_exchange(self._exchange),
+            queue,
+            basic_deliver.delivery_tag,
+            properties,
+            body,
+            headers,
+        )
+
+    def defer(self, basic_deliver, properties, body, delay, channel=None):
+        """Park a message in a retry queue without counting an attempt.
+
+        Used when the upstream is rate limited: the message is fine, it just
+        has to wait at least delay seconds.
+
+        :param float delay: Seconds the message should wait
+        """
+        queue = retry_queue(self._queue_name, retry_level_for_delay(delay))
+        LOGGER.info('Deferring message %s via %s for %.1f s',
+                    basic_deliver.delivery_tag, queue, delay)
+        self._run_on_ioloop(
+            self._republish_and_ack,
+            channel or self._channel,
+            retry_exchange(self._exchange),
+            queue,
+            basic_deliver.delivery_tag,
+            properties,
+            body,
+            dict(properties.headers or {}),
+        )
 
     def stop_consuming(self):
         """Tell RabbitMQ that you would like to stop consuming by sending the
-        Basic.Cancel RPC command.
+        Basic.Cancel RPC command. Messages already handed to workers are
+        allowed to finish and get acked before the channel is closed.
         """
-        if self._channel:
+        if self._channel and self._channel.is_open and self._consuming:
             LOGGER.info('Sending a Basic.Cancel RPC command to RabbitMQ')
             cb = functools.partial(self.on_cancelok, userdata=self._consumer_tag)
             self._channel.basic_cancel(self._consumer_tag, callback=cb)
+        else:
+            # Канал уже потерян: отменять нечего, просто освобождаем ресурсы
+            self._consuming = False
+            self._close_when_drained()
 
     def on_cancelok(self, _unused_frame, userdata):
         """This method is invoked by pika when RabbitMQ acknowledges the
@@ -72,6 +307,21 @@ class BaseConsumer(ABC):
         """
         self._consuming = False
 
+        self._close_when_drained()
+
+    def _close_when_drained(self):
+        """Close the channel once every in-flight message has been handled.
+
+        Polls on the IOLoop instead of blocking it, because the pending acks
+        themselves are delivered through the IOLoop.
+        """
+        if self.in_flight:
+            LOGGER.info('Waiting for %s in-flight messages', self.in_flight)
+            self._connection.call_later(self.DRAIN_POLL_INTERVAL,
+                                        self._close_when_drained)
+            return
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
         self.close_channel()
 
     def close_channel(self):
@@ -80,15 +330,25 @@ class BaseConsumer(ABC):
 
         """
         LOGGER.info('Closing the channel')
-        self._channel.close()
+        self._connection.close_channel(self._channel_name)
+        self._closed = True
 
     @property
     def is_consuming(self):
         return self._consuming
 
+    @property
+    def is_closed(self):
+        return self._closed
+
+    @property
+    def queue_name(self):
+        return self._queue_name
+
 
 class ApiConsumer(BaseConsumer, ABC):
-    def __init__(self, connection: RabbitMqConnection, queue_name, vault_helper: VaultHelper, api_alias):
+    def __init__(self, connection: RabbitMqConnection, queue_name,
+                 vault_helper: VaultHelper, api_alias, **kwargs):
         """
         Initialize the ApiConsumer instance.
 
@@ -100,15 +360,51 @@ class ApiConsumer(BaseConsumer, ABC):
             The Vault helper object.
         :param api_alias: str
             The API alias ('holidays' or 'weather').
+        :param kwargs:
+            Passed to BaseConsumer (workers, prefetch_count, exchange,
+            on_failure).
         """
-        super().__init__(connection, queue_name)
+        super().__init__(connection, queue_name, **kwargs)
         self._vault_helper = vault_helper
         self._api_alias = api_alias
 
-    def on_message(self, _unused_channel, basic_deliver, properties, body):
+    def on_message(self, channel, basic_deliver, properties, body):
+        """Process a task message; it is always acked or re-routed.
+
+        Malformed messages and 4xx answers are dead-lettered right away,
+        everything else (5xx, 429, timeouts, Vault trouble) is retried
+        with backoff. Messages that would wait too long for a rate limit
+        token are deferred without using up an attempt.
+        """
         LOGGER.info('Received message # %s from %s: %s',
                     basic_deliver.delivery_tag, properties.app_id, body)
 
+        try:
+            self.process_message(body)
+        except RateLimited as error:
+            self.defer(basic_deliver, properties, body, error.retry_after,
+                       channel)
+        except (ValueError, KeyError, TypeError, AttributeError) as error:
+            self.dead_letter(basic_deliver, properties, body, error, channel)
+        except requests.HTTPError as error:
+            status = error.response.status_code
+            if status == 429 or status >= 500:
+                self.retry_later(basic_deliver, properties, body, error,
+                                 channel)
+            else:
+                self.dead_letter(basic_deliver, properties, body, error,
+                                 channel)
+        except Exception as error:
+            self.retry_later(basic_deliver, properties, body, error, channel)
+        else:
+            # Отправляем acknowledgement
+            self.acknowledge_message(basic_deliver.delivery_tag, channel)
+
+    def process_message(self, body):
+        """Call the API for one message and store the response.
+
+        :param bytes body: The message body
+        """
         json_data = json.loads(body)
         api_alias = json_data.get('api_alias')
         api_params = json_data.get('api_params', {})
@@ -120,40 +416,29 @@ class ApiConsumer(BaseConsumer, ABC):
         LOGGER.info('API key retrieved from Vault')
         LOGGER.info('API params: %s', api_params)
 
+        # Ждём своей очереди в лимите внешнего API
+        get_limiter().acquire(self._api_alias)
+
         # Выполняем запрос к API
         response = self.make_api_request(api_key, api_params)
+        response.raise_for_status()
 
         # Сохраняем результат
         self.save_response(response, api_params)
 
         LOGGER.debug('Response: %s', response.json())
 
-        # Отправляем acknowledgement
-        self.acknowledge_message(basic_deliver.delivery_tag)
-
     @abstractmethod
     def make_api_request(self, api_key: str, api_params: dict) -> requests.Response:
         pass
 
     def save_response(self, response: requests.Response, api_params: dict):
-        """Save API response to JSON file"""
-        data_dir = Path('api_results')
-        data_dir.mkdir(exist_ok=True)
-
-        # Формируем имя файла на основе API alias и параметров
-        if self._api_alias == 'holidays':
-            filename = f"holidays_{api_params.get('country', 'US')}_{api_params.get('year', 2025)}_{api_params.get('month', 12)}_{api_params.get('day', 25)}.json"
-        elif self._api_alias == 'weather':
-            query = api_params.get('query', 'New York').replace(' ', '_')
-            filename = f"weather_{query}.json"
-        else:
-            filename = f"{self._api_alias}_data.json"
-
-        filepath = data_dir / filename
-        with open(filepath, 'w', encoding='utf-8') as f:
-            json.dump(response.json(), f, indent=4, ensure_ascii=False)
+        """Append the API response to the results store"""
+        record_id = get_store().append(
+            self._api_alias, api_params, response.json())
 
-        LOGGER.info('Response saved to %s', filepath)
+        LOGGER.info('Response saved as record %s', record_id)
+        return record_id
 
 
 class HolidaysConsumer(ApiConsumer):
@@ -167,7 +452,7 @@ class HolidaysConsumer(ApiConsumer):
         :return: The response from the API
         :rtype: requests.Response
         """
-        return requests.get(
+        return get_client().get(
             url='https://holidays.abstractapi.com/v1/',
             params={
                 'api_key': api_key,
@@ -190,7 +475,7 @@ class WeatherConsumer(ApiConsumer):
         :return: The response from the API
         :rtype: requests.Response
         """
-        return requests.get(
+        return get_client().get(
             url='http://api.weatherstack.com/current',
             params={
                 'access_key': api_key,
@@ -0,0 +1,291 @@
+import logging
+import os
+import random
+import threading
+import time
+from collections import deque
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import MaxRetryError
+from urllib3.util.retry import Retry
+
+LOGGER = logging.getLogger(__name__)
+
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+
+class CircuitOpenError(requests.ConnectionError):
+    """Raised instead of calling a host whose circuit breaker is open."""
+
+
+class JitteredRetry(Retry):
+    """
+    urllib3 Retry with full jitter: sleep uniformly in [0, backoff].
+
+    A Retry-After longer than max_retry_after is not slept through: retries
+    stop and the response is returned as is, so the consumer can send the
+    message to its retry queue instead of holding a worker thread.
+    """
+
+    def __init__(self, *args, max_retry_after=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.max_retry_after = max_retry_after
+
+    def new(self, **kwargs):
+        kwargs.setdefault('max_retry_after', self.max_retry_after)
+        return super().new(**kwargs)
+
+    def get_backoff_time(self):
+        return random.uniform(0, super().get_backoff_time())
+
+    def increment(self, method=None, url=None, response=None, error=None,
+                  _pool=None, _stacktrace=None):
+        if (response is not None and self.max_retry_after is not None
+                and self.respect_retry_after_header):
+            wait = self.get_retry_after(response)
+            if wait is not None and wait > self.max_retry_after:
+                # With raise_on_status=False urlopen returns this response
+                raise MaxRetryError(_pool, url, 'Retry-After exceeds cap')
+        return super().increment(method, url, response, error, _pool,
+                                 _stacktrace)
+
+
+class CircuitBreaker:
+    def __init__(self, failure_threshold=5, reset_timeout=30.0):
+        """
+        Initialize the CircuitBreaker object.
+
+        :param int failure_threshold: Consecutive failures opening the circuit
+        :param float reset_timeout: Seconds before a trial call is let through
+        """
+        self._failure_threshold = failure_threshold
+        self._reset_timeout = reset_timeout
+        self._failures = 0
+        self._opened_at = None
+        self._trial_in_progress = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        with self._lock:
+            if self._opened_at is None:
+                return 'closed'
+            if time.monotonic() - self._opened_at < self._reset_timeout:
+                return 'open'
+            return 'half-open'
+
+    def allow(self):
+        """
+        Check whether a call may be made.
+
+        While open every call is refused. Once reset_timeout has passed a
+        single trial call is allowed (half-open); its outcome closes or
+        re-opens the circuit.
+        """
+        with self._lock:
+            if self._opened_at is None:
+                return True
+            if time.monotonic() - self._opened_at < self._reset_timeout:
+                return False
+            if self._trial_in_progress:
+                return False
+            self._trial_in_progress = True
+            return True
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+            self._trial_in_progress = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            self._trial_in_progress = False
+            if (self._opened_at is not None
+                    or self._failures >= self._failure_threshold):
+                self._opened_at = time.monotonic()
+
+
+class HostMetrics:
+    SAMPLES = 1000
+
+    def __init__(self):
+        self.requests = 0
+        self.errors = 0
+        self.rejected = 0
+        self.total_latency = 0.0
+        self.max_latency = 0.0
+        self._samples = deque(maxlen=self.SAMPLES)
+        self._lock = threading.Lock()
+
+    def observe(self, latency, error=False):
+        with self._lock:
+            self.requests += 1
+            self.errors += int(error)
+            self.total_latency += latency
+            self.max_latency = max(self.max_latency, latency)
+            self._samples.append(latency)
+
+    def reject(self):
+        with self._lock:
+            self.rejected += 1
+
+    def snapshot(self):
+        with self._lock:
+            samples = sorted(self._samples)
+            requests_count = self.requests
+            snapshot = {
+                'requests': requests_count,
+                'errors': self.errors,
+                'rejected': self.rejected,
+                'avg_latency': (self.total_latency / requests_count
+                                if requests_count else 0.0),
+                'max_latency': self.max_latency,
+            }
+        for name, quantile in (('p50_latency', 0.5), ('p95_latency', 0.95)):
+            snapshot[name] = (
+                samples[min(int(len(samples) * quantile), len(samples) - 1)]
+                if samples else 0.0
+            )
+        return snapshot
+
+
+class HttpClient:
+    """
+    Outbound HTTP client shared by everything in the process.
+
+    One requests.Session with a keep-alive connection pool per host,
+    default timeouts, jittered retries with backoff on 429/5xx (honouring
+    Retry-After), a circuit breaker per host and per-host latency metrics.
+    """
+
+    def __init__(self, timeout=(3.05, 15), retries=3, backoff_factor=0.5,
+                 pool_connections=10, pool_maxsize=10, failure_threshold=5,
+                 reset_timeout=30.0, max_retry_after=30.0):
+        """
+        Initialize the HttpClient object.
+
+        :param float|tuple timeout: Default (connect, read) timeout
+        :param int retries: Retries on connection errors and 429/5xx
+        :param float backoff_factor: Base of the exponential backoff
+        :param int pool_connections: Number of per-host pools kept
+        :param int pool_maxsize: Keep-alive connections per host
+        :param int failure_threshold: Failures that open a host circuit
+        :param float reset_timeout: Seconds a circuit stays open
+        :param float max_retry_after: Longest Retry-After waited in place
+        """
+        self._timeout = timeout
+        self._failure_threshold = failure_threshold
+        self._reset_timeout = reset_timeout
+        self._breakers = {}
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+        retry = JitteredRetry(
+            total=retries,
+            backoff_factor=backoff_factor,
+            status_forcelist=RETRY_STATUSES,
+            raise_on_status=False,
+            max_retry_after=max_retry_after,
+        )
+        adapter = HTTPAdapter(
+            pool_connections=pool_connections,
+            pool_maxsize=pool_maxsize,
+            max_retries=retry,
+        )
+        self._session = requests.Session()
+        self._session.mount('http://', adapter)
+        self._session.mount('https://', adapter)
+
+    @classmethod
+    def from_env(cls):
+        """Build a client configured from HTTP_* environment variables."""
+        return cls(
+            timeout=(float(os.getenv('HTTP_CONNECT_TIMEOUT', 3.05)),
+                     float(os.getenv('HTTP_READ_TIMEOUT', 15))),
+            retries=int(os.getenv('HTTP_RETRIES', 3)),
+            backoff_factor=float(os.getenv('HTTP_BACKOFF_FACTOR', 0.5)),
+            pool_maxsize=int(os.getenv('HTTP_POOL_MAXSIZE', 10)),
+            failure_threshold=int(os.getenv('HTTP_BREAKER_FAILURES', 5)),
+            reset_timeout=float(os.getenv('HTTP_BREAKER_RESET', 30)),
+            max_retry_after=float(os.getenv('HTTP_MAX_RETRY_AFTER', 30)),
+        )
+
+    def _host_state(self, host):
+        with self._lock:
+            if host not in self._breakers:
+                self._breakers[host] = CircuitBreaker(
+                    self._failure_threshold, self._reset_timeout)
+                self._metrics[host] = HostMetrics()
+            return self._breakers[host], self._metrics[host]
+
+    def request(self, method, url, **kwargs):
+        """
+        Send a request through the shared session.
+
+        :param str method: HTTP method
+        :param str url: The URL to call
+        :raises CircuitOpenError: If the host circuit is open
+        :rtype: requests.Response
+        """
+        host = urlsplit(url).netloc
+        breaker, metrics = self._host_state(host)
+        if not breaker.allow():
+            metrics.reject()
+            raise CircuitOpenError(f'Circuit for {host} is open')
+
+        kwargs.setdefault('timeout', self._timeout)
+        started = time.monotonic()
+        try:
+            response = self._session.request(method, url, **kwargs)
+        except requests.RequestException:
+            metrics.observe(time.monotonic() - started, error=True)
+            breaker.record_failure()
+            raise
+
+        failed = response.status_code in RETRY_STATUSES
+        metrics.observe(time.monotonic() - started, error=failed)
+        if failed:
+            LOGGER.warning('%s %s answered %s after retries',
+                           method, host, response.status_code)
+            breaker.record_failure()
+        else:
+            breaker.record_success()
+        return response
+
+    def get(self, url, **kwargs):
+        return self.request('GET', url, **kwargs)
+
+    def metrics(self):
+        """
+        Per-host latency metrics.
+
+        :return: dict host -> counters, latencies (seconds) and breaker state
+        """
+        with self._lock:
+            hosts = list(self._metrics)
+        result = {}
+        for host in hosts:
+            breaker, metrics = self._host_state(host)
+            result[host] = dict(metrics.snapshot(), circuit=breaker.state)
+        return result
+
+    def close(self):
+        self._session.close()
+
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_client():
+    """Return the process-wide HttpClient, creating it on first use."""
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = HttpClient.from_env()
+    return _client
@@ -1,4 +1,57 @@
 from broker_connection import RabbitMqConnection
+from collections import deque
+import functools
+import logging
+import os
+
+LOGGER = logging.getLogger(__name__)
+
+# Задержки повторных попыток, секунды: уровень N ждёт RETRY_DELAYS[N]
+RETRY_DELAYS = [int(delay) for delay in
+                os.getenv('RETRY_DELAYS', '5,30,120,600').split(',')]
+MAX_ATTEMPTS = int(os.getenv('MAX_ATTEMPTS', 5))
+ATTEMPT_HEADER = 'x-attempt'
+
+
+def routing_key_for(queue):
+    """
+    Routing key of a work queue.
+
+    If the queue is called holidays_queue -> routing key holidays,
+    if it is called holidays -> routing key holidays.
+    """
+    if queue.endswith('_queue'):
+        return queue[:-6]  # Убираем '_queue'
+    return queue
+
+
+def dead_letter_exchange(exchange):
+    return f'{exchange}.dlx'
+
+
+def retry_exchange(exchange):
+    return f'{exchange}.retry'
+
+
+def dead_letter_queue(queue):
+    return f'{queue}.dead'
+
+
+def retry_queue(queue, level):
+    return f'{queue}.retry.{level}'
+
+
+def retry_level(attempt):
+    """Backoff level for the given attempt number (1-based)."""
+    return min(attempt - 1, len(RETRY_DELAYS) - 1)
+
+
+def retry_level_for_delay(delay):
+    """Shortest backoff level that waits at least delay seconds."""
+    for level, level_delay in enumerate(RETRY_DELAYS):
+        if level_delay >= delay:
+            return level
+    return len(RETRY_DELAYS) - 1
 
 
 class RabbitMQInitializer:
@@ -15,37 +68,98 @@ class RabbitMQInitializer:
         self._channel = connection.channel
         self._queues = queues
         self._exchange = exchange
+        self._steps = deque()
+        self._on_done = None
 
-    def init(self):
+    def _plan(self):
         """
-        Initialize RabbitMQ by declaring the exchange and queues.
+        Declarations in the order they have to be made.
 
-        :raises RuntimeError: If RabbitMQ connection is not ready
+        For every work queue:
+        - <queue>.dead is bound to the dead-letter exchange and collects
+          messages that are poison or ran out of attempts;
+        - <queue>.retry.<level> queues hold a failed message for
+          RETRY_DELAYS[level] seconds (x-message-ttl) and then dead-letter
+          it through the default exchange straight back to <queue>.
+        The work queues themselves are declared without arguments, so the
+        topology can be applied on top of already existing queues.
         """
-        if not self._connection.ready:
-            raise RuntimeError('RabbitMQ connection is not ready')
+        channel = self._channel
+        dlx = dead_letter_exchange(self._exchange)
+        retry = retry_exchange(self._exchange)
 
         # Создаем durable direct exchange
-        self._connection.channel.exchange_declare(
-            exchange=self._exchange,
-            exchange_type='direct',
-            durable=True
-        )
+        for exchange in (self._exchange, dlx, retry):
+            yield functools.partial(
+                channel.exchange_declare,
+                exchange=exchange,
+                exchange_type='direct',
+                durable=True,
+            )
 
         # Создаем durable очереди и связываем их с exchange
         for queue in self._queues:
-            # Определяем routing key на основе имени очереди
-            # Если очередь называется holidays_queue -> routing key holidays
-            # Если очередь называется holidays -> routing key holidays
-            if queue.endswith('_queue'):
-                routing_key = queue[:-6]  # Убираем '_queue'
-            else:
-                routing_key = queue
-            
-            self._channel.queue_declare(queue=queue, durable=True)
-            self._channel.queue_bind(
-                exchange=self._exchange,
+            yield functools.partial(
+                channel.queue_declare, queue=queue, durable=True)
+            yield functools.partial(
+                channel.queue_bind,
                 queue=queue,
-                routing_key=routing_key
+                exchange=self._exchange,
+                routing_key=routing_key_for(queue),
             )
 
+            yield functools.partial(
+                channel.queue_declare,
+                queue=dead_letter_queue(queue),
+                durable=True,
+            )
+            yield functools.partial(
+                channel.queue_bind,
+                queue=dead_letter_queue(queue),
+                exchange=dlx,
+                routing_key=queue,
+            )
+
+            for level, delay in enumerate(RETRY_DELAYS):
+                yield functools.partial(
+                    channel.queue_declare,
+                    queue=retry_queue(queue, level),
+                    durable=True,
+                    arguments={
+                        'x-message-ttl': delay * 1000,
+                        'x-dead-letter-exchange': '',
+                        'x-dead-letter-routing-key': queue,
+                    },
+                )
+                yield functools.partial(
+                    channel.queue_bind,
+                    queue=retry_queue(queue, level),
+                    exchange=retry,
+                    routing_key=retry_queue(queue, level),
+                )
+
+    def init(self, on_done=None):
+        """
+        Initialize RabbitMQ by declaring the exchanges and queues.
+
+        Every declaration waits for the DeclareOk/BindOk of the previous
+        one, and on_done is called once the whole topology exists.
+
+        :param callable on_done: Called when everything is declared
+        :raises RuntimeError: If RabbitMQ connection is not ready
+        """
+        if not self._connection.ready:
+            raise RuntimeError('RabbitMQ connection is not ready')
+
+        self._steps = deque(self._plan())
+        self._on_done = on_done
+        self._next_step()
+
+    def _next_step(self, _unused_frame=None):
+        if not self._steps:
+            LOGGER.info('RabbitMQ topology declared for %s', self._queues)
+            if self._on_done:
+                self._on_done()
+            return
+        step = self._steps.popleft()
+        step(callback=self._next_step)
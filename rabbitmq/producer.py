@@ -9,49 +9,62 @@ from initializer import RabbitMQInitializer
 from publisher import TaskPublisher
 
 
-def on_connection_ready(connection, api_alias, api_params):
+def read_jobs(path):
+    """Читает задачи из JSONL: по объекту {"api_alias", "api_params"} в строке"""
+    jobs = []
+    with open(path, encoding='utf-8') as file:
+        for line_number, line in enumerate(file, start=1):
+            if not line.strip():
+                continue
+            try:
+                job = json.loads(line)
+                jobs.append((job['api_alias'], job.get('api_params', {})))
+            except (json.JSONDecodeError, KeyError, TypeError) as e:
+                print(f"Error: Invalid job on line {line_number}: {e}")
+                sys.exit(1)
+    return jobs
+
+
+def on_connection_ready(connection, jobs):
     """Callback вызываемый когда подключение готово"""
     exchange = 'api_tasks_exchange'
     
-    # Инициализируем exchange
-    initializer = RabbitMQInitializer(connection, queues=[], exchange=exchange)
-    initializer.init()
-    
-    # Функция для закрытия соединения
-    def stop_and_close():
-        connection._stopping = True
-        if connection._connection and connection._connection.is_open:
-            connection._connection.close()
-        if connection._connection:
-            connection._connection.ioloop.stop()
+    # Создаем publisher с callback для закрытия соединения
+    publisher = TaskPublisher(connection, close_callback=connection.close)
     
-    # Создаем publisher с callback для закрытия
-    publisher = TaskPublisher(connection, close_callback=stop_and_close)
-    
-    if api_alias == 'holidays':
-        publisher.publish_holidays_task(api_params)
-    elif api_alias == 'weather':
-        publisher.publish_weather_task(api_params)
-    else:
-        print(f"Unknown API alias: {api_alias}")
-        sys.exit(1)
+    def submit_jobs():
+        try:
+            publisher.submit(jobs)
+        except ValueError as e:
+            print(f"Error: {e}")
+            sys.exit(1)
+
+    # Инициализируем exchange, затем публикуем
+    initializer = RabbitMQInitializer(connection, queues=[], exchange=exchange)
+    initializer.init(on_done=submit_jobs)
 
 
 def main():
     if len(sys.argv) < 3:
         print("Usage: python producer.py <api_alias> <api_params_json>")
+        print("       python producer.py --jobs <jobs.jsonl>")
         print("Example: python producer.py holidays '{\"country\":\"US\",\"year\":2025,\"month\":12,\"day\":25}'")
         print("Example: python producer.py weather '{\"query\":\"New York\"}'")
+        print("Example: python producer.py --jobs jobs.jsonl")
         sys.exit(1)
     
-    api_alias = sys.argv[1]
-    api_params_str = sys.argv[2]
-    
-    try:
-        api_params = json.loads(api_params_str)
-    except json.JSONDecodeError as e:
-        print(f"Error: Invalid JSON in api_params: {e}")
-        sys.exit(1)
+    if sys.argv[1] == '--jobs':
+        jobs = read_jobs(sys.argv[2])
+    else:
+        api_alias = sys.argv[1]
+        api_params_str = sys.argv[2]
+
+        try:
+            api_params = json.loads(api_params_str)
+        except json.JSONDecodeError as e:
+            print(f"Error: Invalid JSON in api_params: {e}")
+            sys.exit(1)
+        jobs = [(api_alias, api_params)]
     
     # Получаем учетные данные из Vault
     vault_helper = VaultHelper()
@@ -64,7 +77,7 @@ def main():
     amqp_url = f'amqp://{rabbitmq_credentials["username"]}:{rabbitmq_credentials["password"]}@{host}:{port}/%2F'
     
     # Создаем callback
-    cb = functools.partial(on_connection_ready, api_alias=api_alias, api_params=api_params)
+    cb = functools.partial(on_connection_ready, jobs=jobs)
     connection = RabbitMqConnection(amqp_url, on_ready_callback=cb)
     
     # Запускаем
@@ -1,7 +1,11 @@
 import logging
 from broker_connection import RabbitMqConnection
+from collections import deque
 import pika
 import json
+import os
+import time
+import uuid
 
 LOG_FORMAT = ('%(levelname) -10s %(asctime)s %(name) -30s %(funcName) '
               '-35s %(lineno) -5d: %(message)s')
@@ -9,16 +13,105 @@ LOGGER = logging.getLogger(__name__)
 logging.basicConfig(level=logging.DEBUG, format=LOG_FORMAT)
 
 
+class _Job:
+    # attempts counts republishes after a nack or a return; publishing
+    # again on a new channel after a reconnect does not use one up
+    __slots__ = ('api_alias', 'api_params', 'message_id', 'attempts',
+                 'published_at', 'returned')
+
+    def __init__(self, api_alias, api_params):
+        self.api_alias = api_alias
+        self.api_params = api_params
+        self.message_id = uuid.uuid4().hex
+        self.attempts = 0
+        self.published_at = None
+        self.returned = False
+
+
 class TaskPublisher:
+    CHANNEL_NAME = 'publisher'
     ROUTING_KEY_FOR_HOLIDAYS = 'holidays'
     ROUTING_KEY_FOR_WEATHER = 'weather'
+    ROUTING_KEYS = {
+        'holidays': ROUTING_KEY_FOR_HOLIDAYS,
+        'weather': ROUTING_KEY_FOR_WEATHER,
+    }
     EXCHANGE = 'api_tasks_exchange'
     _close_callback = None
 
-    def __init__(self, connection: RabbitMqConnection, close_callback=None):
+    def __init__(self, connection: RabbitMqConnection, close_callback=None,
+                 max_in_flight=None, max_retries=None):
+        """
+        Initialize the TaskPublisher object.
+
+        The publisher is long-lived: jobs submitted with submit() are queued
+        and published as long as fewer than max_in_flight messages are
+        waiting for a broker confirm. Nacked and returned (unroutable)
+        messages are published again up to max_retries times. The publisher
+        has its own channel on the connection; when it is reopened after a
+        reconnect, messages that were still waiting for a confirm are
+        published again without using up a retry.
+
+        :param RabbitMqConnection connection: The RabbitMQ connection
+        :param callable close_callback: Called when every submitted job has
+            been confirmed or given up on
+        :param int max_in_flight: Unconfirmed messages allowed at once
+            (PUBLISHER_MAX_IN_FLIGHT, default 256)
+        :param int max_retries: Republish attempts for a nacked or returned
+            message (PUBLISHER_MAX_RETRIES, default 3)
+        """
         self._connection = connection
+        self._channel = None
         self._close_callback = close_callback
+        self._max_in_flight = max_in_flight or int(
+            os.getenv('PUBLISHER_MAX_IN_FLIGHT', 256))
+        self._max_retries = (max_retries if max_retries is not None
+                             else int(os.getenv('PUBLISHER_MAX_RETRIES', 3)))
+        self._pending = deque()
+        self._outstanding = {}
+        self._by_message_id = {}
+        self._delivery_tag = 0
+        self._started_at = None
+        self._settled_notified = False
+        self._stats = {
+            'submitted': 0,
+            'published': 0,
+            'confirmed': 0,
+            'nacked': 0,
+            'returned': 0,
+            'retried': 0,
+            'republished': 0,
+            'failed': 0,
+            'confirm_latency_total': 0.0,
+            'confirm_latency_max': 0.0,
+        }
+        connection.open_channel(self.CHANNEL_NAME, self.__on_channel_open)
+
+    def __on_channel_open(self, channel):
+        """
+        Called by the connection every time the publisher channel opens.
+
+        Delivery tags restart from 1 on a new channel, so messages left
+        unconfirmed on the old one are queued again ahead of the rest. The
+        broker never rejected them, so this is not counted as a retry.
+
+        :param pika.channel.Channel channel: The new channel
+        """
+        self._channel = channel
+        unconfirmed = [self._outstanding[tag]
+                       for tag in sorted(self._outstanding)]
+        if unconfirmed:
+            LOGGER.warning('Republishing %s unconfirmed messages',
+                           len(unconfirmed))
+        for job in reversed(unconfirmed):
+            job.returned = False
+            self._pending.appendleft(job)
+        self._stats['republished'] += len(unconfirmed)
+        self._outstanding.clear()
+        self._by_message_id.clear()
+        self._delivery_tag = 0
         self.__setup_delivery_confirmation()
+        self.__pump()
 
     def __setup_delivery_confirmation(self):
         """
@@ -29,83 +122,182 @@ class TaskPublisher:
         the __on_delivery_confirmation method will be called with a
         pika.frame.Method object as an argument. The method object
         contains information about whether the message was confirmed or
-        rejected.
+        rejected. Unroutable messages published with mandatory=True come
+        back through __on_message_returned before their ack.
         """
-        self._connection.channel.confirm_delivery(self.__on_delivery_confirmation)
+        channel = self._channel
+        channel.confirm_delivery(self.__on_delivery_confirmation)
+        channel.add_on_return_callback(self.__on_message_returned)
 
     def __on_delivery_confirmation(self, method_frame):
         """
         Called when a message is confirmed or rejected by RabbitMQ.
 
-        :param pika.frame.Method method_frame: The Basic.Ack or Basic.Nack frame
+        :param pika.frame.Method method_frame: The Basic.Ack or Basic.Nack
+            frame
 
-        This method is a callback that is added to the channel using the
-        add_on_delivery_confirmation_callback method. When a message is confirmed
-        or rejected by RabbitMQ, this method is called with a
-        pika.frame.Method object as an argument. The method object
-        contains information about whether the message was confirmed or
-        rejected.
+        With multiple=True a single frame settles every outstanding delivery
+        tag up to and including method_frame.method.delivery_tag.
         """
         confirmation_type = method_frame.method.NAME.split('.')[1].lower()
-        if confirmation_type == 'ack':
-            LOGGER.debug("Message confirmed")
-            # Вызываем callback для закрытия соединения если есть
-            if self._close_callback:
-                self._connection._connection.ioloop.call_later(0.1, self._close_callback)
+        delivery_tag = method_frame.method.delivery_tag
+        if method_frame.method.multiple:
+            tags = [tag for tag in self._outstanding if tag <= delivery_tag]
         else:
-            LOGGER.warning("Message rejected")
+            tags = [delivery_tag] if delivery_tag in self._outstanding else []
 
-    def publish_holidays_task(self, api_params):
+        now = time.monotonic()
+        for tag in sorted(tags):
+            job = self._outstanding.pop(tag)
+            self._by_message_id.pop(job.message_id, None)
+            if confirmation_type == 'ack' and not job.returned:
+                latency = now - job.published_at
+                self._stats['confirmed'] += 1
+                self._stats['confirm_latency_total'] += latency
+                self._stats['confirm_latency_max'] = max(
+                    self._stats['confirm_latency_max'], latency)
+                LOGGER.debug("Message %s confirmed", tag)
+            else:
+                if confirmation_type != 'ack':
+                    self._stats['nacked'] += 1
+                    LOGGER.warning("Message %s rejected", tag)
+                self.__retry(job)
+
+        if tags:
+            self.__pump()
+
+    def __on_message_returned(self, _unused_channel, _unused_method,
+                              properties, _unused_body):
         """
-        Publish a holidays task.
+        Called when RabbitMQ returns an unroutable mandatory message.
 
-        :param dict api_params: Parameters for holidays API (country, year, month, day)
+        The broker still acks the message afterwards; the job is flagged so
+        that the ack is treated as a failure and the job is retried.
         """
-        channel = self._connection.channel
+        job = self._by_message_id.get(properties.message_id)
+        self._stats['returned'] += 1
+        LOGGER.warning('Message %s returned as unroutable',
+                       properties.message_id)
+        if job is not None:
+            job.returned = True
+
+    def __retry(self, job):
+        if job.attempts >= self._max_retries:
+            self._stats['failed'] += 1
+            LOGGER.error('Giving up on %s task with params %s after %s '
+                         'retries', job.api_alias, job.api_params,
+                         job.attempts)
+            return
+        self._stats['retried'] += 1
+        job.attempts += 1
+        job.returned = False
+        self._pending.appendleft(job)
+
+    def __pump(self):
+        """Publish pending jobs while the in-flight window has room."""
+        if self._channel is None or not self._channel.is_open:
+            return
+        while self._pending and len(self._outstanding) < self._max_in_flight:
+            self.__publish(self._pending.popleft())
+
+        if (self._started_at is not None and not self._pending
+                and not self._outstanding and not self._settled_notified):
+            self._settled_notified = True
+            LOGGER.info('All submitted tasks settled: %s', self.stats)
+            # Вызываем callback для закрытия соединения если есть
+            if self._close_callback:
+                self._connection.call_later(0.1, self._close_callback)
+
+    def __publish(self, job):
+        channel = self._channel
         properties = pika.BasicProperties(
-            app_id='holidays-publisher',
+            app_id=f'{job.api_alias}-publisher',
             content_type='application/json',
-            delivery_mode=2  # Make message persistent (durable)
+            delivery_mode=2,  # Make message persistent (durable)
+            message_id=job.message_id,
         )
 
         message = {
-            'api_alias': 'holidays',
-            'api_params': api_params
+            'api_alias': job.api_alias,
+            'api_params': job.api_params
         }
 
         channel.basic_publish(
             self.EXCHANGE,
-            self.ROUTING_KEY_FOR_HOLIDAYS,
+            self.ROUTING_KEYS[job.api_alias],
             json.dumps(message, ensure_ascii=False),
-            properties
+            properties,
+            mandatory=True,
         )
 
-        LOGGER.info('Published holidays task with params: %s', api_params)
+        self._delivery_tag += 1
+        job.published_at = time.monotonic()
+        self._outstanding[self._delivery_tag] = job
+        self._by_message_id[job.message_id] = job
+        self._stats['published'] += 1
 
-    def publish_weather_task(self, api_params):
+        LOGGER.info('Published %s task with params: %s',
+                    job.api_alias, job.api_params)
+
+    def submit(self, jobs):
         """
-        Publish a weather task.
+        Queue many jobs for publishing. Must be called on the IOLoop thread.
 
-        :param dict api_params: Parameters for weather API (query)
+        :param jobs: iterable of (api_alias, api_params) pairs
+        :raises ValueError: If an api_alias has no routing key
         """
-        channel = self._connection.channel
-        properties = pika.BasicProperties(
-            app_id='weather-publisher',
-            content_type='application/json',
-            delivery_mode=2  # Make message persistent (durable)
-        )
+        jobs = [_Job(api_alias, api_params) for api_alias, api_params in jobs]
+        for job in jobs:
+            if job.api_alias not in self.ROUTING_KEYS:
+                raise ValueError(f'Unknown API alias: {job.api_alias}')
+        if self._started_at is None:
+            self._started_at = time.monotonic()
+        self._settled_notified = False
+        self._pending.extend(jobs)
+        self._stats['submitted'] += len(jobs)
+        self.__pump()
 
-        message = {
-            'api_alias': 'weather',
-            'api_params': api_params
-        }
+    def submit_threadsafe(self, jobs):
+        """
+        Queue many jobs for publishing from a thread other than the IOLoop.
 
-        channel.basic_publish(
-            self.EXCHANGE,
-            self.ROUTING_KEY_FOR_WEATHER,
-            json.dumps(message, ensure_ascii=False),
-            properties
-        )
+        :param jobs: iterable of (api_alias, api_params) pairs
+        """
+        jobs = list(jobs)
+        self._connection.add_callback_threadsafe(lambda: self.submit(jobs))
+
+    @property
+    def stats(self):
+        """
+        Publishing statistics.
+
+        :return: dict with counters, confirm latency (seconds), publish
+            throughput (confirmed messages per second) and window usage
+        """
+        stats = dict(self._stats)
+        elapsed = (time.monotonic() - self._started_at
+                   if self._started_at else 0.0)
+        confirmed = stats['confirmed']
+        stats['confirm_latency_avg'] = (
+            stats['confirm_latency_total'] / confirmed if confirmed else 0.0)
+        stats['throughput'] = confirmed / elapsed if elapsed else 0.0
+        stats['in_flight'] = len(self._outstanding)
+        stats['pending'] = len(self._pending)
+        return stats
+
+    def publish_holidays_task(self, api_params):
+        """
+        Publish a holidays task.
 
-        LOGGER.info('Published weather task with params: %s', api_params)
+        :param dict api_params: Parameters for holidays API (country, year,
+            month, day)
+        """
+        self.submit([('holidays', api_params)])
 
+    def publish_weather_task(self, api_params):
+        """
+        Publish a weather task.
+
+        :param dict api_params: Parameters for weather API (query)
+        """
+        self.submit([('weather', api_params)])
@@ -0,0 +1,210 @@
+import logging
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+LOGGER = logging.getLogger(__name__)
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS buckets (
+    name TEXT PRIMARY KEY,
+    tokens REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+'''
+
+
+class RateLimited(Exception):
+    """The wait for a token is longer than the caller is willing to wait."""
+
+    def __init__(self, name, retry_after):
+        super().__init__(f'{name} is rate limited, retry in '
+                         f'{retry_after:.2f} s')
+        self.name = name
+        self.retry_after = retry_after
+
+
+def parse_limits(value):
+    """
+    Parse a limits string.
+
+    :param str value: 'name=rate:burst,...', e.g. 'holidays=1:1,weather=2:5'
+    :return: dict name -> (rate per second, burst)
+    :raises ValueError: If an entry is malformed
+    """
+    limits = {}
+    for item in filter(None, (part.strip() for part in value.split(','))):
+        name, _, spec = item.partition('=')
+        rate, _, burst = spec.partition(':')
+        limits[name.strip()] = (float(rate), float(burst or 1))
+    return limits
+
+
+class _Stats:
+    __slots__ = ('acquired', 'delayed', 'rejected', 'wait_total', 'wait_max')
+
+    def __init__(self):
+        self.acquired = 0
+        self.delayed = 0
+        self.rejected = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+
+class RateLimiter:
+    """
+    Token buckets shared by every process on the host.
+
+    Each upstream gets a bucket refilled at `rate` tokens per second up to
+    `burst`. Bucket state lives in a SQLite file, and every update runs
+    in a BEGIN IMMEDIATE transaction, so worker processes and consumer
+    threads draw from the same buckets. A caller that finds the bucket
+    empty reserves the next token (the bucket goes negative) and sleeps
+    until it is due, so waiting callers are served in order instead of
+    racing. If the wait would be longer than max_wait nothing is reserved
+    and RateLimited is raised, so the caller can reschedule the work.
+    """
+
+    def __init__(self, path, limits, max_wait=5.0):
+        """
+        Initialize the RateLimiter object.
+
+        :param str path: SQLite file holding the buckets
+        :param dict limits: name -> (rate per second, burst); names that
+            are not listed are not limited
+        :param float max_wait: Longest wait acquire() sleeps through
+        """
+        self._path = path
+        self._limits = limits
+        self._max_wait = max_wait
+        self._stats = {}
+        self._stats_lock = threading.Lock()
+        with self._db() as db:
+            db.executescript(SCHEMA)
+
+    @classmethod
+    def from_env(cls):
+        """
+        Build a limiter configured from RATE_LIMIT* env variables.
+
+        The buckets are not shared with the Celery worker, which runs in
+        its own pod: set RATE_LIMITS to this host's share of the upstream
+        limit (see docs/celery-demo.txt).
+        """
+        return cls(
+            path=os.getenv('RATE_LIMIT_DB', 'rate_limits.sqlite3'),
+            limits=parse_limits(os.getenv('RATE_LIMITS',
+                                          'holidays=1:1,weather=2:5')),
+            max_wait=float(os.getenv('RATE_LIMIT_MAX_WAIT', 5)),
+        )
+
+    @contextmanager
+    def _db(self):
+        db = sqlite3.connect(self._path, timeout=30, isolation_level=None)
+        try:
+            yield db
+        finally:
+            db.close()
+
+    def reserve(self, name, max_wait=None):
+        """
+        Take a token, possibly one that only becomes available later.
+
+        :param str name: Upstream name
+        :param float max_wait: Overrides the limiter's max_wait
+        :return: float seconds to wait before calling the upstream
+        :raises RateLimited: If the wait would exceed max_wait
+        """
+        if name not in self._limits:
+            return 0.0
+        rate, burst = self._limits[name]
+        max_wait = self._max_wait if max_wait is None else max_wait
+        with self._db() as db:
+            db.execute('BEGIN IMMEDIATE')
+            try:
+                now = time.time()
+                row = db.execute(
+                    'SELECT tokens, updated_at FROM buckets WHERE name = ?',
+                    (name,)).fetchone()
+                tokens = burst if row is None else min(
+                    burst, row[0] + max(0.0, now - row[1]) * rate)
+                wait = 0.0 if tokens >= 1 else (1 - tokens) / rate
+                if wait > max_wait:
+                    db.execute('ROLLBACK')
+                    raise RateLimited(name, wait)
+                db.execute(
+                    'INSERT OR REPLACE INTO buckets (name, tokens, '
+                    'updated_at) VALUES (?, ?, ?)', (name, tokens - 1, now))
+                db.execute('COMMIT')
+            except sqlite3.Error:
+                db.execute('ROLLBACK')
+                raise
+        return wait
+
+    def acquire(self, name, max_wait=None):
+        """
+        Block until a call to the upstream is allowed.
+
+        :param str name: Upstream name
+        :param float max_wait: Overrides the limiter's max_wait
+        :return: float seconds spent waiting
+        :raises RateLimited: If the wait would exceed max_wait
+        """
+        try:
+            wait = self.reserve(name, max_wait)
+        except RateLimited:
+            self._record(name, rejected=True)
+            raise
+        if wait > 0:
+            LOGGER.debug('Waiting %.3f s for a %s token', wait, name)
+            time.sleep(wait)
+        self._record(name, wait)
+        return wait
+
+    def _record(self, name, wait=0.0, rejected=False):
+        with self._stats_lock:
+            stats = self._stats.setdefault(name, _Stats())
+            if rejected:
+                stats.rejected += 1
+                return
+            stats.acquired += 1
+            if wait > 0:
+                stats.delayed += 1
+                stats.wait_total += wait
+                stats.wait_max = max(stats.wait_max, wait)
+
+    def stats(self):
+        """
+        Wait statistics of this process.
+
+        :return: dict name -> acquired, delayed, rejected and wait times
+        """
+        with self._stats_lock:
+            return {
+                name: {
+                    'acquired': stats.acquired,
+                    'delayed': stats.delayed,
+                    'rejected': stats.rejected,
+                    'wait_total': round(stats.wait_total, 3),
+                    'wait_avg': round(stats.wait_total / stats.acquired, 3)
+                    if stats.acquired else 0.0,
+                    'wait_max': round(stats.wait_max, 3),
+                }
+                for name, stats in self._stats.items()
+            }
+
+
+_limiter = None
+_limiter_lock = threading.Lock()
+
+
+def get_limiter():
+    """Return the process-wide RateLimiter, creating it on first use."""
+    global _limiter
+    if _limiter is None:
+        with _limiter_lock:
+            if _limiter is None:
+                _limiter = RateLimiter.from_env()
+    return _limiter
@@ -1,33 +1,60 @@
 from dotenv import load_dotenv
-import requests
+from http_client import get_client
+import logging
 import os
+import threading
+import time
+
+LOGGER = logging.getLogger(__name__)
 
 load_dotenv()
 
 
+class _CachedSecret:
+    def __init__(self, data, ttl):
+        self.data = data
+        self.fetched_at = time.monotonic()
+        self.expires_at = self.fetched_at + ttl
+        self.timer = None
+
+
 class VaultHelper:
     """
     A helper class for interacting with Hashicorp's Vault.
 
     This class provides methods for retrieving secrets from Vault.
+    Secrets are cached per path: an entry lives for the lease duration
+    reported by Vault (or VAULT_CACHE_TTL when the secret has no lease),
+    is refreshed in the background before it expires, concurrent misses
+    on the same path share one request, and if Vault is unreachable the
+    last known value is served for up to VAULT_MAX_STALE seconds.
     """
 
     def __init__(self):
         load_dotenv()
         self._vault_address = os.getenv('VAULT_ADDR', 'http://vault.localhost')
         self._vault_token = os.getenv('VAULT_TOKEN')
-        
+
         if not self._vault_token:
             raise ValueError("VAULT_TOKEN environment variable is not set")
 
+        self._cache_ttl = float(os.getenv('VAULT_CACHE_TTL', 300))
+        self._refresh_ahead = float(os.getenv('VAULT_REFRESH_AHEAD', 0.8))
+        self._max_stale = float(os.getenv('VAULT_MAX_STALE', 3600))
+        self._retry_delay = float(os.getenv('VAULT_RETRY_DELAY', 10))
+        self._cache = {}
+        self._path_locks = {}
+        self._lock = threading.Lock()
+        self._closed = False
+
     def __get_secrets(self, secret_path):
         """
         Get the secrets from Vault.
 
         :param secret_path: str
-        :return: dict
+        :return: tuple (dict with the secret data, lease duration in seconds)
         """
-        resp = requests.get(
+        resp = get_client().get(
             url=f'{self._vault_address}/v1/secrets/data/{secret_path}',
             headers={
                 "X-Vault-Token": self._vault_token
@@ -36,9 +63,106 @@ class VaultHelper:
 
         if resp.status_code != 200:
             raise Exception(f"Failed to get secrets from Vault: {resp.text}")
-        
+
         json_data = resp.json()
-        return json_data['data']['data']
+        return json_data['data']['data'], json_data.get('lease_duration') or 0
+
+    def __path_lock(self, secret_path):
+        with self._lock:
+            return self._path_locks.setdefault(secret_path, threading.Lock())
+
+    def __fresh_entry(self, secret_path):
+        entry = self._cache.get(secret_path)
+        if entry is not None and time.monotonic() < entry.expires_at:
+            return entry
+        return None
+
+    def __refresh(self, secret_path):
+        """
+        Fetch a secret from Vault, store it and schedule its refresh.
+
+        Must be called with the path lock held.
+
+        :param secret_path: str
+        :return: _CachedSecret
+        """
+        data, lease_duration = self.__get_secrets(secret_path)
+        ttl = lease_duration if lease_duration > 0 else self._cache_ttl
+        entry = _CachedSecret(data, ttl)
+        previous = self._cache.get(secret_path)
+        if previous is not None and previous.timer is not None:
+            previous.timer.cancel()
+        self._cache[secret_path] = entry
+        self.__schedule_refresh(secret_path, entry, ttl * self._refresh_ahead)
+        return entry
+
+    def __schedule_refresh(self, secret_path, entry, delay):
+        if self._closed:
+            return
+        entry.timer = threading.Timer(
+            delay, self.__background_refresh, args=(secret_path,))
+        entry.timer.daemon = True
+        entry.timer.start()
+
+    def __background_refresh(self, secret_path):
+        """Timer callback: refresh a secret before it expires."""
+        with self.__path_lock(secret_path):
+            try:
+                self.__refresh(secret_path)
+                LOGGER.debug('Refreshed Vault secret %s', secret_path)
+            except Exception as error:
+                LOGGER.warning('Background refresh of %s failed, retrying '
+                               'in %s s: %s', secret_path, self._retry_delay,
+                               error)
+                entry = self._cache.get(secret_path)
+                if entry is not None:
+                    self.__schedule_refresh(
+                        secret_path, entry, self._retry_delay)
+
+    def __get_cached(self, secret_path):
+        """
+        Get a secret from the cache, going to Vault on a miss.
+
+        :param secret_path: str
+        :return: dict
+        """
+        entry = self.__fresh_entry(secret_path)
+        if entry is not None:
+            return entry.data
+
+        with self.__path_lock(secret_path):
+            # Another thread may have fetched it while we were waiting
+            entry = self.__fresh_entry(secret_path)
+            if entry is not None:
+                return entry.data
+            try:
+                return self.__refresh(secret_path).data
+            except Exception:
+                stale = self._cache.get(secret_path)
+                if (stale is None or time.monotonic() - stale.fetched_at
+                        > self._max_stale):
+                    raise
+                LOGGER.warning('Vault unavailable, serving stale %s',
+                               secret_path, exc_info=True)
+                return stale.data
+
+    def invalidate(self, secret_path=None):
+        """
+        Drop cached secrets so the next call goes to Vault.
+
+        :param secret_path: str or None to drop everything
+        """
+        with self._lock:
+            paths = [secret_path] if secret_path else list(self._cache)
+            for path in paths:
+                entry = self._cache.pop(path, None)
+                if entry is not None and entry.timer is not None:
+                    entry.timer.cancel()
+
+    def close(self):
+        """Stop background refreshes."""
+        self._closed = True
+        self.invalidate()
 
     def get_api_key(self, alias):
         """
@@ -47,7 +171,7 @@ class VaultHelper:
         :param alias: str - 'holidays' or 'weather'
         :return: str
         """
-        secrets = self.__get_secrets(secret_path='api-keys')
+        secrets = self.__get_cached(secret_path='api-keys')
         key_name = f'{alias}_api_key'
         return secrets[key_name]
 
@@ -57,5 +181,4 @@ class VaultHelper:
 
         :return: dict with 'username' and 'password' keys
         """
-        return self.__get_secrets(secret_path='rabbitmq')
-
+        return self.__get_cached(secret_path='rabbitmq')